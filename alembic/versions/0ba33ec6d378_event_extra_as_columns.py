@@ -0,0 +1,107 @@
+"""Event extra as columns
+
+Revision ID: 0ba33ec6d378
+Revises: d8e3670601fb
+Create Date: 2026-10-18 16:02:48.907315
+
+"""
+
+import json
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0ba33ec6d378'
+down_revision = 'd8e3670601fb'
+branch_labels = None
+depends_on = None
+
+# Event.extra JSON key => new column.
+EXTRA_COLUMNS = {
+    'software_name': 'software_name',
+    'software_version': 'software_version',
+    'config': 'config_file_id',
+    'site_id': 'new_site_id',
+    'tenant_id': 'new_tenant_id',
+}
+
+event = sa.table(
+    'event',
+    sa.column('id', sa.Integer),
+    sa.column('extra', sa.Unicode),
+    *[sa.column(column, sa.Unicode) for column in EXTRA_COLUMNS.values()],
+)
+
+
+def upgrade():
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('software_name', sa.Unicode(), nullable=True))
+        batch_op.add_column(sa.Column('software_version', sa.Unicode(), nullable=True))
+        batch_op.add_column(sa.Column('config_file_id', sa.Unicode(), nullable=True))
+        batch_op.add_column(sa.Column('new_site_id', sa.Unicode(), nullable=True))
+        batch_op.add_column(sa.Column('new_tenant_id', sa.Unicode(), nullable=True))
+
+    connection = op.get_bind()
+    events = connection.execute(sa.select(event.c.id, event.c.extra).where(event.c.extra.is_not(None))).all()
+
+    values = []
+    for event_id, extra in events:
+        try:
+            extra = json.loads(extra)
+        except json.JSONDecodeError:
+            continue
+
+        if isinstance(extra, dict):
+            values.append({
+                'event_id': event_id,
+                **{column: extra.get(key) for key, column in EXTRA_COLUMNS.items()},
+            })
+
+    if values:
+        columns_values = {column: sa.bindparam(column) for column in EXTRA_COLUMNS.values()}
+        connection.execute(event.update().where(event.c.id == sa.bindparam('event_id')).values(columns_values), values)
+
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.drop_column('extra')
+        batch_op.create_index(batch_op.f('ix_event_config_file_id'), ['config_file_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_event_new_site_id'), ['new_site_id'], unique=False)
+        batch_op.create_index(
+            'ix_event_asset_id_software_name_created_at',
+            ['asset_id', 'software_name', 'created_at'],
+            unique=False,
+            postgresql_where=sa.text('software_name IS NOT NULL'),
+            sqlite_where=sa.text('software_name IS NOT NULL'),
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.drop_index('ix_event_asset_id_software_name_created_at')
+        batch_op.drop_index(batch_op.f('ix_event_new_site_id'))
+        batch_op.drop_index(batch_op.f('ix_event_config_file_id'))
+        batch_op.add_column(sa.Column('extra', sa.Unicode(), nullable=True))
+
+    connection = op.get_bind()
+    columns = [getattr(event.c, column) for column in EXTRA_COLUMNS.values()]
+    events = connection.execute(
+        sa.select(event.c.id, *columns).where(sa.or_(*[column.is_not(None) for column in columns]))
+    ).all()
+
+    values = []
+    for event_id, *extra_values in events:
+        extra = {key: value for key, value in zip(EXTRA_COLUMNS, extra_values) if value is not None}
+        values.append({'event_id': event_id, 'extra': json.dumps(extra)})
+
+    if values:
+        connection.execute(
+            event.update().where(event.c.id == sa.bindparam('event_id')).values(extra=sa.bindparam('extra')),
+            values,
+        )
+
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.drop_column('new_tenant_id')
+        batch_op.drop_column('new_site_id')
+        batch_op.drop_column('config_file_id')
+        batch_op.drop_column('software_version')
+        batch_op.drop_column('software_name')
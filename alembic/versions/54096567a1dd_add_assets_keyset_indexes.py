@@ -0,0 +1,34 @@
+"""Add assets keyset indexes
+
+Revision ID: 54096567a1dd
+Revises: b06495c51e07
+Create Date: 2026-10-18 17:12:40.208815
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '54096567a1dd'
+down_revision = 'b06495c51e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_asset_keyset_calibration_next',
+            [sa.text("coalesce(calibration_next, '0001-01-01')"), 'id'],
+            unique=False,
+        )
+        batch_op.create_index(
+            'ix_asset_keyset_customer_name', [sa.text("coalesce(customer_name, '')"), 'id'], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index('ix_asset_keyset_customer_name')
+        batch_op.drop_index('ix_asset_keyset_calibration_next')
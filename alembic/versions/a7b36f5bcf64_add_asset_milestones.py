@@ -0,0 +1,74 @@
+"""Add asset milestones
+
+Revision ID: a7b36f5bcf64
+Revises: 2280798107fc
+Create Date: 2026-10-18 10:12:41.274410
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a7b36f5bcf64'
+down_revision = '2280798107fc'
+branch_labels = None
+depends_on = None
+
+asset = sa.table(
+    'asset',
+    sa.column('id', sa.Integer),
+    sa.column('production', sa.Date),
+    sa.column('delivery', sa.Date),
+    sa.column('activation', sa.Date),
+    sa.column('calibration_date', sa.Date),
+)
+event = sa.table(
+    'event',
+    sa.column('asset_id', sa.Integer),
+    sa.column('date', sa.Date),
+    sa.column('removed', sa.Boolean),
+    sa.column('status_id', sa.Integer),
+)
+event_status = sa.table(
+    'event_status',
+    sa.column('id', sa.Integer),
+    sa.column('status_id', sa.Unicode),
+)
+
+
+def milestone(status_id, aggregate):
+    """Get the first/last date of a given status in the asset history."""
+    return sa.select(aggregate(event.c.date)) \
+        .select_from(event.join(event_status, event.c.status_id == event_status.c.id)) \
+        .where(
+            event.c.asset_id == asset.c.id,
+            ~event.c.removed,
+            event_status.c.status_id == status_id,
+        ) \
+        .scalar_subquery()
+
+
+def upgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('production', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('delivery', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('activation', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('calibration_date', sa.Date(), nullable=True))
+
+    op.execute(
+        asset.update().values(
+            production=milestone('stock_parsys', sa.func.min),
+            delivery=milestone('transit_customer', sa.func.min),
+            activation=milestone('service', sa.func.min),
+            calibration_date=milestone('calibration', sa.func.max),
+        )
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_column('calibration_date')
+        batch_op.drop_column('activation')
+        batch_op.drop_column('delivery')
+        batch_op.drop_column('production')
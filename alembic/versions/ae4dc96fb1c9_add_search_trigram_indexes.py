@@ -0,0 +1,53 @@
+"""Add search trigram indexes
+
+Revision ID: ae4dc96fb1c9
+Revises: 54096567a1dd
+Create Date: 2026-10-18 18:05:12.630417
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'ae4dc96fb1c9'
+down_revision = '54096567a1dd'
+branch_labels = None
+depends_on = None
+
+TRIGRAM_INDEXES = {
+    'asset': ['asset_id', 'current_location'],
+    'site': ['contact', 'email', 'name', 'phone', 'site_type'],
+    'tenant': ['name'],
+}
+
+
+def upgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_asset_site_id'), ['site_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_asset_tenant_id'), ['tenant_id'], unique=False)
+
+    if op.get_bind().engine.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, columns in TRIGRAM_INDEXES.items():
+        for column in columns:
+            op.create_index(
+                f'ix_{table}_{column}_trgm',
+                table,
+                [column],
+                unique=False,
+                postgresql_using='gin',
+                postgresql_ops={column: 'gin_trgm_ops'},
+            )
+
+
+def downgrade():
+    if op.get_bind().engine.name == 'postgresql':
+        for table, columns in TRIGRAM_INDEXES.items():
+            for column in columns:
+                op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
+
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_asset_tenant_id'))
+        batch_op.drop_index(batch_op.f('ix_asset_site_id'))
@@ -0,0 +1,35 @@
+"""Add config file
+
+Revision ID: b06495c51e07
+Revises: d02817a15df1
+Create Date: 2026-10-18 20:03:57.441209
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b06495c51e07'
+down_revision = 'd02817a15df1'
+branch_labels = None
+depends_on = None
+
+
+# noinspection PyTypeChecker
+def upgrade():
+    # Existing files are deduplicated by scripts/2026-10-18_deduplicate_configs.py.
+    op.create_table(
+        'config_file',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('config_hash', sa.Unicode(), nullable=False),
+        sa.Column('file_id', sa.Unicode(), nullable=False),
+        sa.Column('references', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_config_file')),
+        sa.UniqueConstraint('config_hash', name=op.f('uq_config_file_config_hash')),
+        sa.UniqueConstraint('file_id', name=op.f('uq_config_file_file_id')),
+    )
+
+
+def downgrade():
+    op.drop_table('config_file')
@@ -0,0 +1,74 @@
+"""Add asset software
+
+Revision ID: b4c52a76a9b9
+Revises: 0ba33ec6d378
+Create Date: 2026-10-18 17:24:11.630982
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from parsys_utilities.sql.model import TZDateTime
+
+# revision identifiers, used by Alembic.
+revision = 'b4c52a76a9b9'
+down_revision = '0ba33ec6d378'
+branch_labels = None
+depends_on = None
+
+event = sa.table(
+    'event',
+    sa.column('asset_id', sa.Integer),
+    sa.column('created_at', TZDateTime),
+    sa.column('date', sa.Date),
+    sa.column('removed', sa.Boolean),
+    sa.column('software_name', sa.Unicode),
+    sa.column('software_version', sa.Unicode),
+)
+
+
+# noinspection PyTypeChecker
+def upgrade():
+    asset_software = op.create_table(
+        'asset_software',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('asset_id', sa.Integer(), nullable=False),
+        sa.Column('product', sa.Unicode(), nullable=False),
+        sa.Column('version', sa.Unicode(), nullable=False),
+        sa.Column('last_seen_at', TZDateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['asset_id'], ['asset.id'], name=op.f('fk_asset_software_asset_id_asset')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_asset_software')),
+        sa.UniqueConstraint('asset_id', 'product', name=op.f('uq_asset_software_asset_id')),
+    )
+
+    # Latest software update of each asset/product, in the history order.
+    rank = sa.func.row_number().over(
+        partition_by=(event.c.asset_id, event.c.software_name),
+        order_by=(event.c.date.desc(), event.c.created_at.desc()),
+    )
+    software_updates = sa.select(
+        event.c.asset_id,
+        event.c.software_name,
+        event.c.software_version,
+        event.c.created_at,
+        rank.label('rank'),
+    )
+    software_updates = software_updates \
+        .where(~event.c.removed, event.c.software_name.is_not(None), event.c.software_version.is_not(None)) \
+        .subquery()
+
+    op.execute(
+        asset_software.insert().from_select(
+            ['asset_id', 'product', 'version', 'last_seen_at'],
+            sa.select(
+                software_updates.c.asset_id,
+                software_updates.c.software_name,
+                software_updates.c.software_version,
+                software_updates.c.created_at,
+            ).where(software_updates.c.rank == 1),
+        )
+    )
+
+
+def downgrade():
+    op.drop_table('asset_software')
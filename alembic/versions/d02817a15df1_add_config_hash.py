@@ -0,0 +1,35 @@
+"""Add config hash
+
+Revision ID: d02817a15df1
+Revises: b4c52a76a9b9
+Create Date: 2026-10-18 18:45:32.120674
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd02817a15df1'
+down_revision = 'b4c52a76a9b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Hashes are computed from the depot files by scripts/2026-10-18_hash_configs.py.
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('config_hash', sa.Unicode(), nullable=True))
+
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('config_hash', sa.Unicode(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_event_config_hash'), ['config_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_event_config_hash'))
+        batch_op.drop_column('config_hash')
+
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_column('config_hash')
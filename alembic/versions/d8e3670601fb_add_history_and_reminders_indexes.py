@@ -0,0 +1,46 @@
+"""Add history and reminders indexes
+
+Revision ID: d8e3670601fb
+Revises: a7b36f5bcf64
+Create Date: 2026-10-18 14:37:05.518223
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd8e3670601fb'
+down_revision = 'a7b36f5bcf64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_asset_calibration_next'), ['calibration_next'], unique=False)
+        batch_op.create_index(batch_op.f('ix_asset_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('consumable', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_consumable_expiration_date'), ['expiration_date'], unique=False)
+
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_event_asset_id_date_created_at',
+            ['asset_id', 'date', 'created_at'],
+            unique=False,
+            postgresql_where=sa.text('NOT removed'),
+            sqlite_where=sa.text('NOT removed'),
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.drop_index('ix_event_asset_id_date_created_at')
+
+    with op.batch_alter_table('consumable', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_consumable_expiration_date'))
+
+    with op.batch_alter_table('asset', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_asset_user_id'))
+        batch_op.drop_index(batch_op.f('ix_asset_calibration_next'))
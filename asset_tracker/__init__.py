@@ -25,6 +25,7 @@ from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 
 from asset_tracker.config import DEFAULT_CONFIG, MANDATORY_CONFIG, update_configuration
 from asset_tracker.constants import ASSET_TRACKER_VERSION, LOCALES_PATH
+from asset_tracker.statuses import STATUSES_RELOAD_INTERVAL, StatusesRegistry, get_status
 
 
 def main(global_config, **settings):
@@ -35,9 +36,13 @@ def main(global_config, **settings):
         if not settings.get(app_config):
             technical_logger.critical(f'***CRITICAL: Missing mandatory {app_config}.***')
 
+    # Statuses are loaded once per process, when the configuration is updated.
+    reload_interval = settings.get('asset_tracker.statuses_reload_interval', STATUSES_RELOAD_INTERVAL)
+    statuses = StatusesRegistry(int(reload_interval))
+
     # During tests, the app is created BEFORE the db, so we can't do this.
     if not settings.get('asset_tracker.tests.disable_configuration', False):
-        update_configuration(settings)
+        update_configuration(settings, statuses)
 
     settings['tm.activate_hook'] = activate_hook
     # noinspection PyShadowingNames
@@ -48,6 +53,7 @@ def main(global_config, **settings):
 
     config_file = global_config['__file__']
     config.registry.tenant_config = TenantConfigurator(config_file, defaults=DEFAULT_CONFIG)
+    config.registry.statuses = statuses
 
     config.include('pyramid_jinja2')
     jinja2_settings = {
@@ -93,6 +99,9 @@ def main(global_config, **settings):
     # Add user, authenticated or not.
     config.add_request_method(get_user, 'user', reify=True)
 
+    # Add statuses lookup.
+    config.add_request_method(get_status, 'get_status')
+
     # Add notifier.
     notifier = partial(
         Notifier,
@@ -129,6 +138,8 @@ def main(global_config, **settings):
 
     # Add app routes.
     config.include('asset_tracker.models')
+    config.include('asset_tracker.cache')
+    config.include('asset_tracker.configs')
     config.include('asset_tracker.api', route_prefix='api')
     config.include('asset_tracker.views')
     config.scan(ignore='asset_tracker.tests')
@@ -1,24 +1,40 @@
+import hashlib
+import re
 from datetime import date
-from json import JSONDecodeError
+from json import JSONDecodeError, dumps
 
+from dateutil.relativedelta import relativedelta
 from parsys_utilities.security.authorization import authenticate_rta
 from pyramid.httpexceptions import HTTPBadRequest, HTTPOk
 from pyramid.security import Allow, Everyone
 from pyramid.view import view_config
 from sentry_sdk import capture_exception, capture_message
+from sqlalchemy import desc, select, update
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased, joinedload
+from zope.sqlalchemy import mark_changed
 
 from asset_tracker import models
+from asset_tracker.models import get_insert
+from asset_tracker.cache import mark_counts_changed, mark_datatables_changed
 from asset_tracker.constants import CALIBRATION_FREQUENCIES_YEARS
 from asset_tracker.views.assets import Assets as AssetView
 
+# Maximum number of stations in a sites lookup: RTA ids are sent in the query string by GET (URLs must stay short),
+# in the body by POST.
+SITES_LOOKUP_GET_MAX = 200
+SITES_LOOKUP_POST_MAX = 1000
+
+# Mandatory fields of the stations sent by RTA.
+ASSET_INFO = {'creatorAlias', 'creatorID', 'login', 'tenantID', 'tenantName', 'tenantType', 'userID'}
+
 
 class Assets:
     def __acl__(self):
         # Authenticate RTA using HTTP Basic Auth.
         if authenticate_rta(self.request):
             return [
+                (Allow, None, Everyone, 'api-assets-create'),
                 (Allow, None, Everyone, 'api-assets-site'),
             ]
         else:
@@ -70,7 +86,7 @@ class Assets:
             calibration_frequency = CALIBRATION_FREQUENCIES_YEARS['default']
 
         # New asset.
-        stock_parsys = self.request.db_session.query(models.EventStatus).filter_by(status_id='stock_parsys').one()
+        stock_parsys = self.request.get_status('stock_parsys')
         asset = models.Asset(
             asset_type='station',
             asset_id=json['login'],
@@ -105,7 +121,7 @@ class Assets:
                 creator_id=json['creatorID'],
                 creator_alias=json['creatorAlias'],
                 date=date.today(),
-                status=self.request.db_session.query(models.EventStatus).filter_by(status_id='site_change').one(),
+                status=self.request.get_status('site_change'),
             )
             asset.add_event(event)
             self.request.db_session.add(event)
@@ -129,9 +145,8 @@ class Assets:
             capture_exception(error)
             raise HTTPBadRequest()
 
-        asset_info = {'creatorAlias', 'creatorID', 'login', 'tenantID', 'tenantName', 'tenantType', 'userID'}
         # Validate data.
-        if any(not json.get(field) for field in asset_info):
+        if any(not json.get(field) for field in ASSET_INFO):
             self.request.logger_technical.info('Asset linking: missing values.')
             capture_message('Asset linking: missing values.')
             raise HTTPBadRequest()
@@ -148,12 +163,317 @@ class Assets:
         else:
             return HTTPOk()
 
+    def link_assets(self, stations):
+        """Create/Update several assets based on information from RTA, with the same rules as link_asset, but with
+        set-based queries: tenants and assets are loaded with IN queries, then inserted/updated and their events
+        inserted in bulk.
+
+        Args:
+            stations (list): RTA stations (dict).
+
+        Returns:
+            list: result of each station (created, updated, already_linked, duplicate, invalid or error).
+        """
+        db_session = self.request.db_session
+        insert = get_insert(db_session)
+        today = date.today()
+
+        results = [None] * len(stations)
+        valid_indexes = []
+        users_ids = set()
+        logins = set()
+        for index, station in enumerate(stations):
+            if not isinstance(station, dict) or any(not station.get(field) for field in ASSET_INFO):
+                results[index] = 'invalid'
+            # The login is the asset_id: two stations can't have the same one.
+            elif station['userID'] in users_ids or station['login'] in logins:
+                results[index] = 'duplicate'
+            else:
+                users_ids.add(station['userID'])
+                logins.add(station['login'])
+                valid_indexes.append(index)
+
+        if not valid_indexes:
+            return self.format_link_results(stations, results)
+
+        # Core statements below aren't seen by the session events.
+        mark_datatables_changed(db_session)
+
+        # Tenants upsert.
+        tenants = {stations[index]['tenantID']: stations[index]['tenantName'] for index in valid_indexes}
+        statement = insert(models.Tenant).values(
+            [{'tenant_id': tenant_id, 'name': name} for tenant_id, name in tenants.items()]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['tenant_id'], set_={'name': statement.excluded.name}
+        )
+        tenants_pks = {
+            tenant.tenant_id: tenant.id
+            for tenant in db_session.execute(statement.returning(models.Tenant.id, models.Tenant.tenant_id))
+        }
+
+        # Assets found by user_id (RTA id) or login, only the needed columns. Tenants are identified by their public id.
+        site_tenant = aliased(models.Tenant)
+        assets = db_session.query(
+            models.Asset.id, models.Asset.user_id, models.Asset.site_id,
+            models.Tenant.tenant_id.label('tenant_public_id'), site_tenant.tenant_id.label('site_tenant_public_id'),
+        ) \
+            .join(models.Asset.tenant) \
+            .outerjoin(models.Asset.site) \
+            .outerjoin(site_tenant, models.Site.tenant_id == site_tenant.id) \
+            .filter(models.Asset.user_id.in_(users_ids | logins))
+        assets = {asset.user_id: asset for asset in assets}
+
+        # Owners of the logins, an asset can't be renamed to the asset_id of another asset.
+        assets_ids = db_session.query(models.Asset.asset_id, models.Asset.id).filter(models.Asset.asset_id.in_(logins))
+        assets_ids = {asset.asset_id: asset.id for asset in assets_ids}
+
+        assets_updates = []
+        events = []
+        new_assets = {}
+        site_change = self.request.get_status('site_change')
+        for index in valid_indexes:
+            station = stations[index]
+            not_test = station['tenantType'] != 'Test'
+
+            # If the asset exists in both the Asset Tracker and RTA.
+            asset = assets.get(station['userID'])
+            if asset and assets_ids.get(station['login'], asset.id) != asset.id:
+                capture_message(f'Asset linking: asset {station["login"]} already exists.')
+                results[index] = 'error'
+
+            elif asset:
+                asset_update = {
+                    'id': asset.id,
+                    'asset_id': station['login'],
+                    'site_id': asset.site_id,
+                    'tenant_id': tenants_pks[station['tenantID']],
+                    'user_id': station['userID'],
+                }
+                if asset.tenant_public_id != station['tenantID'] and not_test:
+                    events.append(self.get_link_event(asset.id, station, site_change, today))
+
+                # Allow returning to the original asset site from a test tenant.
+                if asset.site_id and asset.site_tenant_public_id != station['tenantID'] and not_test:
+                    asset_update['site_id'] = None
+
+                assets_updates.append(asset_update)
+                results[index] = 'updated'
+
+            # If the asset only exists in the Asset Tracker, it is already linked.
+            elif station['login'] in assets:
+                asset = assets[station['login']]
+                capture_message(
+                    f'Trying to link asset {asset.id} which is already linked: {asset.user_id}/{station["userID"]}.'
+                )
+                results[index] = 'already_linked'
+
+            else:
+                new_assets[index] = station
+
+        if assets_updates:
+            db_session.execute(update(models.Asset), assets_updates)
+
+        if new_assets:
+            config = self.request.registry.settings.get('asset_tracker.config', 'parsys')
+            if config == 'marlink':
+                calibration_frequency = CALIBRATION_FREQUENCIES_YEARS['marlink']
+            else:
+                calibration_frequency = CALIBRATION_FREQUENCIES_YEARS['default']
+
+            # New assets, with the same status and dates as after their first event (see AssetView).
+            stock_parsys = self.request.get_status('stock_parsys')
+            statement = insert(models.Asset) \
+                .on_conflict_do_nothing(index_elements=['asset_id']) \
+                .returning(models.Asset.id, models.Asset.asset_id)
+            created = db_session.execute(statement, [
+                {
+                    'asset_type': 'station',
+                    'asset_id': station['login'],
+                    'calibration_frequency': calibration_frequency,
+                    'calibration_next': today + relativedelta(years=calibration_frequency),
+                    'production': today,
+                    'status_id': stock_parsys.id,
+                    'tenant_id': tenants_pks[station['tenantID']],
+                    'user_id': station['userID'],
+                }
+                for station in new_assets.values()
+            ])
+            created = {asset.asset_id: asset.id for asset in created}
+            if created:
+                mark_counts_changed(db_session, models.Asset.__tablename__)
+
+            for index, station in new_assets.items():
+                asset_pk = created.get(station['login'])
+                if asset_pk:
+                    events.append(self.get_link_event(asset_pk, station, stock_parsys, today))
+                    results[index] = 'created'
+                else:
+                    # Same asset_id as an asset not linked to this station.
+                    capture_message(f'Asset linking: asset {station["login"]} already exists.')
+                    results[index] = 'error'
+
+        if events:
+            db_session.execute(models.Event.__table__.insert(), events)
+
+            # Asset status: last event which isn't a config event, like Asset.add_event.
+            changed_assets = [event['asset_id'] for event in events if event['status_id'] == site_change.id]
+            if changed_assets:
+                last_status = select(models.Event.status_id) \
+                    .join(models.Event.status) \
+                    .where(
+                        models.Event.asset_id == models.Asset.id,
+                        ~models.Event.removed,
+                        models.EventStatus.status_type != 'config',
+                    ) \
+                    .order_by(desc(models.Event.date), desc(models.Event.created_at)) \
+                    .limit(1) \
+                    .scalar_subquery()
+                db_session.execute(
+                    update(models.Asset).where(models.Asset.id.in_(changed_assets)).values(status_id=last_status),
+                    execution_options={'synchronize_session': False},
+                )
+
+        mark_changed(db_session)
+        return self.format_link_results(stations, results)
+
+    @staticmethod
+    def get_link_event(asset_pk, station, status, event_date):
+        """Get the values of an event created by RTA linking.
+
+        Args:
+            asset_pk (int): asset primary key.
+            station (dict): RTA station.
+            status (asset_tracker.models.EventStatus).
+            event_date (datetime.date).
+
+        Returns:
+            dict.
+        """
+        return {
+            'asset_id': asset_pk,
+            'creator_id': station['creatorID'],
+            'creator_alias': station['creatorAlias'],
+            'date': event_date,
+            'status_id': status.id,
+        }
+
+    @staticmethod
+    def format_link_results(stations, results):
+        """Associate the linking results with the stations RTA ids.
+
+        Args:
+            stations (list).
+            results (list).
+
+        Returns:
+            list: dicts (userID, result).
+        """
+        return [
+            {'userID': station.get('userID') if isinstance(station, dict) else None, 'result': result}
+            for station, result in zip(stations, results)
+        ]
+
+    @view_config(route_name='api-assets-link', request_method='POST', permission='api-assets-create',
+                 require_csrf=False, renderer='json')
+    def rta_bulk_link_post(self):
+        """Link several Stations (RTA) and Assets (AssetTracker) at once, for RTA resyncs.
+
+        Body (json): list of stations, same format as the /api/assets/ POST.
+
+        Returns:
+            list: result of each station (userID, result), in the same order.
+        """
+        try:
+            stations = self.request.json
+        except JSONDecodeError as error:
+            self.request.logger_technical.info('Asset linking: invalid JSON.')
+            capture_exception(error)
+            raise HTTPBadRequest()
+
+        if not isinstance(stations, list):
+            capture_message('Asset linking: stations list expected.')
+            raise HTTPBadRequest()
+
+        try:
+            return self.link_assets(stations)
+
+        except SQLAlchemyError as error:
+            self.request.logger_technical.info('Asset linking: db error.')
+            capture_exception(error)
+            raise HTTPBadRequest()
+
     @view_config(route_name='api-assets-site', request_method='GET', permission='api-assets-site', renderer='json')
     def site_id_get(self):
         user_id = self.request.matchdict.get('user_id')
         asset = self.request.db_session.query(models.Asset).filter_by(user_id=user_id).first()
         return {'site_id': asset.site.site_id if asset and asset.site else None}
 
+    def get_sites_ids(self, users_ids, lookup_max):
+        """Get the sites of several stations.
+
+        Args:
+            users_ids (list): RTA ids of the stations.
+            lookup_max (int): maximum number of stations.
+
+        Returns:
+            dict: user_id => site_id (None if the asset is unknown or has no site).
+        """
+        if not users_ids or len(users_ids) > lookup_max \
+                or any(not isinstance(user_id, str) or not re.fullmatch(r'\w{8}', user_id) for user_id in users_ids):
+            raise HTTPBadRequest(json={'error': 'Invalid user_id.'})
+
+        sites = dict.fromkeys(users_ids)
+        assets = self.request.db_session.query(models.Asset.user_id, models.Site.site_id) \
+            .outerjoin(models.Asset.site) \
+            .filter(models.Asset.user_id.in_(sites))
+        sites.update((asset.user_id, asset.site_id) for asset in assets)
+        return sites
+
+    @view_config(route_name='api-assets-sites', request_method='GET', permission='api-assets-site', renderer='json')
+    def sites_ids_get(self):
+        """Get the sites of several stations at once.
+
+        Query string:
+            user_id (mandatory, multiple): RTA ids of the stations.
+
+        Returns:
+            dict: user_id => site_id (None if the asset is unknown or has no site).
+        """
+        sites = self.get_sites_ids(self.request.GET.getall('user_id'), SITES_LOOKUP_GET_MAX)
+
+        # RTA can send the ETag back, the sites don't change often. The sites are queried anyway: a 304 only saves
+        # bandwidth.
+        response = self.request.response
+        etag_source = dumps(sites, sort_keys=True)
+        response.etag = hashlib.sha256(etag_source.encode()).hexdigest()
+        response.cache_control = 'no-cache'
+        response.conditional_response = True
+        return sites
+
+    @view_config(route_name='api-assets-sites', request_method='POST', permission='api-assets-site',
+                 require_csrf=False, renderer='json')
+    def sites_ids_post(self):
+        """Get the sites of many stations at once, for the lookups too big for a query string.
+
+        Body (json): list of RTA ids of the stations.
+
+        Returns:
+            dict: user_id => site_id (None if the asset is unknown or has no site).
+        """
+        try:
+            users_ids = self.request.json
+        except JSONDecodeError as error:
+            capture_exception(error)
+            raise HTTPBadRequest(json={'error': 'Invalid JSON.'})
+
+        if not isinstance(users_ids, list):
+            raise HTTPBadRequest(json={'error': 'Invalid user_id.'})
+
+        return self.get_sites_ids(users_ids, SITES_LOOKUP_POST_MAX)
+
 
 def includeme(config):
+    config.add_route(pattern='assets/link/', name='api-assets-link', factory=Assets)
+    config.add_route(pattern='assets/sites/', name='api-assets-sites', factory=Assets)
     config.add_route(pattern=r'assets/{user_id:\w{8}}/site/', name='api-assets-site', factory=Assets)
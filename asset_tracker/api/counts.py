@@ -0,0 +1,125 @@
+"""Records counts of the dataTables lists.
+
+Counts often cost more than the page itself:
+- the unfiltered total of a list only changes when rows are inserted or deleted, it is cached in Redis (invalidated by
+  the session events, see cache.includeme);
+- above asset_tracker.count_estimate_threshold rows, the PostgreSQL planner estimate is used instead of an exact count
+  (dataTables then shows an approximate number of pages);
+- with asset_tracker.concurrent_counts, the filtered count runs in another connection while the page is queried.
+  Each process runs at most COUNTS_WORKERS concurrent counts, each holding a connection of the engine pool (which must
+  be sized for it); when they are all busy, the count runs in the request instead of waiting for a worker.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from pyramid.settings import asbool
+from sentry_sdk import capture_exception
+from sqlalchemy.orm import Session
+
+from asset_tracker.cache import get_count_key, get_redis
+from asset_tracker.constants import COUNTS_CACHE
+
+# Shared by the requests of the process.
+COUNTS_WORKERS = 4
+COUNTS_EXECUTOR = ThreadPoolExecutor(max_workers=COUNTS_WORKERS, thread_name_prefix='counts')
+# Free workers: counts are never queued in the executor.
+COUNTS_SLOTS = threading.BoundedSemaphore(COUNTS_WORKERS)
+
+
+class ListCounts:
+    """Count strategy of a list, its total is cached by name of the listed table."""
+
+    def __init__(self, request, table):
+        self.request = request
+        self.table = table
+
+        settings = request.registry.settings
+        self.estimate_threshold = int(settings.get('asset_tracker.count_estimate_threshold') or 0)
+        self.concurrent = asbool(settings.get('asset_tracker.concurrent_counts'))
+
+    def estimate(self, query):
+        """Get the planner estimate of the number of rows of a query.
+
+        Args:
+            query (sqlalchemy.orm.query.Query).
+
+        Returns:
+            int: None if estimates are disabled or not supported by the db.
+        """
+        connection = query.session.connection()
+        if not self.estimate_threshold or connection.dialect.name != 'postgresql':
+            return None
+
+        compiled = query.order_by(None).statement.compile(dialect=connection.dialect)
+        explain = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params)
+        return int(explain.scalar()[0]['Plan']['Plan Rows'])
+
+    def count(self, query):
+        """Count the rows of a query, estimated above the threshold.
+
+        Args:
+            query (sqlalchemy.orm.query.Query).
+
+        Returns:
+            int.
+        """
+        estimate = self.estimate(query)
+        if estimate is not None and estimate >= self.estimate_threshold:
+            return estimate
+
+        return query.order_by(None).count()
+
+    def total(self, query):
+        """Count the rows of the unfiltered list, cached.
+
+        Args:
+            query (sqlalchemy.orm.query.Query).
+
+        Returns:
+            int.
+        """
+        key = get_count_key(self.table)
+        try:
+            cached = get_redis(self.request.registry).get(key)
+        except redis.RedisError as error:
+            capture_exception(error)
+            return self.count(query)
+
+        if cached is not None:
+            return int(cached)
+
+        total = self.count(query)
+        try:
+            get_redis(self.request.registry).set(key, total, ex=COUNTS_CACHE)
+        except redis.RedisError as error:
+            capture_exception(error)
+
+        return total
+
+    def filtered(self, query):
+        """Start counting the rows of the filtered list.
+
+        Args:
+            query (sqlalchemy.orm.query.Query).
+
+        Returns:
+            function: returns the count (waits for it if it runs concurrently).
+        """
+        if not self.concurrent or not COUNTS_SLOTS.acquire(blocking=False):
+            count = self.count(query)
+            return lambda: count
+
+        # Sessions can't be shared between threads: the count has its own session (and connection).
+        engine = self.request.db_session.get_bind()
+
+        def count_in_session():
+            try:
+                with Session(bind=engine) as session:
+                    return self.count(query.with_session(session))
+            finally:
+                COUNTS_SLOTS.release()
+
+        future = COUNTS_EXECUTOR.submit(count_in_session)
+        return future.result
@@ -1,19 +1,30 @@
 """Asset tracker datatables API."""
 
+import hashlib
+import json
+
+import redis
 from parsys_utilities import ADMIN_PRINCIPAL
 from parsys_utilities.api import DataTablesAPI, manage_datatables_queries
 from parsys_utilities.dates import format_date
+from parsys_utilities.security import Right
 from parsys_utilities.security.authorization import authenticate_rta, get_tenantless_principals
-from parsys_utilities.sql import sql_search, table_from_dict
+from parsys_utilities.sql import sql_search
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.security import Allow, Everyone
 from pyramid.settings import asbool
 from pyramid.view import view_config
 from sentry_sdk import capture_exception, capture_message
-from sqlalchemy import Unicode as String, cast
+from sqlalchemy import Integer, Unicode as String, func, literal, literal_column, select, union_all
 
 from asset_tracker import models
 from asset_tracker.api.assets import Assets as AssetsAPI
+from asset_tracker.api.counts import ListCounts
+from asset_tracker.api.keyset import get_datatables_parameters, keyset_search
+from asset_tracker.cache import get_datatables_key, get_redis
+
+# Replaced by the asset primary key in the link of each row, see Assets.get_link_template.
+ASSET_PK_PLACEHOLDER = '0'
 
 
 class Assets:
@@ -37,12 +48,18 @@ class Assets:
 
     @view_config(route_name='api-assets', request_method='GET', permission='assets-list', renderer='json')
     def list_get(self):
-        """List assets and format output according to dataTables requirements."""
+        """List assets and format output according to dataTables requirements. Only the keyset path is a single
+        projected query: sql_search (parsys_utilities) returns ORM entities, their output columns are then queried by
+        id.
+        """
         # Return if API is called by somebody other than dataTables.
         if not asbool(self.request.GET.get('datatables')):
             capture_message('Invalid API call.')
             return []
 
+        if asbool(self.request.GET.get('keyset')):
+            return self.keyset_list_get()
+
         try:
             search_parameters = manage_datatables_queries(self.request.GET)
             draw = search_parameters.pop('draw')
@@ -50,17 +67,11 @@ class Assets:
             capture_exception(error)
             raise HTTPBadRequest()
 
-        config = self.request.registry.settings.get('asset_tracker.config', 'parsys')
-        statuses_dict = [
-            {
-                'id': str(status.id),
-                'label': self.request.localizer.translate(status.label(config)),
-                'status_id': status.status_id,
-            }
-            for status in self.request.db_session.query(models.EventStatus)
-        ]
-        # Simulate the assets statuses as a table with translated labels so that we can filter/sort on status.
-        statuses = table_from_dict('status', statuses_dict)
+        cache_key, cached_output = self.get_cached_output({'keyset': False, **search_parameters})
+        if cached_output is not None:
+            return {**cached_output, 'draw': draw}
+
+        statuses = self.get_statuses_table(self.get_status_labels())
 
         full_text_search_attributes = [
             models.Asset.asset_id,
@@ -69,9 +80,8 @@ class Assets:
             models.Tenant.name,
         ]
 
-        # tables_from_dict makes all columns as strings.
         joined_tables = [
-            (models.Asset, statuses, statuses.c.id == cast(models.Asset.status_id, String)),
+            (models.Asset, statuses, statuses.c.id == models.Asset.status_id),
             models.Asset.site,
             models.Asset.tenant,
         ]
@@ -97,36 +107,219 @@ class Assets:
             capture_exception(error)
             raise HTTPBadRequest()
 
-        # Format db return for dataTables.
-        assets = []
-        for asset in output['items']:
-            c_next = asset.calibration_next
-            asset_output = {
-                'asset_id': asset.asset_id,
-                'calibration_next': format_date(c_next, self.request.locale_name),
-                'customer_name': asset.customer_name,
-                'id': asset.id,
-                'is_active': not asset.is_decommissioned,
-                'site': asset.site.name if asset.site else None,
-                'status': asset.status.status_id,
-                'status_label': self.request.localizer.translate(asset.status.label(config)),
-                'tenant_name': asset.tenant.name,
-            }
-
-            # Append link to output if the user is an admin or has the right to read the asset info.
-            has_read_rights = 'assets-read' in get_tenantless_principals(self.request.effective_principals)
-            if self.request.user.is_admin or has_read_rights:
-                link = self.request.route_path('assets-update', asset_id=asset.id)
-                asset_output['links'] = [{'rel': 'self', 'href': link}]
-
-            assets.append(asset_output)
+        # sql_search returns entities, their output columns are queried at once instead of lazy loading each
+        # relationship.
+        assets_ids = [asset.id for asset in output['items']]
+        rows = self.get_rows_query(statuses).filter(models.Asset.id.in_(assets_ids))
+        rows_by_id = {row.id: row for row in rows}
+        link_template = self.get_link_template()
 
-        return {
-            'data': assets,
-            'draw': draw,
+        output = {
+            'data': [self.format_asset(rows_by_id[asset_id], link_template) for asset_id in assets_ids],
             'recordsFiltered': output['recordsFiltered'],
             'recordsTotal': output['recordsTotal'],
         }
+        self.set_cached_output(cache_key, output)
+        return {**output, 'draw': draw}
+
+    def keyset_list_get(self):
+        """List assets with keyset pagination, see api.keyset."""
+        statuses = self.get_statuses_table(self.get_status_labels())
+
+        sort_columns = {
+            'asset_id': models.Asset.asset_id,
+            'tenant_name': models.Tenant.name,
+            'customer_name': func.coalesce(models.Asset.customer_name, literal_column("''")),
+            'site': func.coalesce(models.Site.name, literal_column("''")),
+            # Same expression as the ix_asset_keyset_calibration_next index.
+            'calibration_next': func.coalesce(models.Asset.calibration_next, literal_column("'0001-01-01'")),
+            'status_label': statuses.c.label,
+        }
+
+        try:
+            parameters = get_datatables_parameters(self.request.GET, sort_columns)
+        except (KeyError, TypeError, ValueError) as error:
+            capture_exception(error)
+            raise HTTPBadRequest()
+
+        cache_key, cached_output = self.get_cached_output({**parameters, 'draw': None, 'keyset': True})
+        if cached_output is not None:
+            return {**cached_output, 'draw': parameters['draw']}
+
+        output = keyset_search(
+            self.get_rows_query(statuses),
+            models.Asset.id,
+            sort_columns,
+            search_attributes=[
+                models.Asset.asset_id,
+                models.Asset.current_location,
+                models.Site.name,
+                models.Tenant.name,
+            ],
+            filter_attributes={'status': statuses.c.status_id},
+            parameters=parameters,
+            counts=ListCounts(self.request, models.Asset.__tablename__),
+        )
+
+        link_template = self.get_link_template()
+
+        output = {
+            'cursors': output['cursors'],
+            'data': [self.format_asset(row, link_template) for row in output['items']],
+            'recordsFiltered': output['recordsFiltered'],
+            'recordsTotal': output['recordsTotal'],
+        }
+        self.set_cached_output(cache_key, output)
+        return {**output, 'draw': parameters['draw']}
+
+    def get_cached_output(self, parameters):
+        """Get a list output from the response cache (opt-in: asset_tracker.datatables_cache is its duration in
+        seconds). The output depends on the query, the locale and the user rights, not on the user.
+        The cache hit or miss is reported in the X-Cache header.
+
+        Args:
+            parameters (dict): normalized dataTables parameters, without draw.
+
+        Returns:
+            tuple: cache key (None if the cache is disabled or unavailable), cached output (None if not cached).
+        """
+        if not int(self.request.registry.settings.get('asset_tracker.datatables_cache') or 0):
+            return None, None
+
+        principals = sorted(
+            f'{principal.tenant}:{principal.name}' if isinstance(principal, Right) else principal
+            for principal in self.request.effective_principals
+            if isinstance(principal, Right) or principal == ADMIN_PRINCIPAL
+        )
+        query = json.dumps(
+            {'locale': self.request.locale_name, 'parameters': parameters, 'principals': principals},
+            default=str,
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+        try:
+            client = get_redis(self.request.registry)
+            cache_key = get_datatables_key(client, 'assets', digest)
+            cached_output = client.get(cache_key)
+        except redis.RedisError as error:
+            capture_exception(error)
+            return None, None
+
+        self.request.response.headers['X-Cache'] = 'HIT' if cached_output else 'MISS'
+        return cache_key, json.loads(cached_output) if cached_output else None
+
+    def set_cached_output(self, cache_key, output):
+        """Cache a list output, see get_cached_output.
+
+        Args:
+            cache_key (str): None if the cache is disabled or unavailable.
+            output (dict): without draw.
+        """
+        if not cache_key:
+            return
+
+        duration = int(self.request.registry.settings['asset_tracker.datatables_cache'])
+        try:
+            get_redis(self.request.registry).set(cache_key, json.dumps(output), ex=duration)
+        except redis.RedisError as error:
+            capture_exception(error)
+
+    def get_status_labels(self):
+        """Get the translated statuses labels of the request locale, cached by the statuses registry.
+
+        Returns:
+            dict: status primary key => (status_id, translated label).
+        """
+        config = self.request.registry.settings.get('asset_tracker.config', 'parsys')
+        return self.request.registry.statuses.get_labels(self.request.db_session, self.request.localizer, config)
+
+    @staticmethod
+    def get_statuses_table(status_labels):
+        """Simulate the assets statuses as a table with translated labels so that we can filter/sort on status. The id
+        column is an integer so that the join on Asset.status_id can use the foreign key.
+
+        Args:
+            status_labels (dict): see get_status_labels.
+
+        Returns:
+            sqlalchemy.sql.FromClause.
+        """
+        rows = [
+            select(
+                literal(pk, Integer).label('id'),
+                literal(label, String).label('label'),
+                literal(status_id, String).label('status_id'),
+            )
+            for pk, (status_id, label) in status_labels.items()
+        ]
+        return (union_all(*rows) if len(rows) > 1 else rows[0]).subquery('status')
+
+    def get_rows_query(self, statuses):
+        """Get the query of the assets output columns, joined to their status, tenant and site. Rows are plain tuples,
+        no ORM object is created.
+
+        Args:
+            statuses (sqlalchemy.sql.FromClause): see get_statuses_table.
+
+        Returns:
+            sqlalchemy.orm.query.Query.
+        """
+        return self.request.db_session.query(
+            models.Asset.id,
+            models.Asset.asset_id,
+            models.Asset.calibration_next,
+            models.Asset.customer_name,
+            models.Site.name.label('site'),
+            statuses.c.status_id.label('status'),
+            statuses.c.label.label('status_label'),
+            models.Tenant.name.label('tenant_name'),
+        ) \
+            .join(statuses, statuses.c.id == models.Asset.status_id) \
+            .join(models.Asset.tenant) \
+            .outerjoin(models.Asset.site)
+
+    def get_link_template(self):
+        """Get the assets link, if the user is an admin or has the right to read the assets info.
+
+        Returns:
+            str: path to format with the asset primary key, None if the user can't read assets.
+        """
+        has_read_rights = 'assets-read' in get_tenantless_principals(self.request.effective_principals)
+        if not self.request.user.is_admin and not has_read_rights:
+            return None
+
+        # Generated paths are quoted, they can't contain braces.
+        path = self.request.route_path('assets-update', asset_id=ASSET_PK_PLACEHOLDER)
+        head, _, tail = path.rpartition(f'/{ASSET_PK_PLACEHOLDER}/')
+        return f'{head}/{{}}/{tail}'
+
+    def format_asset(self, row, link_template):
+        """Format an asset for dataTables.
+
+        Args:
+            row (sqlalchemy.engine.Row): see get_rows_query.
+            link_template (str): see get_link_template.
+
+        Returns:
+            dict.
+        """
+        asset_output = {
+            'asset_id': row.asset_id,
+            'calibration_next': format_date(row.calibration_next, self.request.locale_name),
+            'customer_name': row.customer_name,
+            'id': row.id,
+            'is_active': row.status != 'decommissioned',
+            'site': row.site,
+            'status': row.status,
+            'status_label': row.status_label,
+            'tenant_name': row.tenant_name,
+        }
+
+        if link_template:
+            asset_output['links'] = [{'rel': 'self', 'href': link_template.format(row.id)}]
+
+        return asset_output
 
     @view_config(route_name='api-assets', request_method='POST', permission='api-assets-create', require_csrf=False,
                  renderer='json')
@@ -148,6 +341,9 @@ class Sites(DataTablesAPI):
     @view_config(route_name='api-sites', request_method='GET', permission='sites-list', renderer='json')
     def list_get(self):
         """List sites and format output according to dataTables requirements."""
+        if asbool(self.request.GET.get('keyset')):
+            return self.keyset_list_get()
+
         # Parse data from datatables.
         try:
             search_parameters = manage_datatables_queries(self.request.GET)
@@ -188,33 +384,81 @@ class Sites(DataTablesAPI):
             capture_exception(error)
             raise HTTPBadRequest()
 
-        # Format db return for dataTables.
-        sites = []
-        for site in output['items']:
-            site_output = {
-                'contact': site.contact,
-                'email': site.email,
-                'name': site.name,
-                'phone': site.phone,
-                'site_type': self.request.localizer.translate(site.site_type) if site.site_type else None,
-                'tenant_name': site.tenant.name,
-            }
-
-            # Append link to output if the user is an admin or has the right to read the site info.
-            has_read_rights = 'sites-read' in get_tenantless_principals(self.request.effective_principals)
-            if self.request.user.is_admin or has_read_rights:
-                link = self.request.route_path('sites-update', site_id=site.id)
-                site_output['links'] = [{'rel': 'self', 'href': link}]
-
-            sites.append(site_output)
-
         return {
-            'data': sites,
+            'data': [self.format_site(site) for site in output['items']],
             'draw': draw,
             'recordsFiltered': output['recordsFiltered'],
             'recordsTotal': output.get('recordsTotal'),
         }
 
+    def keyset_list_get(self):
+        """List sites with keyset pagination, see api.keyset."""
+        sort_columns = {
+            'name': models.Site.name,
+            'site_type': func.coalesce(models.Site.site_type, literal_column("''")),
+            'tenant_name': models.Tenant.name,
+            'contact': func.coalesce(models.Site.contact, literal_column("''")),
+            'phone': func.coalesce(models.Site.phone, literal_column("''")),
+            'email': func.coalesce(models.Site.email, literal_column("''")),
+        }
+
+        try:
+            parameters = get_datatables_parameters(self.request.GET, sort_columns)
+        except (KeyError, TypeError, ValueError) as error:
+            capture_exception(error)
+            raise HTTPBadRequest()
+
+        output = keyset_search(
+            self.request.db_session.query(models.Site).join(models.Site.tenant),
+            models.Site.id,
+            sort_columns,
+            search_attributes=[
+                models.Site.contact,
+                models.Site.email,
+                models.Site.name,
+                models.Site.phone,
+                models.Site.site_type,
+                models.Tenant.name,
+            ],
+            filter_attributes={'tenant_name': models.Tenant.name},
+            parameters=parameters,
+            counts=ListCounts(self.request, models.Site.__tablename__),
+        )
+
+        return {
+            'cursors': output['cursors'],
+            'data': [self.format_site(row.Site) for row in output['items']],
+            'draw': parameters['draw'],
+            'recordsFiltered': output['recordsFiltered'],
+            'recordsTotal': output['recordsTotal'],
+        }
+
+    def format_site(self, site):
+        """Format a site for dataTables.
+
+        Args:
+            site (asset_tracker.models.Site).
+
+        Returns:
+            dict.
+        """
+        site_output = {
+            'contact': site.contact,
+            'email': site.email,
+            'name': site.name,
+            'phone': site.phone,
+            'site_type': self.request.localizer.translate(site.site_type) if site.site_type else None,
+            'tenant_name': site.tenant.name,
+        }
+
+        # Append link to output if the user is an admin or has the right to read the site info.
+        has_read_rights = 'sites-read' in get_tenantless_principals(self.request.effective_principals)
+        if self.request.user.is_admin or has_read_rights:
+            link = self.request.route_path('sites-update', site_id=site.id)
+            site_output['links'] = [{'rel': 'self', 'href': link}]
+
+        return site_output
+
 
 def includeme(config):
     config.add_route(pattern='assets/', name='api-assets', factory=Assets)
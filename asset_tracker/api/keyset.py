@@ -0,0 +1,215 @@
+"""Keyset (seek) pagination for the dataTables APIs.
+
+With OFFSET paging, the db reads and drops all the rows before the page, so deep pages get slower as the tables grow.
+Here pages are sorted by the sort column then the primary key, and the next (or previous) page starts after the last
+(or before the first) row of the page the client has: with an index on the sort column, page N costs the same as
+page 1. The client opts in with keyset=true and sends the cursor of the page it has; without cursor (first page, jump
+to any page), OFFSET is used, with the same order.
+"""
+
+import json
+import re
+from datetime import date
+
+from sqlalchemy import Date, and_, bindparam, or_, select, tuple_, union
+
+# dataTables sends the filter of the list (see js/asset_tracker.js), like 'status!=decommissioned'.
+FILTER_REGEX = re.compile(r'^(?P<attribute>\w+)(?P<operator>!?=)(?P<value>.*)$')
+
+
+def get_search_filter(pk, search_attributes, search):
+    """Get the full text search filter of a list: the search is contained in one of the attributes (case-insensitive).
+    The attributes are searched table by table with a UNION of ids, so that each table uses its trigram indexes (an OR
+    across joined tables can't use them).
+
+    Args:
+        pk (sqlalchemy.orm.attributes.InstrumentedAttribute): primary key of the listed model.
+        search_attributes (list): attributes searched, of the listed model or of models it has a foreign key to.
+        search (str).
+
+    Returns:
+        sqlalchemy.sql.ColumnElement.
+    """
+    pattern = '%{}%'.format(search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+    attributes_by_model = {}
+    for attribute in search_attributes:
+        attributes_by_model.setdefault(attribute.class_, []).append(attribute)
+
+    subqueries = []
+    for model, attributes in attributes_by_model.items():
+        # Not correlated: the listed table is also in the FROM of the list query.
+        subquery = select(pk).correlate(None)
+        if model is not pk.class_:
+            subquery = subquery.join(model)
+        subqueries.append(subquery.where(or_(*(attribute.ilike(pattern, escape='\\') for attribute in attributes))))
+
+    return pk.in_(union(*subqueries) if len(subqueries) > 1 else subqueries[0])
+
+
+def get_datatables_parameters(params, sort_columns):
+    """Parse the dataTables query string of a keyset list.
+
+    Args:
+        params (webob.multidict.MultiDict): request GET.
+        sort_columns (dict): column name (dataTables data) => sort expression.
+
+    Returns:
+        dict: draw, start, length, search, filter, sort (column name), direction, after/before (cursors).
+
+    Raises:
+        KeyError, TypeError, ValueError: invalid parameters.
+    """
+    sort_column = params.get(f'columns[{params.get("order[0][column]", "0")}][data]')
+    if sort_column not in sort_columns:
+        sort_column = next(iter(sort_columns))
+
+    parameters = {
+        'draw': int(params['draw']),
+        'start': max(int(params.get('start', 0)), 0),
+        'length': int(params.get('length', -1)),
+        'search': params.get('search[value]', '').strip(),
+        'filter': params.get('filter'),
+        'sort': sort_column,
+        'direction': 'desc' if params.get('order[0][dir]') == 'desc' else 'asc',
+        'after': None,
+        'before': None,
+    }
+
+    for cursor in ['after', 'before']:
+        if params.get(cursor):
+            parameters[cursor] = parse_cursor(sort_columns[sort_column], params[cursor])
+
+    return parameters
+
+
+def parse_cursor(sort_expression, cursor):
+    """Parse and validate a cursor received from dataTables, so that an invalid cursor is a bad request and doesn't
+    fail in the query.
+
+    Args:
+        sort_expression (sqlalchemy.sql.ColumnElement).
+        cursor (str): JSON.
+
+    Returns:
+        tuple: sort value (JSON, see get_cursor_value), primary key.
+
+    Raises:
+        TypeError, ValueError: invalid cursor.
+    """
+    sort_value, pk = json.loads(cursor)
+
+    if isinstance(sort_expression.type, Date):
+        date.fromisoformat(sort_value)
+    elif not isinstance(sort_value, str):
+        raise TypeError(f'Invalid cursor sort value: {sort_value!r}.')
+
+    if not isinstance(pk, int) or isinstance(pk, bool):
+        raise TypeError(f'Invalid cursor primary key: {pk!r}.')
+
+    return sort_value, pk
+
+
+def get_cursor_value(sort_expression, value):
+    """Get the value of a cursor as a bound parameter with the sort expression type.
+
+    Args:
+        sort_expression (sqlalchemy.sql.ColumnElement).
+        value: value received in the cursor (JSON), validated by parse_cursor.
+
+    Returns:
+        sqlalchemy.sql.expression.BindParameter.
+    """
+    if isinstance(sort_expression.type, Date):
+        value = date.fromisoformat(value)
+    return bindparam(None, value, type_=sort_expression.type)
+
+
+def get_row_cursor(row):
+    """Get the cursor of a keyset search row.
+
+    Args:
+        row (sqlalchemy.engine.Row): with keyset_sort and keyset_pk columns.
+
+    Returns:
+        str: JSON.
+    """
+    sort_value = row.keyset_sort
+    if isinstance(sort_value, date):
+        sort_value = sort_value.isoformat()
+    return json.dumps([sort_value, row.keyset_pk])
+
+
+def keyset_search(query, pk, sort_columns, search_attributes, filter_attributes, parameters, counts):
+    """Search and paginate a list by keyset.
+
+    Args:
+        query (sqlalchemy.orm.query.Query): items query, with the joins needed by the sort/search/filter attributes.
+        pk (sqlalchemy.orm.attributes.InstrumentedAttribute): primary key of the listed model, sort tie-breaker.
+        sort_columns (dict): column name => sort expression, it must not be NULL (use coalesce).
+        search_attributes (list): attributes searched (contains, case-insensitive).
+        filter_attributes (dict): attributes which can be filtered.
+        parameters (dict): see get_datatables_parameters.
+        counts (asset_tracker.api.counts.ListCounts).
+
+    Returns:
+        dict: items (rows, the query entities then keyset_sort and keyset_pk), recordsTotal, recordsFiltered, cursors
+            (first and last rows cursors).
+    """
+    records_total = counts.total(query)
+
+    filters = []
+    if parameters['search']:
+        filters.append(get_search_filter(pk, search_attributes, parameters['search']))
+
+    parsed_filter = FILTER_REGEX.match(parameters['filter'] or '')
+    if parsed_filter and parsed_filter['attribute'] in filter_attributes:
+        attribute = filter_attributes[parsed_filter['attribute']]
+        if parsed_filter['operator'] == '!=':
+            filters.append(or_(attribute != parsed_filter['value'], attribute.is_(None)))
+        else:
+            filters.append(attribute == parsed_filter['value'])
+
+    if filters:
+        query = query.filter(and_(*filters))
+        # Counted while the page is queried.
+        get_records_filtered = counts.filtered(query)
+
+    sort_expression = sort_columns[parameters['sort']]
+    query = query.add_columns(sort_expression.label('keyset_sort'), pk.label('keyset_pk'))
+
+    # Going back to the previous page: seek in reverse order, then put the rows back in order.
+    backwards = bool(parameters['before'] and not parameters['after'])
+    descending = (parameters['direction'] == 'desc') != backwards
+    cursor = parameters['before'] if backwards else parameters['after']
+
+    if cursor:
+        key = tuple_(sort_expression, pk)
+        cursor_key = tuple_(get_cursor_value(sort_expression, cursor[0]), bindparam(None, cursor[1], type_=pk.type))
+        query = query.filter(key < cursor_key if descending else key > cursor_key)
+    elif parameters['start']:
+        query = query.offset(parameters['start'])
+
+    if descending:
+        query = query.order_by(sort_expression.desc(), pk.desc())
+    else:
+        query = query.order_by(sort_expression.asc(), pk.asc())
+
+    if parameters['length'] > 0:
+        query = query.limit(parameters['length'])
+
+    items = query.all()
+    if backwards:
+        items.reverse()
+
+    records_filtered = get_records_filtered() if filters else records_total
+
+    return {
+        'items': items,
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'cursors': {
+            'first': get_row_cursor(items[0]) if items else None,
+            'last': get_row_cursor(items[-1]) if items else None,
+        },
+    }
@@ -1,9 +1,16 @@
+import hashlib
+
+import redis
 from parsys_utilities.security import Right
+from pyramid.renderers import render
+from pyramid.response import Response
 from pyramid.security import Allow, Authenticated
 from pyramid.view import view_config
-from sentry_sdk import capture_message
+from sentry_sdk import capture_exception, capture_message
 
 from asset_tracker import models
+from asset_tracker.cache import get_redis, get_site_fragment_key
+from asset_tracker.constants import SITE_FRAGMENT_CACHE
 
 
 class Sites:
@@ -23,27 +30,82 @@ class Sites:
 
         Always returns a 200, even if the site doesn't exist or the user hasn't got the rights. This way the user
         doesn't get an error message, just an empty iframe.
+
+        The rendered HTML is cached in Redis by site and locale, with the site tenant, invalidated when the site or its
+        tenant change (see cache.includeme).
         """
         site_id = self.request.matchdict.get('site_id')
+        cache_key = get_site_fragment_key(site_id)
+        locale = self.request.locale_name
+
+        try:
+            tenant_id, fragment = get_redis(self.request.registry).hmget(cache_key, 'tenant_id', locale)
+        except redis.RedisError as error:
+            capture_exception(error)
+            tenant_id, fragment = None, None
+
+        if tenant_id:
+            if not self.can_read(tenant_id.decode()):
+                return {}
+            if fragment:
+                return self.get_fragment_response(fragment)
 
         site = self.request.db_session.query(models.Site).filter_by(site_id=site_id).join(models.Site.tenant).first()
         if not site:
             capture_message('Missing site.')
             return {}
 
-        # By not putting this in the __acl__, we make sure that the user doesn't get a 403 if he doesn't have the
-        # necessary rights.
-        if Right(name='api-sites-read', tenant=site.tenant.tenant_id) not in self.request.effective_principals:
-            capture_message('Forbidden site request.')
+        if not self.can_read(site.tenant.tenant_id):
             return {}
 
-        return {
+        fragment = render('sites-information.html', {
             'contact': site.contact,
             'email': site.email,
             'name': site.name,
             'phone': site.phone,
             'site_type': site.site_type,
-        }
+        }, request=self.request).encode('utf-8')
+
+        try:
+            with get_redis(self.request.registry).pipeline() as pipeline:
+                pipeline.hset(cache_key, mapping={'tenant_id': site.tenant.tenant_id, locale: fragment})
+                # A fragment written back after a concurrent invalidation doesn't stay forever.
+                pipeline.expire(cache_key, SITE_FRAGMENT_CACHE)
+                pipeline.execute()
+        except redis.RedisError as error:
+            capture_exception(error)
+
+        return self.get_fragment_response(fragment)
+
+    def can_read(self, tenant_id):
+        """Check the user right on the site tenant. By not putting this in the __acl__, we make sure that the user
+        doesn't get a 403 if he doesn't have the necessary rights.
+
+        Args:
+            tenant_id (str).
+
+        Returns:
+            bool.
+        """
+        if Right(name='api-sites-read', tenant=tenant_id) not in self.request.effective_principals:
+            capture_message('Forbidden site request.')
+            return False
+
+        return True
+
+    def get_fragment_response(self, fragment):
+        """Get the response of a rendered site, the iframe revalidates it with its ETag.
+
+        Args:
+            fragment (bytes): rendered HTML.
+
+        Returns:
+            pyramid.response.Response.
+        """
+        response = Response(body=fragment, content_type='text/html', charset='utf-8', conditional_response=True)
+        response.etag = hashlib.sha256(fragment).hexdigest()
+        response.cache_control = 'private, no-cache'
+        return response
 
 
 def includeme(config):
@@ -1,18 +1,81 @@
 """Asset Tracker software management."""
 
+import hashlib
 import json
 import re
-from datetime import date
+from datetime import datetime, timezone
 from pathlib import Path
 
 import packaging.version
-from depot.manager import DepotManager
-from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound, HTTPOk
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound, HTTPNotModified, HTTPOk
+from pyramid.response import Response
 from pyramid.security import Allow
+from pyramid.settings import asbool
 from pyramid.view import view_config
 from sentry_sdk import capture_exception, capture_message
 
 from asset_tracker import models
+from asset_tracker.celery.reports import queue_reports
+from asset_tracker.constants import SOFTWARE_UPDATE_CACHE
+from asset_tracker.reports import apply_reports, create_report
+
+
+# Binary deltas between packages are stored in this sub-folder of the product folders.
+DELTAS_FOLDER = 'deltas'
+
+# Size of the chunks read from the packages when the server has no wsgi.file_wrapper.
+PACKAGE_BLOCK_SIZE = 256 * 1024
+
+
+class PackageRangeIter:
+    """Iterate on a byte range of a package file, chunk by chunk."""
+
+    def __init__(self, package_file, start, stop):
+        self.file = package_file
+        self.file.seek(start)
+        self.remaining = stop - start
+
+    def __iter__(self):
+        while self.remaining > 0:
+            chunk = self.file.read(min(PACKAGE_BLOCK_SIZE, self.remaining))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class PackageResponse(Response):
+    """Package file response: the file is sent by the server file wrapper (sendfile with waitress) and Range requests
+    are served by seeking in the file, so memory use doesn't depend on the package size.
+    """
+
+    def __init__(self, path, request):
+        super().__init__(content_type='application/octet-stream', conditional_response=True)
+        stat = path.stat()
+
+        self.package_file = path.open('rb')
+        self.file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if self.file_wrapper:
+            self.app_iter = self.file_wrapper(self.package_file, PACKAGE_BLOCK_SIZE)
+        else:
+            self.app_iter = PackageRangeIter(self.package_file, 0, stat.st_size)
+
+        self.content_length = stat.st_size
+        self.last_modified = stat.st_mtime
+        self.etag = hashlib.sha256(f'{path.name}-{stat.st_size}-{stat.st_mtime_ns}'.encode()).hexdigest()
+        self.accept_ranges = 'bytes'
+
+    def app_iter_range(self, start, stop):
+        """Called by webob for Range requests."""
+        # The file wrapper sends Content-Length bytes from the current position: no need to read the file here.
+        if self.file_wrapper and stop == self.content_length:
+            self.package_file.seek(start)
+            return self.file_wrapper(self.package_file, PACKAGE_BLOCK_SIZE)
+        else:
+            return PackageRangeIter(self.package_file, start, stop)
 
 
 def get_archi_from_file(file_name):
@@ -42,6 +105,50 @@ def get_product_files(product_folder):
     return [item for item in product_folder.iterdir() if item.is_file()]
 
 
+def get_delta_name(from_file, to_file):
+    """Get the name of the binary delta (bsdiff) between two packages of a product.
+
+    Args:
+        from_file (str): name of the package installed.
+        to_file (str): name of the package to install.
+
+    Returns:
+        str: delta file name.
+    """
+    return f'{from_file}--{to_file}.bsdiff'
+
+
+def get_folder_mtime(product_folder):
+    """Get the modification time of a product folder, or of its deltas folder if more recent.
+
+    Args:
+        product_folder (pathlib.Path).
+
+    Returns:
+        int: modification time (ns).
+    """
+    mtime = product_folder.stat().st_mtime_ns
+    deltas_folder = product_folder / DELTAS_FOLDER
+    if deltas_folder.is_dir():
+        mtime = max(mtime, deltas_folder.stat().st_mtime_ns)
+    return mtime
+
+
+def normalize_version(version):
+    """Handle formats like 4.1.0-alpha5-26-g014084c7e in at.dev for compatibility with packaging.version.
+
+    Args:
+        version (str).
+
+    Returns:
+        str: version, without the commit.
+    """
+    parsed_intermediate_version = re.search(r'\d+\.\d+\.\d+-\w+-\d+(-{1}.*)', version)
+    if parsed_intermediate_version:
+        version = version.replace(parsed_intermediate_version.group(1), '')
+    return version
+
+
 def get_version_from_file(file_name):
     """Get software version from file name.
 
@@ -49,10 +156,169 @@ def get_version_from_file(file_name):
         file_name (pathlib.Path): file name.
 
     Returns:
-        str: software version.
+        str: software version, None if the file name has none.
     """
     # Remove file extension.
-    return re.search(r'\d+\.\d+\.\d+.*', file_name.stem).group()
+    version = re.search(r'\d+\.\d+\.\d+.*', file_name.stem)
+    return version.group() if version else None
+
+
+def get_catalogue_channel(channel):
+    """Get the catalogue channel of a release channel: dev gets the same releases as alpha, unknown channels get stable
+    releases only.
+
+    Args:
+        channel (str): release channel.
+
+    Returns:
+        str: 'alpha', 'beta' or 'stable'.
+    """
+    if channel in ['alpha', 'dev']:
+        return 'alpha'
+    elif channel == 'beta':
+        return 'beta'
+    else:
+        return 'stable'
+
+
+class SoftwareCatalogue:
+    """Products versions, by channel and architecture, and binary deltas. Listing a product folder and parsing its files
+    is done once per worker, then again only when the folder modification time changes (files added, removed or
+    renamed).
+    """
+
+    def __init__(self):
+        self.products = {}
+
+    @staticmethod
+    def scan(product_folder):
+        """List and parse the product files. Files without a valid version are skipped, so that a single misnamed file
+        doesn't break the catalogue of every channel.
+
+        Args:
+            product_folder (pathlib.Path).
+
+        Returns:
+            dict: (catalogue channel, architecture) => versions sorted dict (version => file name).
+        """
+        versions = {(channel, archi): {} for channel in ['alpha', 'beta', 'stable'] for archi in [32, 64]}
+
+        for product_file in get_product_files(product_folder):
+            version = get_version_from_file(product_file)
+            try:
+                packaging.version.Version(normalize_version(version or ''))
+            except packaging.version.InvalidVersion:
+                capture_message(f'Invalid software version: {product_file}.')
+                continue
+
+            # Test channel.
+            if 'beta' in version:
+                channels = ['alpha', 'beta']
+            elif 'alpha' in version:
+                channels = ['alpha']
+            else:
+                channels = ['alpha', 'beta', 'stable']
+
+            version = normalize_version(version)
+            archi = get_archi_from_file(product_file)
+            for channel in channels:
+                versions[channel, archi][version] = product_file.name
+
+        # Sort dictionaries by version (which are the keys of the dicts).
+        # noinspection PyTypeChecker
+        return {
+            key: dict(sorted(product_versions.items(), key=lambda k: packaging.version.Version(k[0])))
+            for key, product_versions in versions.items()
+        }
+
+    @staticmethod
+    def scan_deltas(product_folder):
+        """List the binary deltas of a product.
+
+        Args:
+            product_folder (pathlib.Path).
+
+        Returns:
+            set: deltas file names.
+        """
+        deltas_folder = product_folder / DELTAS_FOLDER
+        if not deltas_folder.is_dir():
+            return set()
+
+        return {item.name for item in deltas_folder.iterdir() if item.is_file()}
+
+    def get_product(self, product_folder):
+        """Get the cached state of a product folder, scan it if it changed.
+
+        Args:
+            product_folder (pathlib.Path).
+
+        Returns:
+            tuple: modification time (None if it can't be followed), versions, deltas.
+        """
+        try:
+            mtime = get_folder_mtime(product_folder)
+        except OSError:
+            mtime = None
+
+        cached = self.products.get(product_folder)
+        if mtime is None or not cached or cached[0] != mtime:
+            cached = (mtime, self.scan(product_folder), self.scan_deltas(product_folder))
+            # Don't cache a folder we can't follow.
+            if mtime is not None:
+                self.products[product_folder] = cached
+
+        return cached
+
+    def get_delta(self, product_folder, from_file, to_file):
+        """Get the binary delta between two packages of a product, if it was computed.
+
+        Args:
+            product_folder (pathlib.Path).
+            from_file (str): name of the package installed.
+            to_file (str): name of the package to install.
+
+        Returns:
+            str: delta file name or None.
+        """
+        delta_name = get_delta_name(from_file, to_file)
+        return delta_name if delta_name in self.get_product(product_folder)[2] else None
+
+    def get_versions(self, product_folder, channel, archi):
+        """Get the versions of a product available in a channel for an architecture.
+
+        Args:
+            product_folder (pathlib.Path).
+            channel (str): release channel.
+            archi (int): 32 or 64.
+
+        Returns:
+            dict: versions sorted dict (version => file name). Must not be modified.
+        """
+        return self.get_product(product_folder)[1][get_catalogue_channel(channel), archi]
+
+    def get_mtime(self, product_folder):
+        """Get the modification time of a scanned product folder, which identifies the state of its versions.
+
+        Args:
+            product_folder (pathlib.Path).
+
+        Returns:
+            int: modification time (ns), None if the folder isn't cached.
+        """
+        cached = self.products.get(product_folder)
+        return cached[0] if cached else None
+
+    def reload(self, product_folder=None):
+        """Forget the scanned folders, they will be scanned again at the next request.
+
+        Args:
+            product_folder (pathlib.Path): forget only this folder.
+        """
+        if product_folder:
+            self.products.pop(product_folder, None)
+        else:
+            self.products = {}
 
 
 class Software:
@@ -68,6 +334,33 @@ class Software:
         self.request = request
         self.product = None
 
+    def set_cache_headers(self, mtime, archi):
+        """Set the caching headers of an update response. The answer only depends on the query, the architecture and
+        the product folder state, so they make the ETag.
+
+        Args:
+            mtime (int): product folder modification time (ns).
+            archi (int): 32 or 64.
+
+        Returns:
+            bool: the client copy is still valid.
+        """
+        query = sorted(self.request.GET.items())
+        etag_source = json.dumps([self.request.host_url, query, archi, mtime])
+
+        response = self.request.response
+        response.etag = hashlib.sha256(etag_source.encode()).hexdigest()
+        response.last_modified = datetime.fromtimestamp(mtime // 10 ** 9, timezone.utc)
+        # The answer is only for authenticated stations: shared caches must not store it.
+        response.cache_control = f'private, max-age={SOFTWARE_UPDATE_CACHE}, must-revalidate'
+        response.vary = ['User-Agent']
+
+        if self.request.if_none_match:
+            return response.etag in self.request.if_none_match
+        else:
+            if_modified_since = self.request.if_modified_since
+            return bool(if_modified_since and response.last_modified <= if_modified_since)
+
     @view_config(route_name='api-software-update', request_method='GET', permission='api-software-update',
                  renderer='json')
     def software_update_get(self):
@@ -111,34 +404,23 @@ class Software:
         if not product_folder.is_dir():
             return {'updateAvailable': False} if current else {}
 
-        product_versions = {}
-        for product_file in get_product_files(product_folder):
-            # Test channel.
-            version = get_version_from_file(product_file)
-            alpha = 'alpha' in version and channel in ['alpha', 'dev']
-            beta = 'beta' in version and channel in ['alpha', 'beta', 'dev']
-            stable = 'alpha' not in version and 'beta' not in version
-            wanted_channel = alpha or beta or stable
+        archi = 32 if archi_32_bits else 64
+        catalogue = self.request.registry.software_catalogue
+        product_versions = catalogue.get_versions(product_folder, channel, archi)
 
-            # Test_archi.
-            archi = get_archi_from_file(product_file)
-            wanted_archi = archi_32_bits == (archi == 32)
-
-            if wanted_channel and wanted_archi:
-                # Handle formats like 4.1.0-alpha5-26-g014084c7e in at.dev for compatibility with packaging.version.
-                parsed_intermediate_version = re.search(r'\d+\.\d+\.\d+-\w+-\d+(-{1}.*)', version)
-                if parsed_intermediate_version:
-                    version = version.replace(parsed_intermediate_version.group(1), '')
-
-                product_versions[version] = product_file.name
+        mtime = catalogue.get_mtime(product_folder)
+        if mtime is not None and self.set_cache_headers(mtime, archi):
+            response = self.request.response
+            return HTTPNotModified(headers={
+                'Cache-Control': response.headers['Cache-Control'],
+                'ETag': response.headers['ETag'],
+                'Last-Modified': response.headers['Last-Modified'],
+                'Vary': response.headers['Vary'],
+            })
 
         if not product_versions:
             return {'updateAvailable': False} if current else {}
 
-        # Sort dictionary by version (which are the keys of the dict).
-        # noinspection PyTypeChecker
-        product_versions = dict(sorted(product_versions.items(), key=lambda k: packaging.version.Version(k[0])))
-
         version = self.request.GET.get('version')
         if version and version in product_versions:
             file = product_versions[version]
@@ -149,73 +431,57 @@ class Software:
             return {}
 
         # We return only the latest version.
-        product_latest = product_versions.popitem()
+        product_latest = next(reversed(product_versions.items()))
         # Make sure we aren't in the special case where the station is using a version that hasn't been uploaded yet.
         if current and current > packaging.version.Version(product_latest[0]):
             return {'updateAvailable': False}
 
         download_url = self.request.route_url('api-software-download', product=self.product, file=product_latest[1])
         if current:
-            return {'updateAvailable': True, 'version': product_latest[0], 'url': download_url}
+            update = {'updateAvailable': True, 'version': product_latest[0], 'url': download_url}
+
+            # If the package of the current version is known, the station can download a binary delta instead.
+            current_file = product_versions.get(normalize_version(self.request.GET['current']))
+            delta = current_file and catalogue.get_delta(product_folder, current_file, product_latest[1])
+            if delta:
+                update['deltaUrl'] = self.request.route_url(
+                    'api-software-delta-download', product=self.product, file=delta
+                )
+
+            return update
         else:
             return {'version': product_latest[0], 'url': download_url}
 
-    def create_config_update_event(self, config, asset):
-        """Create event if configuration file changed.
-
-        Args:
-            config (dict):
-            asset (asset_tracker.models.Asset).
+    @view_config(route_name='api-software-download', request_method='GET', permission='api-software-update')
+    @view_config(route_name='api-software-delta-download', request_method='GET', permission='api-software-update')
+    def software_download_get(self):
+        """Download a product package or binary delta. Interrupted downloads can be resumed with Range requests.
+        If asset_tracker.software_accel_redirect is set, the file is sent by the front proxy (X-Accel-Redirect).
         """
-        depot = DepotManager.get()
-        last_config = None
-
-        last_event = asset.history(order='desc') \
-            .join(models.Event.status) \
-            .filter(models.EventStatus.status_id == 'config_update') \
-            .first()
-        if last_event:
-            try:
-                config_file = depot.get(last_event.extra_json['config'])
-                last_config = json.loads(config_file.read().decode('utf-8'))
-            except (json.JSONDecodeError, OSError, TypeError, ValueError) as error:
-                capture_exception(error)
+        storage_path = self.request.registry.settings.get('asset_tracker.software_storage')
+        if not storage_path:
+            raise HTTPNotFound()
+
+        # Don't serve files outside the product folders (like '..').
+        storage_folder = Path(storage_path).resolve()
+        product_folder = storage_folder / self.request.matchdict['product']
+        if self.request.matched_route.name == 'api-software-delta-download':
+            files_folder = product_folder / DELTAS_FOLDER
+        else:
+            files_folder = product_folder
+        package_path = files_folder / self.request.matchdict['file']
+        outside_storage = product_folder.resolve().parent != storage_folder
+        if outside_storage or package_path.resolve().parent != files_folder.resolve() or not package_path.is_file():
+            raise HTTPNotFound()
 
-        if not last_event or last_config != config:
-            file_id = depot.create(bytes(json.dumps(config), 'utf-8'), 'config.json', 'application/json')
-            new_event = models.Event(
-                creator_id=self.request.user.id,
-                creator_alias=self.request.user.alias,
-                date=date.today(),
-                extra=json.dumps({'config': file_id}),
-                status=self.request.db_session.query(models.EventStatus).filter_by(status_id='config_update').one(),
-            )
-            asset.add_event(new_event)
-            self.request.db_session.add(new_event)
-
-    def create_version_update_event(self, software_version, asset):
-        """Create event if software version was updated.
+        accel_redirect = self.request.registry.settings.get('asset_tracker.software_accel_redirect')
+        if accel_redirect:
+            response = Response(content_type='application/octet-stream')
+            relative_path = package_path.relative_to(storage_folder).as_posix()
+            response.headers['X-Accel-Redirect'] = f'{accel_redirect.rstrip("/")}/{relative_path}'
+            return response
 
-        Args:
-            software_version (str).
-            asset (asset_tracker.models.Asset).
-        """
-        latest_events = asset.history(order='desc') \
-            .join(models.Event.status) \
-            .filter(models.EventStatus.status_id == 'software_update')
-        last_event_generator = (e for e in latest_events if e.extra_json['software_name'] == self.product)
-        last_event = next(last_event_generator, None)
-
-        if not last_event or last_event.extra_json['software_version'] != software_version:
-            new_event = models.Event(
-                creator_id=self.request.user.id,
-                creator_alias=self.request.user.alias,
-                date=date.today(),
-                extra=json.dumps({'software_name': self.product, 'software_version': software_version}),
-                status=self.request.db_session.query(models.EventStatus).filter_by(status_id='software_update').one(),
-            )
-            asset.add_event(new_event)
-            self.request.db_session.add(new_event)
+        return PackageResponse(package_path, self.request)
 
     @view_config(route_name='api-software-update', request_method='POST', permission='api-software-update',
                  require_csrf=False, renderer='json')
@@ -236,17 +502,8 @@ class Software:
         else:
             self.product = self.request.GET['product'].lower()
 
-        # Make sure the JSON provided is valid.
-        try:
-            post_json = self.request.json
-        except json.JSONDecodeError as error:
-            capture_exception(error)
-            raise HTTPBadRequest(json={'error': 'Invalid JSON.'})
-
-        asset = self.request.db_session.query(models.Asset).filter_by(asset_id=self.request.user.login).first()
-        if not asset:
-            capture_message(f'Unknown asset: {self.request.user.login}.')
-            raise HTTPNotFound(json={'error': 'Unknown asset.'})
+        post_json = self.get_json()
+        asset = self.get_asset()
 
         software_version = post_json.get('version')
         config = post_json.get('config')
@@ -254,17 +511,80 @@ class Software:
             capture_message('No data received.')
             raise HTTPBadRequest(json='No data received.')
 
-        # Handle software version update.
-        if software_version:
-            self.create_version_update_event(software_version, asset)
+        self.receive_reports(asset, [create_report(self.request, self.product, software_version, config)])
+
+        return HTTPOk(json='Information received.')
+
+    @view_config(route_name='api-software-reports', request_method='POST', permission='api-software-update',
+                 require_csrf=False, renderer='json')
+    def software_reports_post(self):
+        """Receive the software(s) versions and/or configuration files of several products at once.
+
+        Body (json): product => {version, config}, it is mandatory to provide at least one of them for each product.
+        """
+        post_json = self.get_json()
+        if not post_json or not isinstance(post_json, dict):
+            capture_message('No data received.')
+            raise HTTPBadRequest(json='No data received.')
+
+        reports = []
+        for product, product_data in post_json.items():
+            software_version = product_data.get('version') if isinstance(product_data, dict) else None
+            config = product_data.get('config') if isinstance(product_data, dict) else None
+            if not config and not software_version:
+                capture_message(f'No data received for {product}.')
+                raise HTTPBadRequest(json={'error': f'No data received for {product}.'})
+
+            reports.append(create_report(self.request, product.lower(), software_version, config))
 
-        # Handle software configuration file update.
-        if config:
-            self.create_config_update_event(config, asset)
+        self.receive_reports(self.get_asset(), reports)
 
         return HTTPOk(json='Information received.')
 
+    def get_asset(self):
+        """Get the asset sending the request.
+
+        Returns:
+            asset_tracker.models.Asset.
+        """
+        asset = self.request.db_session.query(models.Asset).filter_by(asset_id=self.request.user.login).first()
+        if not asset:
+            capture_message(f'Unknown asset: {self.request.user.login}.')
+            raise HTTPNotFound(json={'error': 'Unknown asset.'})
+
+        return asset
+
+    def get_json(self):
+        """Make sure the JSON provided is valid.
+
+        Returns:
+            dict.
+        """
+        try:
+            return self.request.json
+        except json.JSONDecodeError as error:
+            capture_exception(error)
+            raise HTTPBadRequest(json={'error': 'Invalid JSON.'})
+
+    def receive_reports(self, asset, reports):
+        """Apply the reports of an asset, or queue them if write-behind ingestion is enabled.
+
+        Args:
+            asset (asset_tracker.models.Asset).
+            reports (list).
+        """
+        if asbool(self.request.registry.settings.get('asset_tracker.software_reports_queue', False)):
+            queue_reports(self.request, asset, reports)
+        else:
+            apply_reports(self.request, asset, reports)
+
 
 def includeme(config):
-    config.add_route(pattern='download/{product}/{file}', name='api-software-download')
+    config.registry.software_catalogue = SoftwareCatalogue()
+
+    config.add_route(pattern='download/{product}/{file}', name='api-software-download', factory=Software)
+    config.add_route(
+        pattern='download/{product}/deltas/{file}', name='api-software-delta-download', factory=Software
+    )
     config.add_route(pattern='update/', name='api-software-update', factory=Software)
+    config.add_route(pattern='reports/', name='api-software-reports', factory=Software)
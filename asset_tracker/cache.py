@@ -0,0 +1,158 @@
+"""Redis client shared by the app caches and queues (same Redis as the sessions)."""
+
+import redis
+from sentry_sdk import capture_exception
+from sqlalchemy import event
+
+from asset_tracker import models
+
+# Models whose lists totals are cached, see api.counts.
+COUNTED_MODELS = (models.Asset, models.Site)
+# Models shown in the cached dataTables responses, see api.datatables.
+DATATABLES_MODELS = (models.Asset, models.Event, models.Site, models.Tenant)
+# Incremented to invalidate all cached dataTables responses at once.
+DATATABLES_GENERATION_KEY = 'asset_tracker:datatables:generation'
+
+
+def get_redis(registry):
+    """Get the Redis client of the app, created once per process.
+
+    Args:
+        registry (pyramid.registry.Registry).
+
+    Returns:
+        redis.Redis.
+    """
+    client = getattr(registry, 'redis', None)
+    if client is None:
+        client = redis.Redis.from_url(registry.settings['asset_tracker.sessions_broker_url'])
+        registry.redis = client
+    return client
+
+
+def get_site_fragment_key(site_id):
+    """Get the Redis key of the rendered site information fragments (see api.sites), one field per locale and the
+    site tenant (to check rights before serving a fragment).
+
+    Args:
+        site_id (str): site public id.
+
+    Returns:
+        str.
+    """
+    return f'asset_tracker:site_fragment:{site_id}'
+
+
+def mark_sites_changed(db_session, *sites_ids):
+    """Invalidate the rendered fragments of sites once the session transaction is committed, so that the old sites
+    aren't cached again by a concurrent request. The ORM changes are tracked by the session events.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+        sites_ids (str): sites public ids.
+    """
+    db_session.info.setdefault('sites_changed', set()).update(sites_ids)
+
+
+def get_count_key(table):
+    """Get the Redis key of the cached number of rows of a list (see api.counts).
+
+    Args:
+        table (str): table name.
+
+    Returns:
+        str.
+    """
+    return f'asset_tracker:count:{table}'
+
+
+def mark_counts_changed(db_session, *tables):
+    """Invalidate the cached lists totals of tables once the session transaction is committed. The ORM inserts and
+    deletes are tracked by the session events, Core statements must call this function.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+        tables (str): tables names.
+    """
+    db_session.info.setdefault('counts_changed', set()).update(tables)
+
+
+def get_datatables_key(client, list_name, digest):
+    """Get the Redis key of a cached dataTables response, in the current generation of responses.
+
+    Args:
+        client (redis.Redis).
+        list_name (str).
+        digest (str): hash of the normalized query.
+
+    Returns:
+        str.
+    """
+    generation = int(client.get(DATATABLES_GENERATION_KEY) or 0)
+    return f'asset_tracker:datatables:{list_name}:{generation}:{digest}'
+
+
+def mark_datatables_changed(db_session):
+    """Invalidate the cached dataTables responses once the session transaction is committed. The ORM changes are
+    tracked by the session events, Core statements must call this function.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+    """
+    db_session.info['datatables_changed'] = True
+
+
+def includeme(config):
+    """Track the changes invalidating the caches (lists counts, dataTables responses and sites fragments) in the app
+    sessions.
+    """
+    registry = config.registry
+    session_factory = registry['db_session_factory']
+
+    @event.listens_for(session_factory, 'after_flush')
+    def collect_counts_changes(session, flush_context):
+        tables = {
+            instance.__tablename__
+            for instance in [*session.new, *session.deleted]
+            if isinstance(instance, COUNTED_MODELS)
+        }
+        if tables:
+            mark_counts_changed(session, *tables)
+
+        changed = [*session.new, *session.dirty, *session.deleted]
+        if any(isinstance(instance, DATATABLES_MODELS) for instance in changed):
+            mark_datatables_changed(session)
+
+        # The fragments show the site and are served according to its tenant.
+        sites_ids = set()
+        for instance in changed:
+            if isinstance(instance, models.Site):
+                sites_ids.add(instance.site_id)
+            elif isinstance(instance, models.Tenant) and instance not in session.new:
+                sites_ids.update(site.site_id for site in instance.sites)
+        if sites_ids:
+            mark_sites_changed(session, *sites_ids)
+
+    @event.listens_for(session_factory, 'after_commit')
+    def invalidate_caches(session):
+        tables = session.info.pop('counts_changed', None)
+        datatables_changed = session.info.pop('datatables_changed', False)
+        sites_ids = session.info.pop('sites_changed', None)
+        if not tables and not datatables_changed and not sites_ids:
+            return
+        try:
+            client = get_redis(registry)
+            if tables:
+                client.delete(*(get_count_key(table) for table in tables))
+            if datatables_changed:
+                client.incr(DATATABLES_GENERATION_KEY)
+            if sites_ids:
+                client.delete(*(get_site_fragment_key(site_id) for site_id in sites_ids))
+        except redis.RedisError as error:
+            capture_exception(error)
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def forget_changes(session):
+        session.info.pop('counts_changed', None)
+        session.info.pop('datatables_changed', None)
+        session.info.pop('sites_changed', None)
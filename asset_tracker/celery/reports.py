@@ -0,0 +1,170 @@
+import json
+
+from parsys_utilities.celery import app
+from pyramid.threadlocal import get_current_request
+from sentry_sdk import capture_message
+
+from asset_tracker import models
+from asset_tracker.cache import get_redis
+from asset_tracker.reports import apply_reports, collapse_reports
+
+# Maximum number of reports of an asset applied in one transaction.
+REPORTS_BATCH_SIZE = 100
+# A worker applying the reports of an asset for longer than this (s) is considered dead, its lock expires.
+REPORTS_LOCK_TIMEOUT = 10 * 60
+
+# Reports of an asset failing this many times in a row are moved to the dead-letter list.
+REPORTS_MAX_ATTEMPTS = 5
+# Attempts are forgotten after this time (s) without failure.
+REPORTS_ATTEMPTS_EXPIRY = 24 * 3600
+# Reports which couldn't be applied, kept for inspection (JSON: asset primary key and report).
+REPORTS_DEAD_LETTER_KEY = 'asset_tracker:reports:dead_letter'
+
+
+def get_reports_key(asset_pk):
+    """Get the Redis key of the reports queue of an asset.
+
+    Args:
+        asset_pk (int): asset primary key.
+
+    Returns:
+        str.
+    """
+    return f'asset_tracker:reports:{asset_pk}'
+
+
+def get_processing_key(asset_pk):
+    """Get the Redis key of the batch of reports of an asset being applied. It is dropped once the batch is committed,
+    so that the reports of a failed or interrupted run are neither lost nor overtaken by the next ones.
+
+    Args:
+        asset_pk (int): asset primary key.
+
+    Returns:
+        str.
+    """
+    return f'asset_tracker:reports_processing:{asset_pk}'
+
+
+def get_lock_key(asset_pk):
+    """Get the Redis key of the lock of the reports of an asset, held by the worker applying them.
+
+    Args:
+        asset_pk (int): asset primary key.
+
+    Returns:
+        str.
+    """
+    return f'asset_tracker:reports_lock:{asset_pk}'
+
+
+def get_attempts_key(asset_pk):
+    """Get the Redis key of the number of failed attempts to apply the reports of an asset.
+
+    Args:
+        asset_pk (int): asset primary key.
+
+    Returns:
+        str.
+    """
+    return f'asset_tracker:reports_attempts:{asset_pk}'
+
+
+def queue_reports(request, asset, reports):
+    """Queue station reports, they will be applied by a worker. Reports are queued per asset to keep their order.
+
+    Args:
+        request (pyramid.request.Request).
+        asset (asset_tracker.models.Asset).
+        reports (list): see asset_tracker.reports.
+    """
+    get_redis(request.registry).rpush(get_reports_key(asset.id), *(json.dumps(report) for report in reports))
+    apply_queued_reports.delay(asset.id)
+
+
+def fail_reports(request, asset_pk, queued_reports):
+    """Count a failure to apply a batch of reports of an asset. The batch stays in the processing list, in front of the
+    queue: the next task applies it first. After REPORTS_MAX_ATTEMPTS failures in a row, it is moved to the dead-letter
+    list instead, so that it doesn't block the next reports of the asset forever. Called under the lock of the asset
+    reports, no other worker can apply the next reports meanwhile.
+
+    Args:
+        request (pyramid.request.Request).
+        asset_pk (int): asset primary key.
+        queued_reports (list): JSON reports.
+
+    Returns:
+        bool: the reports were moved to the dead-letter list.
+    """
+    redis = get_redis(request.registry)
+    attempts_key = get_attempts_key(asset_pk)
+
+    with redis.pipeline() as pipeline:
+        pipeline.incr(attempts_key)
+        pipeline.expire(attempts_key, REPORTS_ATTEMPTS_EXPIRY)
+        attempts, _ = pipeline.execute()
+
+    if attempts < REPORTS_MAX_ATTEMPTS:
+        return False
+
+    dead_reports = [
+        json.dumps({'asset_pk': asset_pk, 'report': json.loads(queued_report)}) for queued_report in queued_reports
+    ]
+    with redis.pipeline() as pipeline:
+        pipeline.rpush(REPORTS_DEAD_LETTER_KEY, *dead_reports)
+        pipeline.delete(get_processing_key(asset_pk), attempts_key)
+        pipeline.execute()
+
+    capture_message(f'{len(queued_reports)} reports of asset {asset_pk} moved to the dead-letter list.')
+    # The next reports of the asset must not wait for another report to be queued.
+    apply_queued_reports.delay(asset_pk)
+    return True
+
+
+@app.task()
+def apply_queued_reports(asset_pk):
+    """Apply the queued reports of an asset. Several tasks can be queued for the same asset, the first one applies all
+    its reports and the next ones have nothing to do.
+
+    Args:
+        asset_pk (int): asset primary key.
+
+    Returns:
+        int: number of reports applied.
+    """
+    request = get_current_request()
+    redis = get_redis(request.registry)
+    key, processing_key = get_reports_key(asset_pk), get_processing_key(asset_pk)
+
+    # The reports of an asset are applied by one worker at a time, in order. The lock is held until the batch is
+    # dropped, after the commit (which releases the lock of the asset row).
+    with redis.lock(get_lock_key(asset_pk), timeout=REPORTS_LOCK_TIMEOUT):
+        # The batch of a failed or interrupted run comes first.
+        queued_reports = redis.lrange(processing_key, 0, -1)
+        if not queued_reports:
+            with redis.pipeline() as pipeline:
+                for _ in range(REPORTS_BATCH_SIZE):
+                    pipeline.lmove(key, processing_key, 'LEFT', 'RIGHT')
+                queued_reports = [queued_report for queued_report in pipeline.execute() if queued_report is not None]
+
+        try:
+            with request.tm:
+                asset = request.db_session.query(models.Asset).filter_by(id=asset_pk).with_for_update().first()
+                if asset and queued_reports:
+                    reports = [json.loads(queued_report) for queued_report in queued_reports]
+                    apply_reports(request, asset, collapse_reports(reports))
+
+        except Exception:
+            if queued_reports:
+                fail_reports(request, asset_pk, queued_reports)
+            raise
+
+        with redis.pipeline() as pipeline:
+            pipeline.delete(processing_key, get_attempts_key(asset_pk))
+            pipeline.llen(key)
+            _, remaining = pipeline.execute()
+
+    if remaining:
+        apply_queued_reports.delay(asset_pk)
+
+    return len(queued_reports)
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import bsdiff4
+from parsys_utilities.celery import app
+from pyramid.threadlocal import get_current_request
+from sentry_sdk import capture_exception
+
+from asset_tracker.api.software import DELTAS_FOLDER, SoftwareCatalogue, get_delta_name
+
+# Number of previous versions a delta is computed from, for each version of each catalogue channel.
+DELTAS_PREDECESSORS = 3
+
+# bsdiff needs about 17 times the size of the packages in memory (about 1.7GB per celery worker process at this
+# limit): deltas of bigger packages aren't computed.
+DELTAS_MAX_PACKAGE_SIZE = 100 * 1024 ** 2
+
+# Temporary files older than this (s) were left by an interrupted run, more recent ones can belong to a running task.
+DELTAS_TEMPORARY_MAX_AGE = 24 * 3600
+
+
+def compute_delta(product_folder, from_file, to_file):
+    """Compute the binary delta between two packages of a product.
+
+    Args:
+        product_folder (pathlib.Path).
+        from_file (str): name of the package installed.
+        to_file (str): name of the package to install.
+    """
+    deltas_folder = product_folder / DELTAS_FOLDER
+    delta_name = get_delta_name(from_file, to_file)
+
+    # Write then rename, the API must not advertise a partial delta. The temporary file name is unique, so that
+    # concurrent runs don't write to (or delete) the same file.
+    descriptor, temporary_path = tempfile.mkstemp(prefix=f'.{delta_name}.', suffix='.tmp', dir=deltas_folder)
+    os.close(descriptor)
+    try:
+        bsdiff4.file_diff(str(product_folder / from_file), str(product_folder / to_file), temporary_path)
+        os.replace(temporary_path, deltas_folder / delta_name)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def compute_product_deltas(product_folder, max_package_size=DELTAS_MAX_PACKAGE_SIZE):
+    """Compute the missing binary deltas of a product and remove the deltas of removed packages.
+
+    Args:
+        product_folder (pathlib.Path).
+        max_package_size (int): deltas of bigger packages (bytes) aren't computed.
+
+    Returns:
+        int: number of deltas computed.
+    """
+    versions = SoftwareCatalogue.scan(product_folder)
+    deltas_folder = product_folder / DELTAS_FOLDER
+    deltas_folder.mkdir(exist_ok=True)
+
+    # Predecessors in each catalogue, a station updates within its channel: in the alpha catalogue, the pre-releases
+    # would push the previous stable versions out of the predecessors of a stable version.
+    deltas_files = set()
+    for (_channel, _archi), product_versions in versions.items():
+        product_files = list(product_versions.values())
+        for index, to_file in enumerate(product_files):
+            for from_file in product_files[max(index - DELTAS_PREDECESSORS, 0):index]:
+                deltas_files.add((from_file, to_file))
+
+    wanted_deltas = set()
+    computed = 0
+    for from_file, to_file in sorted(deltas_files):
+        package_size = max((product_folder / file).stat().st_size for file in [from_file, to_file])
+        if package_size > max_package_size:
+            continue
+
+        delta_name = get_delta_name(from_file, to_file)
+        wanted_deltas.add(delta_name)
+        if (deltas_folder / delta_name).is_file():
+            continue
+
+        compute_delta(product_folder, from_file, to_file)
+        computed += 1
+
+    for delta_path in deltas_folder.iterdir():
+        if not delta_path.is_file() or delta_path.name in wanted_deltas:
+            continue
+
+        try:
+            if delta_path.suffix == '.tmp' and time.time() - delta_path.stat().st_mtime < DELTAS_TEMPORARY_MAX_AGE:
+                continue
+            delta_path.unlink()
+        except FileNotFoundError:
+            # Renamed or removed by a concurrent run.
+            continue
+
+    return computed
+
+
+@app.task()
+def compute_deltas():
+    """Compute the binary deltas between each package and its predecessors, for all products."""
+    request = get_current_request()
+
+    storage_path = request.registry.settings.get('asset_tracker.software_storage')
+    if not storage_path:
+        return 0
+
+    computed = 0
+    for product_folder in Path(storage_path).iterdir():
+        if not product_folder.is_dir():
+            continue
+
+        try:
+            computed += compute_product_deltas(product_folder)
+        except OSError as error:
+            # Don't block the other products.
+            capture_exception(error)
+
+    return computed
@@ -102,12 +102,13 @@ def update_equipment_families(db_session, config):
         db_family.model = config_family['model']
 
 
-def update_statuses(db_session, config):
+def update_statuses(db_session, config, statuses=None):
     """Update assets statuses in the db according to config.json.
 
     Args:
         db_session (sqlalchemy.orm.session.Session).
         config (dict).
+        statuses (asset_tracker.statuses.StatusesRegistry): registry to reload with the updated statuses.
     """
     config_statuses = config['status']
     db_statuses = db_session.query(models.EventStatus).all()
@@ -142,9 +143,17 @@ def update_statuses(db_session, config):
         db_status._label_marlink = config_status.get('label_marlink')
         db_status.status_type = config_status['status_type']
 
+    if statuses is not None:
+        statuses.load(db_session)
 
-def update_configuration(settings):
-    """Run the update."""
+
+def update_configuration(settings, statuses=None):
+    """Run the update.
+
+    Args:
+        settings (dict): app settings.
+        statuses (asset_tracker.statuses.StatusesRegistry): registry to load with the updated statuses.
+    """
     with transaction.manager:
         # Connect to the db.
         engine = models.get_engine(settings)
@@ -157,4 +166,4 @@ def update_configuration(settings):
 
         update_equipment_families(db_session, config)
         update_consumable_families(db_session, config)
-        update_statuses(db_session, config)
+        update_statuses(db_session, config, statuses)
@@ -0,0 +1,104 @@
+"""Assets configuration files storage.
+
+Stations often share the same configuration: files are stored in the depot by content hash and reference counted, so
+that identical configurations are stored only once. Released files are deleted from the depot once the transaction is
+committed (see includeme): if it is rolled back, the files are still referenced.
+"""
+
+import hashlib
+import json
+
+from depot.manager import DepotManager
+from sentry_sdk import capture_exception
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from asset_tracker import models
+
+
+def get_config_hash(config):
+    """Get the hash of a configuration, computed on its canonical JSON so that keys order doesn't matter.
+
+    Args:
+        config (dict).
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    canonical_config = json.dumps(config, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(canonical_config.encode('utf-8')).hexdigest()
+
+
+def store_config(db_session, config, config_hash=None):
+    """Store a configuration in the depot, unless an identical configuration is already stored.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+        config (dict).
+        config_hash (str): hash of the configuration, if already computed.
+
+    Returns:
+        str: depot file id.
+    """
+    if not config_hash:
+        config_hash = get_config_hash(config)
+
+    config_file = db_session.query(models.ConfigFile).filter_by(config_hash=config_hash).first()
+    if not config_file:
+        depot = DepotManager.get()
+        file_id = depot.create(bytes(json.dumps(config), 'utf-8'), 'config.json', 'application/json')
+        config_file = models.ConfigFile(config_hash=config_hash, file_id=file_id, references=0)
+        try:
+            with db_session.begin_nested():
+                db_session.add(config_file)
+        except IntegrityError:
+            # The same configuration was stored by a concurrent request.
+            depot.delete(file_id)
+            config_file = db_session.query(models.ConfigFile).filter_by(config_hash=config_hash).one()
+
+    # Increment in the db to avoid losing concurrent increments.
+    config_file.references = models.ConfigFile.references + 1
+    return config_file.file_id
+
+
+def release_config(db_session, file_id):
+    """Release a reference to a configuration file. The file is deleted from the depot when it isn't referenced anymore,
+    once the session transaction is committed.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+        file_id (str): depot file id.
+    """
+    config_file = db_session.query(models.ConfigFile).filter_by(file_id=file_id).first()
+    # Files stored before deduplication aren't reference counted.
+    if not config_file:
+        db_session.info.setdefault('released_configs', set()).add(file_id)
+        return
+
+    config_file.references = models.ConfigFile.references - 1
+    db_session.flush()
+    db_session.refresh(config_file, ['references'])
+    if config_file.references <= 0:
+        db_session.info.setdefault('released_configs', set()).add(file_id)
+        db_session.delete(config_file)
+
+
+def includeme(config):
+    """Delete the released configuration files from the depot when the app sessions are committed."""
+    session_factory = config.registry['db_session_factory']
+
+    @event.listens_for(session_factory, 'after_commit')
+    def delete_released_configs(session):
+        depot = DepotManager.get()
+        for file_id in session.info.pop('released_configs', ()):
+            try:
+                depot.delete(file_id)
+            except OSError as error:
+                # The file is already unreferenced, at worst it stays in the depot.
+                capture_exception(error)
+
+    @event.listens_for(session_factory, 'after_soft_rollback')
+    def forget_released_configs(session, previous_transaction):
+        # A savepoint rollback (see store_config) doesn't roll back the releases.
+        if not previous_transaction.nested:
+            session.info.pop('released_configs', None)
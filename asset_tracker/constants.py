@@ -19,6 +19,12 @@ CALIBRATION_FREQUENCIES_YEARS = {
     'default': 2,
     'marlink': 5,
 }
+# Lists totals are invalidated when rows are inserted or deleted, the expiration (seconds) is a safety net.
+COUNTS_CACHE = 3600
+# Rendered sites are invalidated when sites or tenants change, the expiration (seconds) is a safety net.
+SITE_FRAGMENT_CACHE = 3600
+# Stations poll the software update API: how long (seconds) they can keep an answer before revalidating it.
+SOFTWARE_UPDATE_CACHE = 300
 SITE_TYPES = [
     _('Company'),
     _('Hospital'),
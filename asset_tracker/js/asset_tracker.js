@@ -228,6 +228,45 @@ function manageColumnsRender(table) {
   return columns;
 }
 
+function getKeysetQuery(data) {
+  /**
+   * Parameters which must be the same between two pages to use a cursor.
+   */
+  return JSON.stringify({filter: data.filter, length: data.length, order: data.order, search: data.search.value});
+}
+
+function addKeysetCursor(table, data) {
+  /**
+   * Keyset pagination: send the cursor of the page displayed when moving to the next/previous page, the other pages
+   * are requested with the offset.
+   */
+  data.keyset = true;
+  const query = getKeysetQuery(data);
+  const displayedPage = table.data('keyset-page');
+  table.data('keyset-request', {length: data.length, query: query, start: data.start});
+
+  if (!displayedPage || !displayedPage.cursors || displayedPage.query !== query) {
+    return;
+  }
+
+  if (data.start === displayedPage.start + displayedPage.length && displayedPage.cursors.last) {
+    data.after = displayedPage.cursors.last;
+  } else if (data.start === displayedPage.start - data.length && displayedPage.cursors.first) {
+    data.before = displayedPage.cursors.first;
+  }
+}
+
+function saveKeysetPage(event, settings, json) {
+  /**
+   * Keep the cursors of the page received, for the next request.
+   */
+  const table = $(event.target);
+  const request = table.data('keyset-request');
+  if (request && json) {
+    table.data('keyset-page', Object.assign({cursors: json.cursors}, request));
+  }
+}
+
 function styleInactiveObjects(row, data) {
   const hasActiveProperty = Object.prototype.hasOwnProperty.call(data, 'is_active');
   // noinspection JSUnresolvedVariable
@@ -290,6 +329,11 @@ $(function createDatatables() {
                               '<"row"<"col-sm-5"i><"col-sm-7"p>>';
   }
 
+  // Keyset pagination, see addKeysetCursor.
+  if (table.data('keyset')) {
+    table.on('xhr.dt', saveKeysetPage);
+  }
+
   const initialisedDataTable = table.DataTable(dataTableParameters);
 
   // Manage the custom filter.
@@ -324,7 +368,8 @@ $(function createDatatables() {
 
 $(document).on('preInit.dt', function initCustomFilter(event, settings) {
   /**
-   * Before dataTable initialization, manage when to send the 'hide' query string for the custon filter.
+   * Before dataTable initialization, manage when to send the 'hide' query string for the custon filter, and the
+   * keyset pagination cursors.
    */
   const api = new $.fn.dataTable.Api(settings);
   const state = api.state.loaded();
@@ -333,17 +378,24 @@ $(document).on('preInit.dt', function initCustomFilter(event, settings) {
   const table = $(event.target);
 
   const customFilter = table.data('custom-filter');
-  if (customFilter) {
-    settings.ajax.data = function setDatatablesFilter(data) {
-      // This is the HTML node wrapping around the table with the special search, filter, etc.
-      const dataTableContainer = $(table.DataTable().table().container());
-      const customFilterInput = dataTableContainer.find('.custom_filter__input');
-
-      // 1: the filter checkbox is visible.
-      if ((customFilterInput.length && !customFilterInput.is(':checked')) ||
-        // 2: the table isn't visible yet but a filter value is present in the local storage.
-        (!customFilterInput.length && state && state.customFilter)) {
-        data.filter = customFilter;
+  const keyset = table.data('keyset');
+  if (customFilter || keyset) {
+    settings.ajax.data = function setDatatablesParameters(data) {
+      if (customFilter) {
+        // This is the HTML node wrapping around the table with the special search, filter, etc.
+        const dataTableContainer = $(table.DataTable().table().container());
+        const customFilterInput = dataTableContainer.find('.custom_filter__input');
+
+        // 1: the filter checkbox is visible.
+        if ((customFilterInput.length && !customFilterInput.is(':checked')) ||
+          // 2: the table isn't visible yet but a filter value is present in the local storage.
+          (!customFilterInput.length && state && state.customFilter)) {
+          data.filter = customFilter;
+        }
+      }
+
+      if (keyset) {
+        addKeysetCursor(table, data);
       }
     };
   }
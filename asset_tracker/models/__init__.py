@@ -1,15 +1,16 @@
 import zope.sqlalchemy
 from sqlalchemy import engine_from_config
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import configure_mappers, sessionmaker
 
 # import or define all models here to ensure they are attached to the
 # Base.metadata prior to any initialization routines
-from asset_tracker.models.asset_tracker import Asset, Consumable, ConsumableFamily, Equipment, EquipmentFamily, Event, \
-    EventStatus, Site, Tenant, consumable_families_equipment_families
+from asset_tracker.models.asset_tracker import Asset, AssetSoftware, ConfigFile, Consumable, ConsumableFamily, \
+    Equipment, EquipmentFamily, Event, EventStatus, Site, Tenant, consumable_families_equipment_families
 
 _ = (
-    Asset, consumable_families_equipment_families, Consumable, ConsumableFamily, Equipment, EquipmentFamily, Event,
-    EventStatus, Site, Tenant,
+    Asset, AssetSoftware, ConfigFile, consumable_families_equipment_families, Consumable, ConsumableFamily, Equipment,
+    EquipmentFamily, Event, EventStatus, Site, Tenant,
 )
 
 # run configure_mappers after defining all of the models to ensure
@@ -25,6 +26,18 @@ def get_engine(settings):
     return engine_from_config(settings, connect_args=connect_args)
 
 
+def get_insert(db_session):
+    """Get the insert construct of the db dialect, which handles ON CONFLICT clauses.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+
+    Returns:
+        function: postgresql.insert or sqlite.insert.
+    """
+    return sqlite.insert if db_session.get_bind().dialect.name == 'sqlite' else postgresql.insert
+
+
 def get_session_factory(engine):
     return sessionmaker(bind=engine)
 
@@ -1,21 +1,57 @@
-from json import loads
-
 from dateutil.relativedelta import relativedelta
 from parsys_utilities import random_id
 from parsys_utilities.sql.model import CreationDateTimeMixin, Model, TZDateTime
-from sqlalchemy import Boolean, Column, Date, ForeignKey, Integer, Table, Unicode as String, UniqueConstraint, asc, \
-    desc, select
+from sqlalchemy import DDL, Boolean, Column, Date, ForeignKey, Index, Integer, Table, Unicode as String, \
+    UniqueConstraint, asc, desc, event, func, select, text
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
 from asset_tracker.constants import WARRANTY_DURATION_YEARS
 
+# Statuses whose first event date is an asset milestone.
+MILESTONES_STATUSES = {
+    'stock_parsys': 'production',
+    'transit_customer': 'delivery',
+    'service': 'activation',
+}
+MILESTONES = [*MILESTONES_STATUSES.values(), 'calibration_date']
+
+# Trigram indexes (PostgreSQL only) need the pg_trgm extension.
+event.listen(
+    Model.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+
+
+def get_trigram_index(name, column):
+    """Get a trigram index, used by the lists search (ILIKE '%search%'), see api.keyset.get_search_filter.
+
+    Args:
+        name (str): index name.
+        column (str): column name.
+
+    Returns:
+        sqlalchemy.Index: created on PostgreSQL only.
+    """
+    index = Index(name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+    return index.ddl_if(dialect='postgresql')
+
 
 class Asset(Model, CreationDateTimeMixin):
+    __table_args__ = (
+        # Keyset pagination of the assets list (NULLs sorted as empty values), see api.keyset.
+        Index('ix_asset_keyset_calibration_next', text("coalesce(calibration_next, '0001-01-01')"), 'id'),
+        Index('ix_asset_keyset_customer_name', text("coalesce(customer_name, '')"), 'id'),
+        # Search.
+        get_trigram_index('ix_asset_asset_id_trgm', 'asset_id'),
+        get_trigram_index('ix_asset_current_location_trgm', 'current_location'),
+    )
+
     asset_id = Column(String, nullable=False, unique=True)
-    tenant_id = Column(Integer, ForeignKey('tenant.id'), nullable=False)
+    tenant_id = Column(Integer, ForeignKey('tenant.id'), nullable=False, index=True)
     tenant = relationship('Tenant', foreign_keys=tenant_id, uselist=False, back_populates='assets')
-    user_id = Column(String)  # Received from RTA during station creation/update.
+    user_id = Column(String, index=True)  # Received from RTA during station creation/update.
 
     @hybrid_property
     def is_linked(self):
@@ -34,19 +70,28 @@ class Asset(Model, CreationDateTimeMixin):
     customer_id = Column(String)
     customer_name = Column(String)
 
-    site_id = Column(Integer, ForeignKey('site.id'))
+    site_id = Column(Integer, ForeignKey('site.id'), index=True)
     site = relationship('Site', foreign_keys=site_id, uselist=False, back_populates='assets')
 
     current_location = Column(String)
     notes = Column(String)
 
     calibration_frequency = Column(Integer)
-    calibration_next = Column(Date)
+    calibration_next = Column(Date, index=True)
+
+    # Lifecycle milestones, stored so that reading them doesn't query the asset history.
+    production = Column(Date)
+    delivery = Column(Date)
+    activation = Column(Date)
+    calibration_date = Column(Date)  # Last calibration event.
+
+    config_hash = Column(String)  # Hash of the last configuration received, see Event.config_hash.
 
     status_id = Column(Integer, ForeignKey('event_status.id'), nullable=False)
     status = relationship('EventStatus', foreign_keys=status_id, uselist=False)
 
     equipments = relationship('Equipment', back_populates='asset')
+    softwares = relationship('AssetSoftware', back_populates='asset', cascade='all, delete-orphan')
 
     _history = relationship('Event', lazy='dynamic', back_populates='asset')
 
@@ -57,7 +102,11 @@ class Asset(Model, CreationDateTimeMixin):
             asset_tracker.models.Event.
         """
         self._history.append(event)
-        self.status = self.history('desc', filter_config=True).first().status
+        # Config events (software/configuration updates) are excluded from the status history (filter_config), so they
+        # can't change the asset status: skip the history query, run for each product of each station report.
+        if event.status.status_type != 'config':
+            self.status = self.history('desc', filter_config=True).first().status
+        self._update_dates_with_event(event)
 
     def history(self, order, filter_config=False):
         """Filter removed events from history.
@@ -93,87 +142,159 @@ class Asset(Model, CreationDateTimeMixin):
             .where(EventStatus.id == cls.status_id) \
             .scalar_subquery()
 
-    def _get_asset_dates(self):
-        """Compute all the dates in one method to avoid too many sql request."""
-        self._asset_dates = {}
-        asset_history = self.history('asc').join(Event.status)
-        asset_history_desc = self.history('desc').join(Event.status)
-
-        production = asset_history.filter(EventStatus.status_id == 'stock_parsys').first()
-        self._asset_dates['production'] = production.date if production else None
+    def compute_dates(self):
+        """Compute the asset milestones dates from its history.
 
-        delivery = asset_history.filter(EventStatus.status_id == 'transit_customer').first()
-        self._asset_dates['delivery'] = delivery.date if delivery else None
+        Returns:
+            dict: milestone column => date.
+        """
+        asset_history = self.history('asc').join(Event.status)
+        dates = {}
 
-        activation = asset_history.filter(EventStatus.status_id == 'service').first()
-        self._asset_dates['activation'] = activation.date if activation else None
-        self._asset_dates['warranty_end'] = (
-            activation.date + relativedelta(years=WARRANTY_DURATION_YEARS)
-            if not self.is_decommissioned and activation
-            else None
-        )
+        for status_id, milestone in MILESTONES_STATUSES.items():
+            event = asset_history.filter(EventStatus.status_id == status_id).first()
+            dates[milestone] = event.date if event else None
 
-        if self.asset_type == 'consumables_case':
-            self._asset_dates['calibration_last'] = None
-        else:
-            calibration_last = asset_history_desc.filter(EventStatus.status_id == 'calibration').first()
-            for status in ['calibration_last', 'production', 'delivery', 'activation']:
-                if locals().get(status):
-                    self._asset_dates['calibration_last'] = locals()[status].date
-                    break
-            else:
-                self._asset_dates['calibration_last'] = None
+        calibration = self.history('desc').join(Event.status).filter(EventStatus.status_id == 'calibration').first()
+        dates['calibration_date'] = calibration.date if calibration else None
 
-    @property
-    def asset_dates(self):
-        if not hasattr(self, '_asset_dates'):
-            self._get_asset_dates()
-        return self._asset_dates
+        return dates
 
-    @hybrid_property
-    def activation(self):
-        """Get the date of the asset first activation.
+    def update_dates(self, dates=None):
+        """Update the asset milestones dates from its history. Needed when events are removed, as the dates can't be
+        updated incrementally in this case.
 
-        Returns:
-            datetime.date.
+        Args:
+            dates (dict): milestones dates already computed with load_asset_dates.
         """
-        return self.asset_dates['activation']
+        if dates is None:
+            dates = self.compute_dates()
 
-    @hybrid_property
-    def calibration_last(self):
-        """Get the date of the asset last calibration.
+        for milestone, milestone_date in dates.items():
+            setattr(self, milestone, milestone_date)
 
-        Returns:
-            datetime.date.
+    def update_softwares(self):
+        """Update the asset current software versions from its history. Needed when events are removed, as the
+        versions can't be updated incrementally in this case.
+        """
+        software_updates = self.history('asc') \
+            .filter(Event.software_name.is_not(None), Event.software_version.is_not(None))
+        # Last update of each software, in the history order.
+        last_updates = {software_event.software_name: software_event for software_event in software_updates}
+
+        for software in list(self.softwares):
+            if software.product not in last_updates:
+                self.softwares.remove(software)
+
+        softwares = {software.product: software for software in self.softwares}
+        for product, software_event in last_updates.items():
+            software = softwares.get(product)
+            if not software:
+                software = AssetSoftware(product=product, last_seen_at=software_event.created_at)
+                self.softwares.append(software)
+            software.version = software_event.software_version
+
+    def update_config_hash(self):
+        """Update the asset current configuration hash from its history. Needed when events are removed, as a removed
+        configuration can't be compared with the next uploads.
         """
-        return self.asset_dates['calibration_last']
+        last_config = self.history('desc').filter(Event.config_file_id.is_not(None)).first()
+        self.config_hash = last_config.config_hash if last_config else None
 
-    @hybrid_property
-    def delivery(self):
-        """Get the date of the asset first activation.
+    def _update_dates_with_event(self, event):
+        """Update incrementally the asset milestones dates with a new event.
 
-        Returns:
-            datetime.date.
+        Args:
+            event (asset_tracker.models.Event).
         """
-        return self.asset_dates['delivery']
+        status_id = event.status.status_id
+        milestone = MILESTONES_STATUSES.get(status_id)
+        if milestone:
+            # Events are sorted by date, then creation date: for the same date, the oldest event is the first one.
+            milestone_date = getattr(self, milestone)
+            if not milestone_date or event.date < milestone_date:
+                setattr(self, milestone, event.date)
+
+        elif status_id == 'calibration':
+            if not self.calibration_date or event.date >= self.calibration_date:
+                self.calibration_date = event.date
 
-    @hybrid_property
-    def production(self):
-        """Get the date of the asset production.
+    @property
+    def calibration_last(self):
+        """Get the date of the asset last calibration. If the asset was never calibrated, use its first milestone.
 
         Returns:
             datetime.date.
         """
-        return self.asset_dates['production']
+        if self.asset_type == 'consumables_case':
+            return None
 
-    @hybrid_property
+        return self.calibration_date or self.production or self.delivery or self.activation
+
+    @property
     def warranty_end(self):
         """Get the date of the end of the asset warranty.
 
         Returns:
             datetime.date.
         """
-        return self.asset_dates['warranty_end']
+        if not self.activation or self.is_decommissioned:
+            return None
+
+        return self.activation + relativedelta(years=WARRANTY_DURATION_YEARS)
+
+
+def load_asset_dates(db_session, assets_ids):
+    """Compute the milestones dates of several assets from their histories in one query. Same result as
+    Asset.compute_dates, without querying the history of each asset.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+        assets_ids (list): assets primary keys.
+
+    Returns:
+        dict: asset primary key => (milestone column => date).
+    """
+    milestones = [
+        func.min(Event.date).filter(EventStatus.status_id == status_id).label(milestone)
+        for status_id, milestone in MILESTONES_STATUSES.items()
+    ]
+    milestones.append(func.max(Event.date).filter(EventStatus.status_id == 'calibration').label('calibration_date'))
+
+    histories = db_session.query(Event.asset_id, *milestones) \
+        .join(Event.status) \
+        .filter(Event.asset_id.in_(assets_ids), ~Event.removed) \
+        .group_by(Event.asset_id)
+
+    # Assets without history have no dates.
+    assets_dates = {asset_id: dict.fromkeys(MILESTONES) for asset_id in assets_ids}
+    for history in histories:
+        assets_dates[history.asset_id] = {milestone: getattr(history, milestone) for milestone in MILESTONES}
+
+    return assets_dates
+
+
+class AssetSoftware(Model):
+    """Current version of each software (product) of an asset, to avoid scanning the software updates history."""
+
+    __table_args__ = (
+        UniqueConstraint('asset_id', 'product'),
+    )
+
+    asset_id = Column(Integer, ForeignKey('asset.id'), nullable=False)
+    asset = relationship('Asset', foreign_keys=asset_id, uselist=False, back_populates='softwares')
+
+    product = Column(String, nullable=False)
+    version = Column(String, nullable=False)
+    last_seen_at = Column(TZDateTime, nullable=False)
+
+
+class ConfigFile(Model):
+    """Configuration file stored in the depot, see asset_tracker.configs."""
+
+    config_hash = Column(String, nullable=False, unique=True)
+    file_id = Column(String, nullable=False, unique=True)
+    references = Column(Integer, nullable=False, default=0)
 
 
 class Consumable(Model):
@@ -183,7 +304,7 @@ class Consumable(Model):
     equipment_id = Column(Integer, ForeignKey('equipment.id'), nullable=False)
     equipment = relationship('Equipment', foreign_keys=equipment_id, uselist=False, back_populates='consumables')
 
-    expiration_date = Column(Date)
+    expiration_date = Column(Date, index=True)
 
 
 # Association table between consumable families and equipment families (n to n).
@@ -228,6 +349,27 @@ class EquipmentFamily(Model):
 
 
 class Event(Model, CreationDateTimeMixin):
+    __table_args__ = (
+        # Asset.history.
+        Index(
+            'ix_event_asset_id_date_created_at',
+            'asset_id',
+            'date',
+            'created_at',
+            postgresql_where=text('NOT removed'),
+            sqlite_where=text('NOT removed'),
+        ),
+        # Last version of a given software.
+        Index(
+            'ix_event_asset_id_software_name_created_at',
+            'asset_id',
+            'software_name',
+            'created_at',
+            postgresql_where=text('software_name IS NOT NULL'),
+            sqlite_where=text('software_name IS NOT NULL'),
+        ),
+    )
+
     event_id = Column(String, default=random_id, nullable=False, unique=True)
 
     asset_id = Column(Integer, ForeignKey('asset.id'), nullable=False)
@@ -246,19 +388,17 @@ class Event(Model, CreationDateTimeMixin):
     status_id = Column(Integer, ForeignKey('event_status.id'), nullable=False)
     status = relationship('EventStatus', foreign_keys=status_id, uselist=False)
 
-    extra = Column(String)
+    # Software update.
+    software_name = Column(String)
+    software_version = Column(String)
 
-    @property
-    def extra_json(self):
-        """Return dictionary from extra.
+    # Configuration update: depot file id and hash of the configuration.
+    config_file_id = Column(String, index=True)
+    config_hash = Column(String, index=True)
 
-        Returns:
-            dict.
-        """
-        try:
-            return loads(self.extra)
-        except TypeError:
-            return {}
+    # Site change: new site and tenant public ids (site_id/tenant_id, not primary keys).
+    new_site_id = Column(String, index=True)
+    new_tenant_id = Column(String)
 
 
 class EventStatus(Model):
@@ -282,6 +422,15 @@ class EventStatus(Model):
 
 
 class Site(Model, CreationDateTimeMixin):
+    __table_args__ = (
+        # Search.
+        get_trigram_index('ix_site_contact_trgm', 'contact'),
+        get_trigram_index('ix_site_email_trgm', 'email'),
+        get_trigram_index('ix_site_name_trgm', 'name'),
+        get_trigram_index('ix_site_phone_trgm', 'phone'),
+        get_trigram_index('ix_site_site_type_trgm', 'site_type'),
+    )
+
     site_id = Column(String, default=random_id, nullable=False, unique=True)
     tenant_id = Column(Integer, ForeignKey('tenant.id'), nullable=False)
     tenant = relationship('Tenant', foreign_keys=tenant_id, uselist=False, back_populates='sites')
@@ -297,6 +446,11 @@ class Site(Model, CreationDateTimeMixin):
 
 
 class Tenant(Model):
+    __table_args__ = (
+        # Search.
+        get_trigram_index('ix_tenant_name_trgm', 'name'),
+    )
+
     tenant_id = Column(String, nullable=False, unique=True)
     name = Column(String, nullable=False)
 
@@ -0,0 +1,168 @@
+"""Stations reports: software versions and configurations sent by the stations through the software API.
+
+Reports are plain dicts, so that they can be applied in the request or queued and applied later by a worker:
+    product (str): product name.
+    version (str): software version, optional.
+    config (dict): configuration, optional.
+    config_hash (str): hash of the configuration.
+    creator_id (str), creator_alias (str): user who sent the report.
+    date (str): ISO date of the report.
+    received_at (str): ISO datetime of the report.
+"""
+
+from datetime import date, datetime
+
+from parsys_utilities.dates import utc_now
+
+from asset_tracker import models
+from asset_tracker.configs import get_config_hash, store_config
+from asset_tracker.models import get_insert
+
+
+def create_report(request, product, software_version=None, config=None):
+    """Create a report received from a station.
+
+    Args:
+        request (pyramid.request.Request).
+        product (str).
+        software_version (str).
+        config (dict).
+
+    Returns:
+        dict: report.
+    """
+    return {
+        'product': product,
+        'version': software_version,
+        'config': config,
+        'config_hash': get_config_hash(config) if config else None,
+        'creator_id': request.user.id,
+        'creator_alias': request.user.alias,
+        'date': date.today().isoformat(),
+        'received_at': utc_now().isoformat(),
+    }
+
+
+def collapse_reports(reports):
+    """Remove the reports identical to the previous report of the same product, order is preserved.
+
+    Args:
+        reports (list): reports, oldest first.
+
+    Returns:
+        list: reports.
+    """
+    collapsed = []
+    last_reports = {}
+    for report in reports:
+        key = (report['version'], report['config_hash'])
+        last_report = last_reports.get(report['product'])
+        if last_report and last_report[0] == key:
+            # Same data, only the station last report time changes.
+            last_report[1]['received_at'] = report['received_at']
+            continue
+
+        last_reports[report['product']] = (key, report)
+        collapsed.append(report)
+
+    return collapsed
+
+
+def apply_reports(request, asset, reports):
+    """Create the software and configuration update events of the reports of an asset.
+
+    Args:
+        request (pyramid.request.Request).
+        asset (asset_tracker.models.Asset).
+        reports (list): reports, oldest first.
+    """
+    # The current versions of all the asset softwares are loaded at once.
+    asset_softwares = {software.product: software for software in asset.softwares}
+
+    for report in reports:
+        if report['version']:
+            asset_software = asset_softwares.get(report['product'])
+            if not asset_software:
+                asset_software = get_asset_software(request.db_session, asset, report['product'])
+                asset_softwares[report['product']] = asset_software
+
+            create_version_update_event(request, asset, asset_software, report)
+
+        if report['config']:
+            create_config_update_event(request, asset, report)
+
+
+def get_asset_software(db_session, asset, product):
+    """Get the current version of an asset software, created if needed. The first reports of a software can be applied
+    concurrently (by requests or workers), so the row is upserted.
+
+    Args:
+        db_session (sqlalchemy.orm.session.Session).
+        asset (asset_tracker.models.Asset).
+        product (str).
+
+    Returns:
+        asset_tracker.models.AssetSoftware: with an empty version if it was just created.
+    """
+    statement = get_insert(db_session)(models.AssetSoftware) \
+        .values(asset_id=asset.id, product=product, version='', last_seen_at=utc_now()) \
+        .on_conflict_do_nothing(index_elements=['asset_id', 'product'])
+    db_session.execute(statement)
+    # The asset softwares collection doesn't know about the inserted row.
+    db_session.expire(asset, ['softwares'])
+
+    return db_session.query(models.AssetSoftware).filter_by(asset_id=asset.id, product=product).one()
+
+
+def create_config_update_event(request, asset, report):
+    """Create event if configuration file changed. Configurations are compared by hash, so that the last
+    configuration doesn't have to be read from the depot.
+
+    Args:
+        request (pyramid.request.Request).
+        asset (asset_tracker.models.Asset).
+        report (dict).
+    """
+    config_hash = report['config_hash']
+    if asset.config_hash == config_hash:
+        return
+
+    new_event = models.Event(
+        creator_id=report['creator_id'],
+        creator_alias=report['creator_alias'],
+        date=date.fromisoformat(report['date']),
+        config_file_id=store_config(request.db_session, report['config'], config_hash),
+        config_hash=config_hash,
+        status=request.get_status('config_update'),
+    )
+    asset.add_event(new_event)
+    asset.config_hash = config_hash
+    request.db_session.add(new_event)
+
+
+def create_version_update_event(request, asset, asset_software, report):
+    """Create event if software version was updated. The asset current version is stored so that we don't have to
+    go through the history to find it.
+
+    Args:
+        request (pyramid.request.Request).
+        asset (asset_tracker.models.Asset).
+        asset_software (asset_tracker.models.AssetSoftware).
+        report (dict).
+    """
+    # Reports are applied in order.
+    asset_software.last_seen_at = datetime.fromisoformat(report['received_at'])
+
+    software_version = report['version']
+    if asset_software.version != software_version:
+        asset_software.version = software_version
+        new_event = models.Event(
+            creator_id=report['creator_id'],
+            creator_alias=report['creator_alias'],
+            date=date.fromisoformat(report['date']),
+            software_name=report['product'],
+            software_version=software_version,
+            status=request.get_status('software_update'),
+        )
+        asset.add_event(new_event)
+        request.db_session.add(new_event)
@@ -6,6 +6,7 @@ from pyramid.paster import bootstrap
 from pyramid.scripts.common import parse_vars
 
 from asset_tracker import models
+from asset_tracker.configs import release_config
 
 
 def main():
@@ -25,7 +26,7 @@ def main():
             .filter(models.EventStatus.status_id == 'config_update')
         for event in events:
             try:
-                config_file = depot.get(event.extra_json['config'])
+                config_file = depot.get(event.config_file_id)
                 config = config_file.read().decode('utf-8')
             except (json.JSONDecodeError, OSError, TypeError, ValueError) as error:
                 print(f'{event.id}: {error}')
@@ -33,7 +34,7 @@ def main():
 
             if config == 'null':
                 print(f'{event.id}: "null" file, deleting.')
-                depot.delete(event.extra_json['config'])
+                release_config(db_session, event.config_file_id)
                 db_session.delete(event)
 
     print('Done.')
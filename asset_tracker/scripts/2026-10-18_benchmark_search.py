@@ -0,0 +1,119 @@
+"""18/10/2026: benchmark the assets list search, ILIKE on the joined tables vs trigram indexes (api.keyset).
+
+The PostgreSQL database must be empty: tables are created and seeded with a large dataset, then dropped.
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import create_engine, or_, text
+from sqlalchemy.orm import Session
+
+from asset_tracker import models
+from asset_tracker.api.keyset import get_search_filter
+
+NB_TENANTS = 100
+NB_SITES = 10000
+
+SEED_QUERIES = [
+    """
+    INSERT INTO tenant (tenant_id, name)
+    SELECT 'tenant' || i, 'Tenant ' || i FROM generate_series(1, :nb_tenants) AS i
+    """,
+    """
+    INSERT INTO event_status (status_id, position, status_type, _label)
+    VALUES ('service', 1, 'event', 'In service')
+    """,
+    """
+    INSERT INTO site (site_id, tenant_id, name, site_type, contact, phone, email, created_at)
+    SELECT 'site' || i, 1 + i % :nb_tenants, 'Site ' || i, 'Hospital', 'Contact ' || i, '+33 1 23 45 ' || i,
+        'contact' || i || '@example.com', now()
+    FROM generate_series(1, :nb_sites) AS i
+    """,
+    """
+    INSERT INTO asset (asset_id, tenant_id, site_id, asset_type, current_location, status_id, created_at)
+    SELECT 'asset' || i, 1 + i % :nb_tenants, CASE WHEN i % 5 = 0 THEN NULL ELSE 1 + i % :nb_sites END, 'station',
+        'Room ' || i % 1000, 1, now()
+    FROM generate_series(1, :nb_assets) AS i
+    """,
+]
+
+SEARCH_ATTRIBUTES = [models.Asset.asset_id, models.Asset.current_location, models.Site.name, models.Tenant.name]
+
+
+def get_ilike_filter(search):
+    """Get the search filter used before the trigram indexes.
+
+    Args:
+        search (str).
+
+    Returns:
+        sqlalchemy.sql.ColumnElement.
+    """
+    return or_(*(attribute.ilike(f'%{search}%') for attribute in SEARCH_ATTRIBUTES))
+
+
+def time_search(db_session, search_filter, runs):
+    """Time the search of a page of the assets list (count and first page, like api.keyset.keyset_search).
+
+    Args:
+        db_session (sqlalchemy.orm.Session).
+        search_filter (sqlalchemy.sql.ColumnElement).
+        runs (int).
+
+    Returns:
+        tuple: median duration (ms), number of assets found.
+    """
+    query = db_session.query(models.Asset) \
+        .join(models.Asset.tenant) \
+        .outerjoin(models.Asset.site) \
+        .filter(search_filter)
+
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        count = query.order_by(None).count()
+        query.order_by(models.Asset.asset_id).limit(10).all()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(durations), count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('postgresql_url', help='URL of an empty PostgreSQL database')
+    parser.add_argument('--assets', type=int, default=500000, help='number of assets')
+    parser.add_argument('--runs', type=int, default=5, help='runs per search')
+    parser.add_argument('searches', nargs='*', default=['asset12345', 'room 42', 'site 9999', 'tenant 7', 'nothing'])
+    args = parser.parse_args()
+
+    engine = create_engine(args.postgresql_url)
+    models.Asset.metadata.create_all(engine)
+
+    try:
+        print(f'Seeding {args.assets} assets...')
+        with engine.begin() as connection:
+            for query in SEED_QUERIES:
+                parameters = {'nb_assets': args.assets, 'nb_sites': NB_SITES, 'nb_tenants': NB_TENANTS}
+                connection.execute(text(query), parameters)
+
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+        print(f'{"search":<15}{"found":>10}{"ILIKE (ms)":>15}{"trigram (ms)":>15}')
+        with Session(bind=engine) as db_session:
+            for search in args.searches:
+                ilike_duration, count = time_search(db_session, get_ilike_filter(search), args.runs)
+                trigram_filter = get_search_filter(models.Asset.id, SEARCH_ATTRIBUTES, search)
+                trigram_duration, trigram_count = time_search(db_session, trigram_filter, args.runs)
+                assert trigram_count == count, search
+                print(f'{search:<15}{count:>10}{ilike_duration:>15.1f}{trigram_duration:>15.1f}')
+
+    finally:
+        models.Asset.metadata.drop_all(engine)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
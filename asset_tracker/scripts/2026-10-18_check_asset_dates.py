@@ -0,0 +1,49 @@
+"""18/10/2026: check that the stored assets milestones dates match the assets histories."""
+
+import argparse
+from itertools import islice
+
+from parsys_utilities.sql import windowed_query
+from pyramid.paster import bootstrap
+from pyramid.scripts.common import parse_vars
+
+from asset_tracker import models
+from asset_tracker.models.asset_tracker import load_asset_dates
+
+WINDOW_SIZE = 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file')
+    parser.add_argument('--fix', action='store_true', help='update the inconsistent dates')
+    args, extras = parser.parse_known_args()
+
+    print('Checking assets dates...')
+
+    options = parse_vars(extras)
+    with bootstrap(args.config_file, options=options) as env, env['request'].tm:
+        db_session = env['request'].db_session
+
+        errors = 0
+        assets = db_session.query(models.Asset).order_by(models.Asset.asset_id)
+        assets = windowed_query(assets, models.Asset.asset_id, WINDOW_SIZE)
+        while window := list(islice(assets, WINDOW_SIZE)):
+            assets_dates = load_asset_dates(db_session, [asset.id for asset in window])
+
+            for asset in window:
+                dates = assets_dates[asset.id]
+                for milestone, milestone_date in dates.items():
+                    stored_date = getattr(asset, milestone)
+                    if stored_date != milestone_date:
+                        errors += 1
+                        print(f'{asset.asset_id}: {milestone} is {stored_date}, should be {milestone_date}.')
+
+                if args.fix:
+                    asset.update_dates(dates)
+
+    print(f'Done, {errors} error(s){" fixed" if args.fix else ""}.')
+
+
+if __name__ == '__main__':
+    main()
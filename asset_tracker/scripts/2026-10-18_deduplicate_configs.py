@@ -0,0 +1,131 @@
+"""18/10/2026: deduplicate the configuration files of the depot, see asset_tracker.configs.
+
+The app can run meanwhile: the references are counted in the db at the end, from the events which aren't removed.
+"""
+
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from depot.manager import DepotManager
+from parsys_utilities.sql import windowed_query
+from pyramid.paster import bootstrap
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import func, select, update
+from zope.sqlalchemy import mark_changed
+
+from asset_tracker import models
+from asset_tracker.configs import get_config_hash
+
+WINDOW_SIZE = 1000
+
+
+def read_config(file_id):
+    """Get the hash and the size of a configuration file.
+
+    Args:
+        file_id (str): depot file id.
+
+    Returns:
+        tuple: file id, hash, size (or error).
+    """
+    try:
+        config_file = DepotManager.get().get(file_id)
+        content = config_file.read()
+        config_file.close()
+        return file_id, get_config_hash(json.loads(content.decode('utf-8'))), len(content)
+    except (json.JSONDecodeError, OSError, TypeError, ValueError) as error:
+        return file_id, None, error
+
+
+def delete_file(file_id):
+    """Delete a file from the depot.
+
+    Args:
+        file_id (str): depot file id.
+    """
+    DepotManager.get().delete(file_id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file')
+    parser.add_argument('--dry-run', action='store_true', help="don't update the db or delete files")
+    parser.add_argument('--workers', type=int, default=8, help='number of files read/deleted in parallel')
+    args, extras = parser.parse_known_args()
+
+    print('Deduplicating configs...')
+
+    options = parse_vars(extras)
+    with bootstrap(args.config_file, options=options) as env, env['request'].tm:
+        db_session = env['request'].db_session
+
+        events = db_session.query(models.Event) \
+            .join(models.Event.status) \
+            .filter(models.EventStatus.status_id == 'config_update', models.Event.config_file_id.is_not(None))
+        events = windowed_query(events, models.Event.id, WINDOW_SIZE)
+
+        # Files already stored by hash are kept.
+        config_files = {config_file.config_hash: config_file for config_file in db_session.query(models.ConfigFile)}
+        kept_files = {config_file.file_id for config_file in config_files.values()}
+        # Files read in the previous windows: file id => config file (None if unreadable).
+        read_files = {}
+
+        duplicates = []
+        reclaimed_space = 0
+        # Reading files is I/O bound, threads are enough.
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            # Oldest events first, so that the oldest copy of each configuration is kept.
+            while window := list(islice(events, WINDOW_SIZE)):
+                window = [event for event in window if event.config_file_id not in kept_files]
+                new_files = list(dict.fromkeys(e.config_file_id for e in window if e.config_file_id not in read_files))
+
+                for file_id, config_hash, size in executor.map(read_config, new_files):
+                    if not config_hash:
+                        print(f'{file_id}: {size}')
+                        read_files[file_id] = None
+                        continue
+
+                    config_file = config_files.get(config_hash)
+                    if config_file:
+                        duplicates.append(file_id)
+                        reclaimed_space += size
+                    else:
+                        config_file = models.ConfigFile(config_hash=config_hash, file_id=file_id, references=0)
+                        config_files[config_hash] = config_file
+                        if not args.dry_run:
+                            db_session.add(config_file)
+                    read_files[file_id] = config_file
+
+                if args.dry_run:
+                    continue
+
+                for event in window:
+                    config_file = read_files[event.config_file_id]
+                    if config_file:
+                        event.config_hash = config_file.config_hash
+                        event.config_file_id = config_file.file_id
+                db_session.flush()
+
+        if not args.dry_run:
+            # Not incremented in Python, which would overwrite the concurrent increments of store_config.
+            references = select(func.count(models.Event.id)) \
+                .where(models.Event.config_file_id == models.ConfigFile.file_id, ~models.Event.removed) \
+                .scalar_subquery()
+            db_session.execute(
+                update(models.ConfigFile).values(references=references),
+                execution_options={'synchronize_session': False},
+            )
+            mark_changed(db_session)
+
+    # Files are deleted once the events pointing to them are committed.
+    if not args.dry_run:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(delete_file, duplicates))
+
+    print(f'Done, {len(duplicates)} duplicate(s), {reclaimed_space / 1024 / 1024:.2f} MB reclaimed.')
+
+
+if __name__ == '__main__':
+    main()
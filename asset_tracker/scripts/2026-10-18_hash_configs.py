@@ -0,0 +1,77 @@
+"""18/10/2026: compute the hashes of the existing configuration files."""
+
+import argparse
+import json
+from itertools import islice
+
+from depot.manager import DepotManager
+from parsys_utilities.sql import windowed_query
+from pyramid.paster import bootstrap
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import desc, select, update
+from zope.sqlalchemy import mark_changed
+
+from asset_tracker import models
+from asset_tracker.configs import get_config_hash
+
+WINDOW_SIZE = 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file')
+    args, extras = parser.parse_known_args()
+
+    print('Hashing configs...')
+
+    options = parse_vars(extras)
+    with bootstrap(args.config_file, options=options) as env, env['request'].tm:
+        db_session = env['request'].db_session
+        depot = DepotManager.get()
+
+        events = db_session.query(models.Event) \
+            .join(models.Event.status) \
+            .filter(
+                models.EventStatus.status_id == 'config_update',
+                models.Event.config_hash.is_(None),
+                ~models.Event.removed,
+            )
+        events = windowed_query(events, models.Event.id, WINDOW_SIZE)
+        while window := list(islice(events, WINDOW_SIZE)):
+            for event in window:
+                try:
+                    config_file = depot.get(event.config_file_id)
+                    config = json.loads(config_file.read().decode('utf-8'))
+                except (json.JSONDecodeError, OSError, TypeError, ValueError) as error:
+                    print(f'{event.id}: {error}')
+                    continue
+
+                event.config_hash = get_config_hash(config)
+
+            db_session.flush()
+
+        # Each asset keeps the hash of its last configuration (None if it couldn't be read), like
+        # Asset.update_config_hash, in one statement instead of loading the assets.
+        last_config_hash = select(models.Event.config_hash) \
+            .where(
+                models.Event.asset_id == models.Asset.id,
+                models.Event.config_file_id.is_not(None),
+                ~models.Event.removed,
+            ) \
+            .order_by(desc(models.Event.date), desc(models.Event.created_at)) \
+            .limit(1) \
+            .scalar_subquery()
+        configured_assets = select(models.Event.asset_id).where(models.Event.config_file_id.is_not(None))
+        db_session.execute(
+            update(models.Asset)
+            .where(models.Asset.id.in_(configured_assets))
+            .values(config_hash=last_config_hash),
+            execution_options={'synchronize_session': False},
+        )
+        mark_changed(db_session)
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
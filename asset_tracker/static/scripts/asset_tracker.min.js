@@ -1 +1 @@
-function manageSites(){$("#site__reference").clone().prop("id","site_id").prop("name","site_id").appendTo("#site__options");const e=$("#tenant_id").find("option:selected").val();$("#site_id").children("option").each((function(){$(this).data("tenant-id")&&$(this).data("tenant-id")!==e&&$(this).remove()}))}function manageCalibrationFrequency(){const e=$("#asset_type"),t=$("#calibration_frequency").parent();"consumables_case"===e.val()?t.addClass("hidden"):t.removeClass("hidden")}function setActiveMenu(e){e.removeClass("active");const t=window.location.pathname.split("/",2).join("/");e.find(`a[href="${t}/"]`).parent("li").addClass("active")}$(document).on("change","#tenant_id",(function(){let e=$("#site_id");e.select2("destroy"),e.remove(),manageSites(),e=$("#site_id"),e.val(""),e.select2({theme:"bootstrap",width:"100%"})})),$(document).on("change","#asset_type",manageCalibrationFrequency),$(document).on("click",".equipment__add",(function(e){e.stopPropagation();const t=$(this).closest(".panel.panel-default");t.removeClass("no-equipment"),t.find(".collapse").collapse("show");const n=$("#equipments__reference").clone();let a=0;$(".equipment__block").each((function(){$(this).data("equipments-counter")>a&&(a=$(this).data("equipments-counter"))})),a+=1;const o=n.find(".equipment__family"),i=o.eq(0).attr("id"),s=`${a}#${i}`;$(`label[for="${i}"]`).attr("for",s),o.attr("id",s).attr("name",s);const c=n.find(".equipment__serial_number"),r=c.eq(0).attr("id"),l=`${a}#${r}`;$(`label[for="${r}"]`).attr("for",l),c.attr("id",l).attr("name",l),n.attr("data-equipments-counter",a).removeAttr("id").removeClass("hidden").appendTo("#equipments__list"),n.find("select").select2({theme:"bootstrap",width:"100%"})})),$(document).on("click",".equipment__remove",(function(){2===$(".equipment__block").length&&(console.log($(this).closest(".panel.panel-default")),$(this).closest(".panel.panel-default").addClass("no-equipment")),$(this).closest(".equipment__block").remove()})),$(document).on("change",".equipment__family",(function(e){const t=$(this).closest(".equipment__block"),n=t.find(".expiration_dates"),a=t.data("equipments-counter"),o=e.target.value;n.empty();const i=$("#equipments__container").data("consumables-families");if(i[o]){const e=Object.entries(i[o]);e.sort(((e,t)=>e[1].localeCompare(t[1]))),e.forEach((function(e){const t=$("#equipments_consumables__reference").clone().removeAttr("id").removeClass("hidden"),o=`${a}#${e[0]}-expiration_date`,i=t.find("label");i.attr("for",o),i.text(e[1]);t.find("input").attr("id",o).attr("name",o),n.append(t)}))}}));const DATATABLES_TRANSLATIONS={fr:{sProcessing:"Traitement en cours...",sSearch:"Rechercher&nbsp;:",sLengthMenu:"Afficher _MENU_ &eacute;l&eacute;ments",sInfo:"Affichage de l'&eacute;l&eacute;ment _START_ &agrave; _END_ sur _TOTAL_ &eacute;l&eacute;ments",sInfoEmpty:"Affichage de l'&eacute;l&eacute;ment 0 &agrave; 0 sur 0 &eacute;l&eacute;ments",sInfoFiltered:"(filtr&eacute; de _MAX_ &eacute;l&eacute;ments au total)",sInfoPostFix:"",sLoadingRecords:"Chargement en cours...",sZeroRecords:"Aucun &eacute;l&eacute;ment &agrave; afficher",sEmptyTable:"Aucune donn&eacute;e disponible dans le tableau",oPaginate:{sFirst:"Premier",sPrevious:"Pr&eacute;c&eacute;dent",sNext:"Suivant",sLast:"Dernier",sSeparator:"sur"},oAria:{sSortAscending:": activer pour trier la colonne par ordre croissant",sSortDescending:": activer pour trier la colonne par ordre d&eacute;croissant"}}};function addHrefToDataTablesRows(e,t){if(t.links){const n=jQuery.grep(t.links,(function(e){return"self"===e.rel}));$(e).find("td").each((function(){$(this).html()||$(this).html("&nbsp;"),$(this).wrapInner(`<a href="${n[0].href}"></a>`)}))}}function cancelColReorderEvents(){$(document).unbind("touchmove.ColReorder"),$(document).unbind("mousemove.ColReorder"),$(document).unbind("mouseup.ColReorder"),$(document).unbind("touchend.ColReorder")}function manageColumnsRender(e){const t=[];return e.find("th").each((function(){const e={},n=$(this).data("render");n&&(e.render=window[n]),t.push(e)})),t}function styleInactiveObjects(e,t){Object.prototype.hasOwnProperty.call(t,"is_active")&&!t.is_active&&$(e).addClass("warning")}function assetTrackerCallback(e,t){addHrefToDataTablesRows(e,t),styleInactiveObjects(e,t)}$((function(){const e=$("table.dataTables");if(!e)return;const t={serverSide:!0,ajax:{url:e.data("ajax-url")},stateSave:!0,pageLength:50,lengthChange:!1,responsive:{details:!1},processing:!0,columns:manageColumnsRender(e),rowCallback:assetTrackerCallback,colReorder:!0,colResize:{isEnabled:!0,isResizable:function(e){return!!e.sTitle},onResizeStart:cancelColReorderEvents,onResize:cancelColReorderEvents}};window.userLocale in DATATABLES_TRANSLATIONS&&(t.language=DATATABLES_TRANSLATIONS[window.userLocale]);const n=e.data("custom-filter");n&&(t.dom='<"row"<"col-sm-6"<"custom_filter checkbox">><"col-sm-6"f>><"row"<"col-sm-12"tr>><"row"<"col-sm-5"i><"col-sm-7"p>>');const a=e.DataTable(t);if(n){const t=$(a.table().container());t.find(".dataTables_info").css("padding-bottom","10px"),a.on("stateSaveParams.dt",(function(e,n,a){a.customFilter=!t.find(".custom_filter__input").is(":checked")}));const n=e.data("custom-filter-label"),o=a.state.loaded(),i=`<label><input class="custom_filter__input" type="checkbox"${o&&o.customFilter?"":" checked"}> ${n}</label>`;t.find(".custom_filter").html(i).css("padding","10px 0 0 10px"),a.state.save(),t.find(".custom_filter__input").on("change",a.draw)}e.on("preXhr.dt",a.state.save)})),$(document).on("preInit.dt",(function(e,t){const n=new $.fn.dataTable.Api(t).state.loaded(),a=$(e.target),o=a.data("custom-filter");o&&(t.ajax.data=function(e){const t=$(a.DataTable().table().container()).find(".custom_filter__input");(t.length&&!t.is(":checked")||!t.length&&n&&n.customFilter)&&(e.filter=o)})})),$(document).on("click",".event__delete",(function(){const e=$(this).data("event-id");$("form").append(`<input type="hidden" name="event-removed" value="${e}">`),$(this).parent().hide("fast")})),$(document).on("click",".panel_link",(function(e){e.stopPropagation(),window.location=$(this).prop("href")})),$((function(){setActiveMenu($("#menu-main li, #menu-settings li"));const e=$("input[type=text]").first();e.trigger("focus"),e.val(e.val()),manageCalibrationFrequency(),manageSites(),$("select:visible").select2({theme:"bootstrap",width:"100%"})}));
\ No newline at end of file
+function manageSites(){$('#site__reference').clone().prop('id','site_id').prop('name','site_id').appendTo('#site__options');const tenantIdSelected=$('#tenant_id').find('option:selected').val();$('#site_id').children('option').each(function removeSitesFromOtherTenants(){if($(this).data('tenant-id')&&$(this).data('tenant-id')!==tenantIdSelected){$(this).remove()}})}$(document).on('change','#tenant_id',function manageSiteSelect(){let siteSelect=$('#site_id');siteSelect.select2('destroy');siteSelect.remove();manageSites();siteSelect=$('#site_id');siteSelect.val('');siteSelect.select2({theme:'bootstrap',width:'100%'})});function manageCalibrationFrequency(){const assetType=$('#asset_type');const calibrationFrequency=$('#calibration_frequency').parent();if(assetType.val()==='consumables_case'){calibrationFrequency.addClass('hidden')}else{calibrationFrequency.removeClass('hidden')}}$(document).on('change','#asset_type',manageCalibrationFrequency);function setActiveMenu(menuLinks){menuLinks.removeClass('active');const path=window.location.pathname;const cat=path.split('/',2).join('/');const activeLink=menuLinks.find(`a[href="${cat}/"]`);activeLink.parent('li').addClass('active')}$(document).on('click','.equipment__add',function addEquipment(event){event.stopPropagation();const panel=$(this).closest('.panel.panel-default');panel.removeClass('no-equipment');panel.find('.collapse').collapse('show');const equipmentBlock=$('#equipments__reference').clone();let equipmentsCounter=0;$('.equipment__block').each(function getCounter(){if($(this).data('equipments-counter')>equipmentsCounter){equipmentsCounter=$(this).data('equipments-counter')}});equipmentsCounter+=1;const equipmentSelect=equipmentBlock.find('.equipment__family');const modelSelectId=equipmentSelect.eq(0).attr('id');const newSelectId=`${equipmentsCounter}#${modelSelectId}`;$(`label[for="${modelSelectId}"]`).attr('for',newSelectId);equipmentSelect.attr('id',newSelectId).attr('name',newSelectId);const serialNumberInput=equipmentBlock.find('.equipment__serial_number');const modelSerialNumberId=serialNumberInput.eq(0).attr('id');const newSerialNumberId=`${equipmentsCounter}#${modelSerialNumberId}`;$(`label[for="${modelSerialNumberId}"]`).attr('for',newSerialNumberId);serialNumberInput.attr('id',newSerialNumberId).attr('name',newSerialNumberId);equipmentBlock.attr('data-equipments-counter',equipmentsCounter).removeAttr('id').removeClass('hidden').appendTo('#equipments__list');equipmentBlock.find('select').select2({theme:'bootstrap',width:'100%'})});$(document).on('click','.equipment__remove',function removeEquipment(){if($('.equipment__block').length===2){console.log($(this).closest('.panel.panel-default'));$(this).closest('.panel.panel-default').addClass('no-equipment')}$(this).closest('.equipment__block').remove()});$(document).on('change','.equipment__family',function addConsumableExpirationDates(event){const equipmentContainer=$(this).closest('.equipment__block');const expirationDates=equipmentContainer.find('.expiration_dates');const equipmentCounter=equipmentContainer.data('equipments-counter');const selectedValue=event.target.value;expirationDates.empty();const consumablesFamilies=$('#equipments__container').data('consumables-families');if(consumablesFamilies[selectedValue]){const equipmentsConsumablesEntries=Object.entries(consumablesFamilies[selectedValue]);equipmentsConsumablesEntries.sort((a,b)=>a[1].localeCompare(b[1]));equipmentsConsumablesEntries.forEach(function cloneConsumableExpirationDate(element){const consumableEl=$('#equipments_consumables__reference').clone().removeAttr('id').removeClass('hidden');const consumableId=`${equipmentCounter}#${element[0]}-expiration_date`;const consumableLabel=consumableEl.find('label');consumableLabel.attr('for',consumableId);consumableLabel.text(element[1]);const consumableInput=consumableEl.find('input');consumableInput.attr('id',consumableId).attr('name',consumableId);expirationDates.append(consumableEl)})}});const DATATABLES_TRANSLATIONS={fr:{sProcessing:'Traitement en cours...',sSearch:'Rechercher&nbsp;:',sLengthMenu:'Afficher _MENU_ &eacute;l&eacute;ments',sInfo:"Affichage de l'&eacute;l&eacute;ment _START_ &agrave; _END_ sur _TOTAL_ &eacute;l&eacute;ments",sInfoEmpty:"Affichage de l'&eacute;l&eacute;ment 0 &agrave; 0 sur 0 &eacute;l&eacute;ments",sInfoFiltered:'(filtr&eacute; de _MAX_ &eacute;l&eacute;ments au total)',sInfoPostFix:'',sLoadingRecords:'Chargement en cours...',sZeroRecords:'Aucun &eacute;l&eacute;ment &agrave; afficher',sEmptyTable:'Aucune donn&eacute;e disponible dans le tableau',oPaginate:{sFirst:'Premier',sPrevious:'Pr&eacute;c&eacute;dent',sNext:'Suivant',sLast:'Dernier',sSeparator:'sur'},oAria:{sSortAscending:': activer pour trier la colonne par ordre croissant',sSortDescending:': activer pour trier la colonne par ordre d&eacute;croissant'}}};function addHrefToDataTablesRows(row,data){if(data.links){const objectLink=jQuery.grep(data.links,function getLink(n){return n.rel==='self'});const rowTd=$(row).find('td');rowTd.each(function fillCell(){if(!$(this).html()){$(this).html('&nbsp;')}$(this).wrapInner(`<a href="${objectLink[0].href}"></a>`)})}}function cancelColReorderEvents(){$(document).unbind('touchmove.ColReorder');$(document).unbind('mousemove.ColReorder');$(document).unbind('mouseup.ColReorder');$(document).unbind('touchend.ColReorder')}function manageColumnsRender(table){const columns=[];table.find('th').each(function setRenderFunctions(){const col={};const renderFunction=$(this).data('render');if(renderFunction){col.render=window[renderFunction]}columns.push(col)});return columns}function getKeysetQuery(data){return JSON.stringify({filter:data.filter,length:data.length,order:data.order,search:data.search.value})}function addKeysetCursor(table,data){data.keyset=true;const query=getKeysetQuery(data);const displayedPage=table.data('keyset-page');table.data('keyset-request',{length:data.length,query:query,start:data.start});if(!displayedPage||!displayedPage.cursors||displayedPage.query!==query){return}if(data.start===displayedPage.start+displayedPage.length&&displayedPage.cursors.last){data.after=displayedPage.cursors.last}else if(data.start===displayedPage.start-data.length&&displayedPage.cursors.first){data.before=displayedPage.cursors.first}}function saveKeysetPage(event,settings,json){const table=$(event.target);const request=table.data('keyset-request');if(request&&json){table.data('keyset-page',Object.assign({cursors:json.cursors},request))}}function styleInactiveObjects(row,data){const hasActiveProperty=Object.prototype.hasOwnProperty.call(data,'is_active');if(hasActiveProperty&&!data.is_active){$(row).addClass('warning')}}function assetTrackerCallback(row,data){addHrefToDataTablesRows(row,data);styleInactiveObjects(row,data)}$(function createDatatables(){const table=$('table.dataTables');if(!table){return}const dataTableParameters={serverSide:true,ajax:{url:table.data('ajax-url')},stateSave:true,pageLength:50,lengthChange:false,responsive:{details:false},processing:true,columns:manageColumnsRender(table),rowCallback:assetTrackerCallback,colReorder:true,colResize:{isEnabled:true,isResizable:function(column){return!!column.sTitle},onResizeStart:cancelColReorderEvents,onResize:cancelColReorderEvents}};if(window.userLocale in DATATABLES_TRANSLATIONS){dataTableParameters.language=DATATABLES_TRANSLATIONS[window.userLocale]}const customFilter=table.data('custom-filter');if(customFilter){dataTableParameters.dom='<"row"<"col-sm-6"<"custom_filter checkbox">><"col-sm-6"f>>'+'<"row"<"col-sm-12"tr>>'+'<"row"<"col-sm-5"i><"col-sm-7"p>>'}if(table.data('keyset')){table.on('xhr.dt',saveKeysetPage)}const initialisedDataTable=table.DataTable(dataTableParameters);if(customFilter){const tableContainer=$(initialisedDataTable.table().container());tableContainer.find('.dataTables_info').css('padding-bottom','10px');initialisedDataTable.on('stateSaveParams.dt',function saveCustomFilter(event,settings,data){data.customFilter=!tableContainer.find('.custom_filter__input').is(':checked')});const filterLabel=table.data('custom-filter-label');const tableState=initialisedDataTable.state.loaded();const inputIsChecked=!tableState||!tableState.customFilter?' checked':'';const filterHTML=`<label><input class="custom_filter__input" type="checkbox"${inputIsChecked}> ${filterLabel}</label>`;tableContainer.find('.custom_filter').html(filterHTML).css('padding','10px 0 0 10px');initialisedDataTable.state.save();tableContainer.find('.custom_filter__input').on('change',initialisedDataTable.draw)}table.on('preXhr.dt',initialisedDataTable.state.save)});$(document).on('preInit.dt',function initCustomFilter(event,settings){const api=new $.fn.dataTable.Api(settings);const state=api.state.loaded();const table=$(event.target);const customFilter=table.data('custom-filter');const keyset=table.data('keyset');if(customFilter||keyset){settings.ajax.data=function setDatatablesParameters(data){if(customFilter){const dataTableContainer=$(table.DataTable().table().container());const customFilterInput=dataTableContainer.find('.custom_filter__input');if(customFilterInput.length&&!customFilterInput.is(':checked')||!customFilterInput.length&&state&&state.customFilter){data.filter=customFilter}}if(keyset){addKeysetCursor(table,data)}}}});$(document).on('click','.event__delete',function removeEvent(){const eventID=$(this).data('event-id');$('form').append(`<input type="hidden" name="event-removed" value="${eventID}">`);$(this).parent().hide('fast')});$(document).on('click','.panel_link',function followRTALink(event){event.stopPropagation();window.location=$(this).prop('href')});$(function preparePageReady(){setActiveMenu($('#menu-main li, #menu-settings li'));const firstInput=$('input[type=text]').first();firstInput.trigger('focus');firstInput.val(firstInput.val());manageCalibrationFrequency();manageSites();$('select:visible').select2({theme:'bootstrap',width:'100%'})})
\ No newline at end of file
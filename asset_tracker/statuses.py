@@ -0,0 +1,111 @@
+"""Events statuses registry.
+
+Statuses only change when config.update_statuses runs, at startup. They are loaded once per process and attached to
+the request sessions without querying the db.
+"""
+
+import time
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from asset_tracker import models
+
+# An unknown status reloads the registry at most once per interval (seconds).
+STATUSES_RELOAD_INTERVAL = 60
+
+
+class StatusesRegistry:
+    """Detached copies of the events statuses, by status_id and by primary key, and their translated labels by locale
+    and config.
+    """
+
+    def __init__(self, reload_interval=STATUSES_RELOAD_INTERVAL):
+        self.by_id = {}
+        self.by_status_id = {}
+        self.labels = {}
+        self.loaded_at = None
+        self.reload_interval = reload_interval
+
+    def load(self, db_session):
+        """Load all statuses from the db. The registry content is replaced in one go, so that threads reading it never
+        see a partial registry.
+
+        Args:
+            db_session (sqlalchemy.orm.session.Session).
+        """
+        columns = [column.key for column in inspect(models.EventStatus).column_attrs]
+        # Query columns instead of entities to leave the statuses of the session untouched.
+        rows = db_session.query(*[getattr(models.EventStatus, column) for column in columns])
+
+        by_id = {}
+        for row in rows:
+            status = models.EventStatus(**row._asdict())
+            make_transient_to_detached(status)
+            by_id[status.id] = status
+
+        self.by_id = by_id
+        self.by_status_id = {status.status_id: status for status in by_id.values()}
+        self.labels = {}
+        self.loaded_at = time.monotonic()
+
+    def get_labels(self, db_session, localizer, config):
+        """Get the translated labels of all statuses, computed once per locale and config.
+
+        Args:
+            db_session (sqlalchemy.orm.session.Session).
+            localizer (pyramid.i18n.Localizer).
+            config (str).
+
+        Returns:
+            dict: status primary key => (status_id, translated label).
+        """
+        key = (localizer.locale_name, config)
+        labels = self.labels.get(key)
+        if labels is None:
+            if self.loaded_at is None:
+                self.load(db_session)
+            labels = {
+                status.id: (status.status_id, localizer.translate(status.label(config)))
+                for status in self.by_id.values()
+            }
+            self.labels[key] = labels
+
+        return labels
+
+    def get(self, db_session, status_id):
+        """Get a status by status_id, attached to a session. If the status is unknown, the registry is loaded again in
+        case the status was created after the registry was loaded, at most once per reload interval (status ids can
+        come from user input).
+
+        Args:
+            db_session (sqlalchemy.orm.session.Session).
+            status_id (str).
+
+        Returns:
+            asset_tracker.models.EventStatus.
+        """
+        status = self.by_status_id.get(status_id)
+        if not status:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.reload_interval:
+                return
+            self.load(db_session)
+            status = self.by_status_id.get(status_id)
+            if not status:
+                return
+
+        # The registry statuses are never modified, so there is no need to load them from the db.
+        return db_session.merge(status, load=False)
+
+
+def get_status(request, status_id):
+    """Request method: get a status attached to the request db session.
+
+    Args:
+        request (pyramid.request.Request).
+        status_id (str).
+
+    Returns:
+        asset_tracker.models.EventStatus.
+    """
+    return request.registry.statuses.get(request.db_session, status_id)
@@ -1,10 +1,20 @@
+import json
 from datetime import date
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
 from parsys_utilities.security import Right
+from pyramid.request import Request
 
 from asset_tracker import models
+from asset_tracker.api.software import DELTAS_FOLDER, PackageResponse, SoftwareCatalogue, get_delta_name
+from asset_tracker.cache import get_redis, get_site_fragment_key
+from asset_tracker.celery.reports import REPORTS_DEAD_LETTER_KEY, REPORTS_MAX_ATTEMPTS, fail_reports, \
+    get_attempts_key, get_processing_key, get_reports_key
+from asset_tracker.celery.software import compute_product_deltas
+from asset_tracker.constants import SITE_FRAGMENT_CACHE
+from asset_tracker.reports import collapse_reports, get_asset_software
 from asset_tracker.tests import FunctionalTest
 
 
@@ -16,11 +26,14 @@ def create_asset(request):
     status_software = models.EventStatus(
         status_id='software_update', position=14, status_type='config', _label='Software update'
     )
+    status_config = models.EventStatus(
+        status_id='config_update', position=15, status_type='config', _label='Configuration update'
+    )
     asset = models.Asset(asset_id='x@x.x', asset_type='station', status=status_created, tenant=tenant)
     event_created = models.Event(
         asset=asset, date=date.today(), creator_id='XXXXXXXX', creator_alias='XXXX XXXX', status=status_created
     )
-    request.db_session.add_all([asset, event_created, status_created, status_software, tenant])
+    request.db_session.add_all([asset, event_created, status_config, status_created, status_software, tenant])
     request.db_session.commit()
 
 
@@ -43,6 +56,147 @@ class API(FunctionalTest):
         assert output['version'] == '3.0.5-rc2'
         assert output['url'] == 'https://localhost:80/api/download/medcapture/ParsysMedCaptureSetup-3.0.5-rc2.exe'
 
+    @patch('asset_tracker.api.software.SoftwareCatalogue.get_delta', return_value='delta.bsdiff')
+    @patch('asset_tracker.api.software.Path.is_dir', return_value=True)
+    @patch('asset_tracker.api.software.get_product_files')
+    def test_software_get_delta(self, get_product_files_mock, _is_dir_mock, get_delta_mock):
+        get_product_files_mock.return_value = [
+            Path('/tmp/ParsysMedCaptureSetup-3.0.5.exe'),
+            Path('/tmp/ParsysMedCaptureSetup-3.0.3-beta1.exe'),
+            Path('/tmp/ParsysMedCaptureSetup-3.0.2.exe'),
+        ]
+
+        params = {'product': 'medcapture', 'current': '3.0.2'}
+        output = self.app.get('/api/update/', params=params, status=200).json_body
+        assert output['deltaUrl'] == 'https://localhost:80/api/download/medcapture/deltas/delta.bsdiff'
+        get_delta_mock.assert_called_once()
+
+        # The current package isn't in the stable channel.
+        params = {'product': 'medcapture', 'current': '3.0.3-beta1'}
+        output = self.app.get('/api/update/', params=params, status=200).json_body
+        assert output['version'] == '3.0.5'
+        assert 'deltaUrl' not in output
+        get_delta_mock.assert_called_once()
+
+    @patch('asset_tracker.api.software.SoftwareCatalogue.get_mtime', return_value=1_700_000_000_000_000_000)
+    @patch('asset_tracker.api.software.Path.is_dir', return_value=True)
+    @patch('asset_tracker.api.software.get_product_files')
+    def test_software_get_not_modified(self, get_product_files_mock, _is_dir_mock, _get_mtime_mock):
+        get_product_files_mock.return_value = [Path('/tmp/ParsysMedCaptureSetup-3.0.2.exe')]
+
+        params = {'product': 'medcapture', 'current': '2.9.4'}
+        response = self.app.get('/api/update/', params=params, status=200)
+        assert 'private' in response.headers['Cache-Control']
+
+        headers = {'If-None-Match': response.headers['ETag']}
+        self.app.get('/api/update/', params=params, headers=headers, status=304)
+
+        # Pinned version: different answer, different ETag.
+        params = {'product': 'medcapture', 'version': '3.0.2'}
+        self.app.get('/api/update/', params=params, headers=headers, status=200)
+
+    def test_software_catalogue(self):
+        with TemporaryDirectory() as storage_path:
+            product_folder = Path(storage_path)
+            (product_folder / 'ParsysMedCaptureSetup-3.1.0-alpha5-26-g014084c7e.exe').touch()
+            (product_folder / 'ParsysMedCaptureSetup-3.0.2.exe').touch()
+            # Invalid versions are skipped.
+            (product_folder / 'ParsysMedCaptureSetup-3.0.2-rc_final.exe').touch()
+            (product_folder / 'ParsysMedCaptureSetup.exe').touch()
+
+            catalogue = SoftwareCatalogue()
+            alpha_versions = catalogue.get_versions(product_folder, 'dev', 64)
+            assert list(alpha_versions) == ['3.0.2', '3.1.0-alpha5-26']
+            assert list(catalogue.get_versions(product_folder, 'stable', 64)) == ['3.0.2']
+            assert catalogue.get_versions(product_folder, 'stable', 32) == {}
+
+            # Unchanged folder: no new scan.
+            assert catalogue.get_versions(product_folder, 'alpha', 64) is alpha_versions
+
+            catalogue.reload()
+            assert catalogue.get_versions(product_folder, 'alpha', 64) is not alpha_versions
+
+            # New delta: the catalogue is scanned again.
+            from_file = 'ParsysMedCaptureSetup-3.0.2.exe'
+            to_file = 'ParsysMedCaptureSetup-3.1.0-alpha5-26-g014084c7e.exe'
+            assert catalogue.get_delta(product_folder, from_file, to_file) is None
+            (product_folder / DELTAS_FOLDER).mkdir()
+            (product_folder / DELTAS_FOLDER / get_delta_name(from_file, to_file)).touch()
+            assert catalogue.get_delta(product_folder, from_file, to_file)
+
+    def test_compute_product_deltas(self):
+        with TemporaryDirectory() as storage_path:
+            product_folder = Path(storage_path)
+            from_file = 'ParsysMedCaptureSetup-3.0.2.exe'
+            to_file = 'ParsysMedCaptureSetup-3.0.5.exe'
+            (product_folder / from_file).write_bytes(b'0123456789' * 100)
+            (product_folder / to_file).write_bytes(b'0123456789' * 90 + b'abcdefghij' * 10)
+
+            # Packages too big.
+            assert compute_product_deltas(product_folder, max_package_size=100) == 0
+
+            deltas_folder = product_folder / DELTAS_FOLDER
+            (deltas_folder / 'removed.bsdiff').touch()
+            # Temporary file of a concurrent run.
+            (deltas_folder / '.running.bsdiff.1234.tmp').touch()
+
+            assert compute_product_deltas(product_folder) == 1
+            assert sorted(item.name for item in deltas_folder.iterdir()) == [
+                '.running.bsdiff.1234.tmp', get_delta_name(from_file, to_file),
+            ]
+            assert compute_product_deltas(product_folder) == 0
+
+    def test_compute_product_deltas_channels(self):
+        with TemporaryDirectory() as storage_path:
+            product_folder = Path(storage_path)
+            product_files = [
+                'ParsysMedCaptureSetup-3.0.2.exe',
+                'ParsysMedCaptureSetup-3.0.3-beta1.exe',
+                'ParsysMedCaptureSetup-3.0.3-beta2.exe',
+                'ParsysMedCaptureSetup-3.0.3-beta3.exe',
+                'ParsysMedCaptureSetup-3.0.3.exe',
+            ]
+            for index, product_file in enumerate(product_files):
+                (product_folder / product_file).write_bytes(b'0123456789' * 100 + str(index).encode())
+
+            # The beta versions don't push the previous stable version out of the predecessors.
+            assert compute_product_deltas(product_folder) == 10
+            deltas = {item.name for item in (product_folder / DELTAS_FOLDER).iterdir()}
+            assert get_delta_name(product_files[0], product_files[4]) in deltas
+            assert get_delta_name(product_files[1], product_files[4]) in deltas
+            assert get_delta_name(product_files[3], product_files[4]) in deltas
+
+    def test_software_download_range(self):
+        with TemporaryDirectory() as storage_path:
+            package_path = Path(storage_path) / 'ParsysMedCaptureSetup-3.0.2.exe'
+            package_path.write_bytes(b'0123456789')
+
+            request = Request.blank('/', headers={'Range': 'bytes=2-5'})
+            response = request.get_response(PackageResponse(package_path, request))
+            assert response.status_code == 206
+            assert response.body == b'2345'
+            assert response.headers['Content-Range'] == 'bytes 2-5/10'
+
+            request = Request.blank('/', headers={'If-None-Match': response.etag})
+            response = request.get_response(PackageResponse(package_path, request))
+            assert response.status_code == 304
+
+    def test_collapse_reports(self):
+        def report(product, version, received_at):
+            return {'product': product, 'version': version, 'config_hash': None, 'received_at': received_at}
+
+        reports = [
+            report('medcapture', '2.9.4', '1'),
+            report('camagent', '1.0.0', '2'),
+            report('medcapture', '2.9.4', '3'),
+            report('medcapture', '3.0.2', '4'),
+            report('medcapture', '2.9.4', '5'),
+        ]
+        collapsed = collapse_reports(reports)
+        assert [(item['version'], item['received_at']) for item in collapsed] == [
+            ('2.9.4', '3'), ('1.0.0', '2'), ('3.0.2', '4'), ('2.9.4', '5'),
+        ]
+
     def test_software_post(self):
         request = self.dummy_request()
         create_asset(request)
@@ -54,5 +208,236 @@ class API(FunctionalTest):
             .join(models.Event.status) \
             .filter(models.EventStatus.status_id == 'software_update') \
             .first()
-        assert update.extra_json['software_name'] == 'medcapture'
-        assert update.extra_json['software_version'] == '2.9.4'
+        assert update.software_name == 'medcapture'
+        assert update.software_version == '2.9.4'
+
+    def test_reports_post(self):
+        request = self.dummy_request()
+        create_asset(request)
+
+        reports = {'medcapture': {'version': '2.9.4', 'config': {'a': 1}}, 'camagent': {'version': '1.0.0'}}
+        self.app.post_json('/api/reports/', reports, status=200)
+
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='x@x.x').first()
+        assert {software.product: software.version for software in asset.softwares} == {
+            'camagent': '1.0.0', 'medcapture': '2.9.4',
+        }
+        assert asset.config_hash
+        assert asset.status.status_id == 'stock_parsys'
+
+        self.app.post_json('/api/reports/', {'medcapture': {}}, status=400)
+
+    def test_add_config_event(self):
+        request = self.dummy_request()
+        create_asset(request)
+
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='x@x.x').first()
+        status_software = request.db_session.query(models.EventStatus).filter_by(status_id='software_update').one()
+        event = models.Event(
+            date=date.today(), creator_id='XXXXXXXX', creator_alias='XXXX XXXX', status=status_software,
+            software_name='medcapture', software_version='2.9.4',
+        )
+        with patch.object(models.Asset, 'history') as history_mock:
+            asset.add_event(event)
+        history_mock.assert_not_called()
+        assert asset.status.status_id == 'stock_parsys'
+
+    @patch('asset_tracker.celery.reports.apply_queued_reports.delay')
+    def test_reports_failed(self, delay_mock):
+        request = self.dummy_request()
+        redis = get_redis(request.registry)
+        processing_key = get_processing_key(0)
+        redis.delete(get_reports_key(0), processing_key, get_attempts_key(0), REPORTS_DEAD_LETTER_KEY)
+
+        queued_reports = [json.dumps({'product': 'medcapture', 'version': '2.9.4'})]
+        redis.rpush(processing_key, *queued_reports)
+        for _ in range(REPORTS_MAX_ATTEMPTS - 1):
+            # The batch stays in front of the queue, for the next task.
+            assert not fail_reports(request, 0, queued_reports)
+            assert [queued_report.decode() for queued_report in redis.lrange(processing_key, 0, -1)] == queued_reports
+        delay_mock.assert_not_called()
+
+        # Too many failures: the reports don't block the queue anymore.
+        assert fail_reports(request, 0, queued_reports)
+        assert not redis.exists(processing_key)
+        assert not redis.exists(get_attempts_key(0))
+        delay_mock.assert_called_once_with(0)
+        dead_report = json.loads(redis.lpop(REPORTS_DEAD_LETTER_KEY))
+        assert dead_report == {'asset_pk': 0, 'report': {'product': 'medcapture', 'version': '2.9.4'}}
+
+    def test_asset_software_upsert(self):
+        request = self.dummy_request()
+        create_asset(request)
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='x@x.x').first()
+
+        created = get_asset_software(request.db_session, asset, 'medcapture')
+        assert created.version == ''
+
+        # A concurrent first report of the same software finds the existing row.
+        created.version = '2.9.4'
+        existing = get_asset_software(request.db_session, asset, 'medcapture')
+        assert existing.id == created.id
+        assert existing.version == '2.9.4'
+        assert [software.product for software in asset.softwares] == ['medcapture']
+
+    def test_asset_software_removed_events(self):
+        request = self.dummy_request()
+        create_asset(request)
+
+        self.app.post_json('/api/update/?product=medcapture', {'version': '2.9.4'}, status=200)
+        self.app.post_json('/api/update/?product=medcapture', {'version': '3.0.2'}, status=200)
+
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='x@x.x').first()
+        updates = asset.history('desc').filter(models.Event.software_name == 'medcapture').all()
+        assert [update.software_version for update in updates] == ['3.0.2', '2.9.4']
+
+        updates[0].removed = True
+        asset.update_softwares()
+        assert {software.product: software.version for software in asset.softwares} == {'medcapture': '2.9.4'}
+
+        updates[1].removed = True
+        asset.update_softwares()
+        request.db_session.flush()
+        assert not asset.softwares
+        assert not request.db_session.query(models.AssetSoftware).count()
+
+    def test_config_post(self):
+        request = self.dummy_request()
+        create_asset(request)
+
+        self.app.post_json('/api/update/?product=medcapture', {'config': {'a': 1, 'b': [1, 2]}}, status=200)
+        # Same configuration, different keys order.
+        self.app.post_json('/api/update/?product=medcapture', {'config': {'b': [1, 2], 'a': 1}}, status=200)
+
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='x@x.x').first()
+        updates = asset.history('desc') \
+            .join(models.Event.status) \
+            .filter(models.EventStatus.status_id == 'config_update') \
+            .all()
+        assert len(updates) == 1
+        assert updates[0].config_hash == asset.config_hash
+
+    def test_config_hash_removed_events(self):
+        request = self.dummy_request()
+        create_asset(request)
+
+        self.app.post_json('/api/update/?product=medcapture', {'config': {'a': 1}}, status=200)
+        self.app.post_json('/api/update/?product=medcapture', {'config': {'a': 2}}, status=200)
+
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='x@x.x').first()
+        updates = asset.history('desc').filter(models.Event.config_file_id.is_not(None)).all()
+        assert asset.config_hash == updates[0].config_hash
+
+        updates[0].removed = True
+        asset.update_config_hash()
+        assert asset.config_hash == updates[1].config_hash
+
+        updates[1].removed = True
+        asset.update_config_hash()
+        assert asset.config_hash is None
+
+
+class SitesFragments(FunctionalTest):
+    principals = [Right(name='api-sites-read', tenant='tenantXX')]
+
+    def test_site_fragment_invalidation(self):
+        request = self.dummy_request()
+        tenant = models.Tenant(tenant_id='tenantXX', name='Tenant XX')
+        site = models.Site(name='Site 1', site_type='Hospital', tenant=tenant)
+        request.db_session.add(site)
+        request.db_session.commit()
+
+        redis = get_redis(request.registry)
+        key = get_site_fragment_key(site.site_id)
+        redis.delete(key)
+
+        assert 'Site 1' in self.app.get(f'/api/sites/{site.site_id}/', status=200).text
+        assert 0 < redis.ttl(key) <= SITE_FRAGMENT_CACHE
+
+        # Site updated.
+        site.name = 'Site 2'
+        request.db_session.commit()
+        assert not redis.exists(key)
+        assert 'Site 2' in self.app.get(f'/api/sites/{site.site_id}/', status=200).text
+
+        # Tenant updated (RTA linking).
+        tenant.name = 'Tenant YY'
+        request.db_session.commit()
+        assert not redis.exists(key)
+
+
+class RTAAssets(FunctionalTest):
+    @staticmethod
+    def get_station(user_id, login, tenant_id='tenantXX'):
+        return {
+            'creatorAlias': 'XXXX XXXX', 'creatorID': 'XXXXXXXX', 'login': login, 'tenantID': tenant_id,
+            'tenantName': 'Tenant', 'tenantType': 'Hospital', 'userID': user_id,
+        }
+
+    @staticmethod
+    def populate_data(request):
+        create_asset(request)
+        status = models.EventStatus(status_id='site_change', position=2, status_type='event', _label='Site change')
+        request.db_session.add(status)
+        request.db_session.commit()
+
+    def link(self, stations):
+        with patch('asset_tracker.api.assets.authenticate_rta', return_value=True):
+            output = self.app.post_json('/api/assets/link/', stations, status=200).json_body
+        return [station['result'] for station in output]
+
+    def test_link_assets(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        stations = [self.get_station('AAAAAAAA', 'a@a.a'), self.get_station('BBBBBBBB', 'b@b.b')]
+        assert self.link(stations) == ['created', 'created']
+
+        # Renamed, moved to another tenant.
+        assert self.link([self.get_station('AAAAAAAA', 'c@c.c', tenant_id='tenantYY')]) == ['updated']
+        asset = request.db_session.query(models.Asset).filter_by(user_id='AAAAAAAA').one()
+        assert asset.asset_id == 'c@c.c'
+        assert asset.tenant.tenant_id == 'tenantYY'
+        assert asset.status.status_id == 'site_change'
+
+    def test_link_assets_conflicts(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        assert self.link([self.get_station('BBBBBBBB', 'b@b.b')]) == ['created']
+
+        # Renamed to the asset_id of another asset: the other stations are still linked.
+        stations = [self.get_station('BBBBBBBB', 'x@x.x'), self.get_station('DDDDDDDD', 'd@d.d')]
+        assert self.link(stations) == ['error', 'created']
+        asset = request.db_session.query(models.Asset).filter_by(user_id='BBBBBBBB').one()
+        assert asset.asset_id == 'b@b.b'
+
+        # Same login, different RTA ids.
+        stations = [self.get_station('EEEEEEEE', 'e@e.e'), self.get_station('FFFFFFFF', 'e@e.e')]
+        assert self.link(stations) == ['created', 'duplicate']
+        assert not request.db_session.query(models.Asset).filter_by(user_id='FFFFFFFF').count()
+
+    def test_sites_ids(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+        assert self.link([self.get_station('AAAAAAAA', 'a@a.a')]) == ['created']
+
+        asset = request.db_session.query(models.Asset).filter_by(user_id='AAAAAAAA').one()
+        asset.site = models.Site(site_id='site_1', name='Site 1', site_type='Hospital', tenant=asset.tenant)
+        request.db_session.commit()
+
+        with patch('asset_tracker.api.assets.authenticate_rta', return_value=True):
+            params = [('user_id', 'AAAAAAAA'), ('user_id', 'ZZZZZZZZ')]
+            response = self.app.get('/api/assets/sites/', params=params, status=200)
+            assert response.json_body == {'AAAAAAAA': 'site_1', 'ZZZZZZZZ': None}
+
+            headers = {'If-None-Match': response.headers['ETag']}
+            self.app.get('/api/assets/sites/', params=params, headers=headers, status=304)
+            self.app.get('/api/assets/sites/', params=[('user_id', 'invalid')], status=400)
+
+            # Big lookups are sent in the body.
+            users_ids = [f'{i:08}' for i in range(1000)] + ['AAAAAAAA']
+            output = self.app.post_json('/api/assets/sites/', users_ids[1:], status=200).json_body
+            assert len(output) == 1000
+            assert output['AAAAAAAA'] == 'site_1'
+            self.app.post_json('/api/assets/sites/', users_ids, status=400)
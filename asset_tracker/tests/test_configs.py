@@ -0,0 +1,56 @@
+from depot.manager import DepotManager
+
+from asset_tracker import models
+from asset_tracker.configs import get_config_hash, release_config, store_config
+from asset_tracker.tests import FunctionalTest
+
+
+class Configs(FunctionalTest):
+    def test_get_config_hash(self):
+        assert get_config_hash({'a': 1, 'b': [1, 2]}) == get_config_hash({'b': [1, 2], 'a': 1})
+        assert get_config_hash({'a': 1}) != get_config_hash({'a': 2})
+
+    def test_store_release(self):
+        request = self.dummy_request()
+
+        file_id = store_config(request.db_session, {'a': 1})
+        # An identical configuration is stored once.
+        assert store_config(request.db_session, {'a': 1}) == file_id
+        assert store_config(request.db_session, {'a': 2}) != file_id
+
+        config_file = request.db_session.query(models.ConfigFile).filter_by(file_id=file_id).one()
+        request.db_session.refresh(config_file)
+        assert config_file.references == 2
+        assert DepotManager.get().exists(file_id)
+
+        release_config(request.db_session, file_id)
+        assert config_file.references == 1
+        assert DepotManager.get().exists(file_id)
+
+        release_config(request.db_session, file_id)
+        assert not request.db_session.query(models.ConfigFile).filter_by(file_id=file_id).count()
+        # Deleted once committed.
+        assert DepotManager.get().exists(file_id)
+        request.db_session.commit()
+        assert not DepotManager.get().exists(file_id)
+
+    def test_release_rollback(self):
+        request = self.dummy_request()
+
+        file_id = store_config(request.db_session, {'a': 1})
+        request.db_session.commit()
+
+        release_config(request.db_session, file_id)
+        request.db_session.rollback()
+        request.db_session.commit()
+        assert request.db_session.query(models.ConfigFile).filter_by(file_id=file_id).one().references == 1
+        assert DepotManager.get().exists(file_id)
+
+    def test_release_not_counted(self):
+        request = self.dummy_request()
+
+        # Files stored before deduplication have no reference count.
+        file_id = DepotManager.get().create(b'{"a": 1}', 'config.json', 'application/json')
+        release_config(request.db_session, file_id)
+        request.db_session.commit()
+        assert not DepotManager.get().exists(file_id)
@@ -0,0 +1,188 @@
+from datetime import date
+from unittest.mock import patch
+
+from parsys_utilities.security import Right
+from sqlalchemy import select
+
+from asset_tracker import models
+from asset_tracker.api.counts import ListCounts
+from asset_tracker.api.keyset import get_search_filter
+from asset_tracker.cache import DATATABLES_GENERATION_KEY, get_count_key, get_redis
+from asset_tracker.tests import FunctionalTest
+
+
+class DataTables(FunctionalTest):
+    principals = [Right(name='assets-list', tenant='tenantXX')]
+
+    @staticmethod
+    def populate_data(request):
+        tenant = models.Tenant(tenant_id='tenantXX', name='Tenant XX')
+        status = models.EventStatus(
+            status_id='stock_parsys', position=1, status_type='event', _label='In stock Parsys'
+        )
+        request.db_session.add_all([status, tenant])
+
+        for i in range(8):
+            # Duplicates and NULLs in the sort column.
+            customer_name = f'Customer {i % 3}' if i % 4 else None
+            asset = models.Asset(
+                asset_id=f'asset_{i}', asset_type='station', customer_name=customer_name, status=status, tenant=tenant
+            )
+            request.db_session.add(asset)
+
+        request.db_session.commit()
+
+    def test_assets_keyset(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        params = {
+            'columns[0][data]': 'customer_name',
+            'datatables': 'true',
+            'draw': '1',
+            'keyset': 'true',
+            'length': '3',
+            'order[0][column]': '0',
+            'order[0][dir]': 'desc',
+        }
+
+        # Offset pages.
+        offset_pages = []
+        for start in [0, 3, 6]:
+            output = self.app.get('/api/assets/', params={**params, 'start': str(start)}, status=200).json_body
+            offset_pages.append([asset['asset_id'] for asset in output['data']])
+        assert output['recordsTotal'] == 8
+
+        # Next pages with cursors.
+        keyset_pages = []
+        output = self.app.get('/api/assets/', params={**params, 'start': '0'}, status=200).json_body
+        keyset_pages.append([asset['asset_id'] for asset in output['data']])
+        for start in [3, 6]:
+            cursor_params = {**params, 'after': output['cursors']['last'], 'start': str(start)}
+            output = self.app.get('/api/assets/', params=cursor_params, status=200).json_body
+            keyset_pages.append([asset['asset_id'] for asset in output['data']])
+        assert keyset_pages == offset_pages
+
+        # Previous page.
+        cursor_params = {**params, 'before': output['cursors']['first'], 'start': '3'}
+        output = self.app.get('/api/assets/', params=cursor_params, status=200).json_body
+        assert [asset['asset_id'] for asset in output['data']] == offset_pages[1]
+
+    def test_assets_status_label(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+        status = models.EventStatus(status_id='service', position=2, status_type='event', _label='In service')
+        request.db_session.add(status)
+        request.db_session.query(models.Asset).filter_by(asset_id='asset_0').one().status = status
+        request.db_session.commit()
+
+        params = {
+            'columns[0][data]': 'status_label',
+            'datatables': 'true',
+            'draw': '1',
+            'keyset': 'true',
+            'length': '10',
+            'order[0][column]': '0',
+            'order[0][dir]': 'asc',
+            'start': '0',
+        }
+
+        output = self.app.get('/api/assets/', params=params, status=200).json_body
+        assert [asset['status_label'] for asset in output['data']] == ['In service'] + ['In stock Parsys'] * 7
+
+        output = self.app.get('/api/assets/', params={**params, 'filter': 'status=service'}, status=200).json_body
+        assert [asset['asset_id'] for asset in output['data']] == ['asset_0']
+        assert output['data'][0]['is_active'] and 'links' not in output['data'][0]
+
+    def test_assets_keyset_bad_cursor(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        params = {
+            'columns[0][data]': 'calibration_next',
+            'datatables': 'true',
+            'draw': '1',
+            'keyset': 'true',
+            'length': '3',
+            'order[0][column]': '0',
+            'start': '3',
+        }
+        output = self.app.get('/api/assets/', params={**params, 'start': '0'}, status=200).json_body
+        self.app.get('/api/assets/', params={**params, 'after': output['cursors']['last']}, status=200)
+
+        for cursor in ['not json', '[]', '["2026-13-01", 1]', '[null, 1]', '["2026-10-18", "x"]', '["2026-10-18"]']:
+            self.app.get('/api/assets/', params={**params, 'after': cursor}, status=400)
+
+    def test_search_filter_not_correlated(self):
+        search_filter = get_search_filter(models.Asset.id, [models.Asset.asset_id, models.Site.name], 'asset')
+        query = select(models.Asset.id).outerjoin(models.Asset.site).where(search_filter)
+        # Each search subquery selects from the listed table, so that it can use its own (trigram) indexes.
+        assert str(query.compile()).count('FROM asset') == 3
+
+    def test_counts(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+        get_redis(request.registry).delete(get_count_key('asset'))
+
+        counts = ListCounts(request, 'asset')
+        query = request.db_session.query(models.Asset)
+        assert counts.total(query) == 8
+        assert int(get_redis(request.registry).get(get_count_key('asset'))) == 8
+
+        # Cached total, invalidated when an asset is committed.
+        with patch.object(ListCounts, 'count') as count_mock:
+            assert counts.total(query) == 8
+        count_mock.assert_not_called()
+        tenant = request.db_session.query(models.Tenant).one()
+        status = request.db_session.query(models.EventStatus).one()
+        request.db_session.add(models.Asset(asset_id='asset_8', asset_type='station', status=status, tenant=tenant))
+        request.db_session.commit()
+        assert counts.total(query) == 9
+
+        # Estimated above the threshold.
+        counts.estimate_threshold = 5
+        with patch.object(ListCounts, 'estimate', return_value=100):
+            assert counts.count(query) == 100
+            assert counts.filtered(query.filter(models.Asset.asset_id != 'asset_0'))() == 100
+        with patch.object(ListCounts, 'estimate', return_value=3):
+            assert counts.count(query) == 9
+
+    def test_assets_cache(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+        redis = get_redis(request.registry)
+
+        params = {
+            'columns[0][data]': 'asset_id',
+            'datatables': 'true',
+            'draw': '1',
+            'keyset': 'true',
+            'length': '3',
+            'order[0][column]': '0',
+            'start': '0',
+        }
+
+        asset = request.db_session.query(models.Asset).filter_by(asset_id='asset_0').one()
+        changes = [
+            lambda: setattr(asset, 'customer_name', 'Customer 9'),
+            lambda: setattr(asset.tenant, 'name', 'Tenant YY'),
+            lambda: request.db_session.add(models.Site(name='Site 1', tenant=asset.tenant)),
+            lambda: request.db_session.add(models.Event(
+                asset=asset, date=date.today(), creator_id='XXXXXXXX', creator_alias='XXXX XXXX', status=asset.status,
+            )),
+        ]
+
+        with patch.dict(request.registry.settings, {'asset_tracker.datatables_cache': '60'}):
+            for change in changes:
+                response = self.app.get('/api/assets/', params=params, status=200)
+                cached_response = self.app.get('/api/assets/', params={**params, 'draw': '2'}, status=200)
+                assert cached_response.headers['X-Cache'] == 'HIT'
+                assert cached_response.json_body == {**response.json_body, 'draw': 2}
+
+                # A committed change of a listed model starts a new generation of responses.
+                generation = int(redis.get(DATATABLES_GENERATION_KEY) or 0)
+                change()
+                request.db_session.commit()
+                assert int(redis.get(DATATABLES_GENERATION_KEY)) == generation + 1
+                response = self.app.get('/api/assets/', params=params, status=200)
+                assert response.headers['X-Cache'] == 'MISS'
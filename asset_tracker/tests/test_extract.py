@@ -4,15 +4,17 @@ import os
 import random
 import tempfile
 from datetime import date, datetime, timedelta
+from unittest.mock import patch
 
 from parsys_utilities.dates import utc_now
 from parsys_utilities.security import Right
-from sqlalchemy import func
+from sqlalchemy import event, func
 from sqlalchemy.orm import joinedload
 
 from asset_tracker import models
 from asset_tracker.config import update_consumable_families, update_equipment_families, update_statuses
 from asset_tracker.constants import ASSET_TYPES, PATH
+from asset_tracker.models.asset_tracker import MILESTONES, load_asset_dates
 from asset_tracker.tests import FunctionalTest
 
 
@@ -58,11 +60,12 @@ class Extract(FunctionalTest):
                     if event_status.status_type == 'event':
                         asset.status = event_status
                     elif event_status.status_id == 'software_update':
-                        event.extra = json.dumps(
-                            {'software_name': 'medcapture', 'software_version': f'3.0.{random.randint(0, 9)}'}
-                        )
+                        event.software_name = 'medcapture'
+                        event.software_version = f'3.0.{random.randint(0, 9)}'
                     request.db_session.add(event)
 
+                asset.update_dates()
+
         request.db_session.commit()
 
     def test_extract_asset(self):
@@ -94,17 +97,17 @@ class Extract(FunctionalTest):
                     .join(models.EventStatus) \
                     .filter(models.Event.asset_id == asset.id, models.EventStatus.status_type == 'event') \
                     .one()[0]
-                medcapture = request.db_session.query(models.Event.extra) \
+                medcapture = request.db_session.query(models.Event.software_version) \
                     .join(models.Event.status) \
                     .filter(
                         models.Event.asset_id == asset.id,
                         models.EventStatus.status_id == 'software_update',
-                        models.Event.extra.ilike('%"medcapture"%'),
+                        models.Event.software_name == 'medcapture',
                     ) \
                     .order_by(models.Event.created_at.desc()) \
                     .limit(1) \
                     .first()
-                medcapture_version = json.loads(medcapture[0])['software_version'] if medcapture else None
+                medcapture_version = medcapture[0] if medcapture else None
 
                 assert asset.asset_id == row[0]
                 assert asset.asset_type == row[1]
@@ -125,3 +128,172 @@ class Extract(FunctionalTest):
 
         assert nb_asset == 0
         os.remove(tmp_file)
+
+    def test_load_asset_dates(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        assets = request.db_session.query(models.Asset).all()
+        assets_dates = load_asset_dates(request.db_session, [asset.id for asset in assets])
+
+        assert len(assets_dates) == len(assets)
+        for asset in assets:
+            assert assets_dates[asset.id] == asset.compute_dates()
+
+    @staticmethod
+    def create_asset_with_events(request, events):
+        """Create an asset and add its events one by one, with incremental dates updates.
+
+        Args:
+            request (pyramid.request.Request).
+            events (list): (status_id, date), in creation order.
+
+        Returns:
+            tuple: asset, events.
+        """
+        with open(PATH / 'config.json') as config_file:
+            update_statuses(request.db_session, json.load(config_file))
+        statuses = {status.status_id: status for status in request.db_session.query(models.EventStatus)}
+
+        tenant = models.Tenant(tenant_id='tenantXX', name='Tenant XX')
+        asset = models.Asset(asset_id='asset', tenant=tenant, asset_type='station', status=statuses['stock_parsys'])
+        request.db_session.add(asset)
+
+        added_events = []
+        for index, (status_id, event_date) in enumerate(events):
+            event = models.Event(
+                created_at=utc_now() + timedelta(seconds=index),
+                creator_id='user',
+                creator_alias='user',
+                date=event_date,
+                status=statuses[status_id],
+            )
+            asset.add_event(event)
+            request.db_session.add(event)
+            added_events.append(event)
+
+        request.db_session.flush()
+        return asset, added_events
+
+    @staticmethod
+    def assert_dates(request, asset):
+        """The dates stored on the asset are the same as the dates recomputed from its history."""
+        request.db_session.flush()
+        stored_dates = {milestone: getattr(asset, milestone) for milestone in MILESTONES}
+        assert stored_dates == asset.compute_dates()
+        assert stored_dates == load_asset_dates(request.db_session, [asset.id])[asset.id]
+
+    def test_add_events_out_of_order(self):
+        request = self.dummy_request()
+        today = date.today()
+        asset, _ = self.create_asset_with_events(request, [
+            ('service', today),
+            ('stock_parsys', today - timedelta(days=10)),
+            ('transit_customer', today - timedelta(days=5)),
+            ('stock_parsys', today - timedelta(days=20)),
+            ('calibration', today - timedelta(days=3)),
+            ('calibration', today - timedelta(days=30)),
+        ])
+
+        assert asset.production == today - timedelta(days=20)
+        assert asset.calibration_date == today - timedelta(days=3)
+        self.assert_dates(request, asset)
+
+    def test_add_events_same_date(self):
+        request = self.dummy_request()
+        today = date.today()
+        asset, _ = self.create_asset_with_events(request, [
+            ('stock_parsys', today),
+            ('stock_parsys', today),
+            ('calibration', today),
+            ('calibration', today),
+            ('service', today),
+        ])
+
+        assert asset.production == asset.calibration_date == asset.activation == today
+        self.assert_dates(request, asset)
+
+    def test_remove_milestone_event(self):
+        request = self.dummy_request()
+        today = date.today()
+        asset, events = self.create_asset_with_events(request, [
+            ('stock_parsys', today - timedelta(days=10)),
+            ('stock_parsys', today - timedelta(days=20)),
+            ('calibration', today - timedelta(days=5)),
+            ('calibration', today - timedelta(days=1)),
+            ('service', today),
+        ])
+
+        # Same as views.assets.Assets.remove_events.
+        for event in [events[1], events[3], events[4]]:
+            event.removed = True
+            asset.update_dates()
+            self.assert_dates(request, asset)
+
+        assert asset.production == today - timedelta(days=10)
+        assert asset.calibration_date == today - timedelta(days=5)
+        assert asset.activation is None
+
+    def test_extract_queries_count(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        equipment_family = request.db_session.query(models.EquipmentFamily).first()
+        consumable_family = request.db_session.query(models.ConsumableFamily).first()
+
+        def add_equipments():
+            for asset in request.db_session.query(models.Asset).filter(~models.Asset.equipments.any()):
+                equipment = models.Equipment(asset=asset, family=equipment_family, serial_number=asset.asset_id)
+                consumable = models.Consumable(
+                    equipment=equipment, family=consumable_family, expiration_date=date.today()
+                )
+                request.db_session.add_all([equipment, consumable])
+            request.db_session.commit()
+
+        statements = []
+
+        def count_statement(connection, cursor, statement, *args):
+            statements.append(statement)
+
+        def count_extract_queries():
+            statements.clear()
+            event.listen(engine, 'before_cursor_execute', count_statement)
+            try:
+                self.app.get('/assets/extract/', status=200)
+            finally:
+                event.remove(engine, 'before_cursor_execute', count_statement)
+            return len(statements)
+
+        engine = request.db_session.get_bind()
+        add_equipments()
+        queries_count = count_extract_queries()
+
+        # Twice as many assets, with their equipments and consumables.
+        tenant = request.db_session.query(models.Tenant).first()
+        status = request.db_session.query(models.EventStatus).first()
+        for i in range(request.db_session.query(models.Asset).count()):
+            asset = models.Asset(asset_id=f'more_{i}', tenant=tenant, asset_type='station', status=status)
+            request.db_session.add(asset)
+        add_equipments()
+
+        assert count_extract_queries() == queries_count
+
+    @patch('asset_tracker.views.extract.EXTRACT_WINDOW_SIZE', 3)
+    def test_extract_columns(self):
+        request = self.dummy_request()
+        self.populate_data(request)
+
+        # The last asset has the most equipments, its rows are in the last window.
+        equipment_family = request.db_session.query(models.EquipmentFamily).first()
+        asset = request.db_session.query(models.Asset).order_by(models.Asset.asset_id.desc()).first()
+        for i in range(3):
+            request.db_session.add(models.Equipment(asset=asset, family=equipment_family, serial_number=f'serial_{i}'))
+        request.db_session.commit()
+
+        response = self.app.get('/assets/extract/', status=200)
+        header, *rows = csv.reader(response.body.decode('utf-8').splitlines())
+        assert 'equipment_3_serial_number' in header
+        assert 'equipment_4_serial_number' not in header
+        assert len(rows) == request.db_session.query(models.Asset).count()
+        assert all(len(row) == len(header) for row in rows)
+        assert rows[-1][header.index('equipment_3_serial_number')] == 'serial_2'
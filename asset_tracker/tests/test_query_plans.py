@@ -0,0 +1,132 @@
+"""Make sure the hot queries use indexes. These tests need a PostgreSQL database, they are skipped if the
+ASSET_TRACKER_TESTS_POSTGRESQL_URL environment variable isn't set. The database must be empty: tables are created and
+seeded with a large dataset, then dropped.
+"""
+
+import os
+import unittest
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from asset_tracker import models
+
+POSTGRESQL_URL = os.environ.get('ASSET_TRACKER_TESTS_POSTGRESQL_URL')
+
+NB_ASSETS = 20000
+NB_EVENTS_PER_ASSET = 25
+
+SEED_QUERIES = [
+    """
+    INSERT INTO tenant (tenant_id, name)
+    SELECT 'tenant' || i, 'Tenant ' || i FROM generate_series(1, 10) AS i
+    """,
+    """
+    INSERT INTO event_status (status_id, position, status_type, _label)
+    SELECT 'status' || i, i, CASE WHEN i > 13 THEN 'config' ELSE 'event' END, 'Status ' || i
+    FROM generate_series(1, 16) AS i
+    """,
+    """
+    INSERT INTO asset (asset_id, tenant_id, user_id, asset_type, calibration_next, status_id, created_at)
+    SELECT 'asset' || i, 1 + i % 10, 'user' || i, 'station', current_date + i % 3650, 1 + i % 13, now()
+    FROM generate_series(1, :nb_assets) AS i
+    """,
+    """
+    INSERT INTO event (event_id, asset_id, date, creator_id, creator_alias, removed, status_id, created_at)
+    SELECT 'event' || asset.id || '_' || i, asset.id, current_date - i, 'creator', 'Creator', i % 20 = 0, 1 + i % 16,
+        now() - i * interval '1 hour'
+    FROM asset CROSS JOIN generate_series(1, :nb_events) AS i
+    """,
+    "INSERT INTO equipment_family (family_id, model) VALUES ('family', 'Family')",
+    "INSERT INTO consumable_family (family_id, model) VALUES ('family', 'Family')",
+    "INSERT INTO equipment (family_id, asset_id) SELECT 1, asset.id FROM asset",
+    """
+    INSERT INTO consumable (family_id, equipment_id, expiration_date)
+    SELECT 1, equipment.id, current_date + equipment.id % 3650 FROM equipment
+    """,
+]
+
+
+def get_scanned_tables(plan, scan_type='Seq Scan'):
+    """Get the tables read with a given scan type in a query plan.
+
+    Args:
+        plan (dict): EXPLAIN (FORMAT JSON) node.
+        scan_type (str).
+
+    Returns:
+        set.
+    """
+    tables = {plan['Relation Name']} if plan['Node Type'] == scan_type else set()
+    for sub_plan in plan.get('Plans', []):
+        tables |= get_scanned_tables(sub_plan, scan_type)
+    return tables
+
+
+@unittest.skipUnless(POSTGRESQL_URL, 'ASSET_TRACKER_TESTS_POSTGRESQL_URL is not set.')
+class QueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine(POSTGRESQL_URL)
+        models.Asset.metadata.create_all(cls.engine)
+
+        with cls.engine.begin() as connection:
+            for query in SEED_QUERIES:
+                connection.execute(text(query), {'nb_assets': NB_ASSETS, 'nb_events': NB_EVENTS_PER_ASSET})
+
+        # Statistics must be up to date for the planner to choose the indexes.
+        with cls.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+    @classmethod
+    def tearDownClass(cls):
+        models.Asset.metadata.drop_all(cls.engine)
+        cls.engine.dispose()
+
+    def setUp(self):
+        self.db_session = Session(bind=self.engine)
+
+    def tearDown(self):
+        self.db_session.close()
+
+    def get_plan(self, query):
+        """Get the query plan of an ORM query.
+
+        Args:
+            query (sqlalchemy.orm.query.Query).
+
+        Returns:
+            dict.
+        """
+        compiled = query.statement.compile(dialect=self.engine.dialect)
+        explain = self.db_session.connection().exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params)
+        return explain.scalar()[0]['Plan']
+
+    def test_history(self):
+        asset = self.db_session.query(models.Asset).filter_by(asset_id=f'asset{NB_ASSETS // 2}').one()
+
+        for order in ['asc', 'desc']:
+            plan = self.get_plan(asset.history(order))
+            assert 'event' not in get_scanned_tables(plan)
+            assert 'ix_event_asset_id_date_created_at' in str(plan)
+
+    def test_assets_calibration(self):
+        query = self.db_session.query(models.Asset) \
+            .join(models.Asset.tenant) \
+            .filter(~models.Asset.is_decommissioned, models.Asset.calibration_next == date.today() + timedelta(days=90))
+
+        assert 'asset' not in get_scanned_tables(self.get_plan(query))
+
+    def test_consumables_expiration(self):
+        query = self.db_session.query(models.Asset, models.Consumable) \
+            .join(models.Asset.equipments) \
+            .join(models.Equipment.consumables) \
+            .filter(models.Consumable.expiration_date == date.today() + timedelta(days=90))
+
+        assert 'consumable' not in get_scanned_tables(self.get_plan(query))
+
+    def test_user_id(self):
+        query = self.db_session.query(models.Asset).filter_by(user_id=f'user{NB_ASSETS // 2}')
+
+        assert 'asset' not in get_scanned_tables(self.get_plan(query))
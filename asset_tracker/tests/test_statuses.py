@@ -0,0 +1,40 @@
+from asset_tracker import models
+from asset_tracker.statuses import StatusesRegistry
+from asset_tracker.tests import FunctionalTest
+
+
+class Statuses(FunctionalTest):
+    @staticmethod
+    def add_status(request, status_id, position):
+        status = models.EventStatus(status_id=status_id, position=position, status_type='event', _label=status_id)
+        request.db_session.add(status)
+        request.db_session.commit()
+
+    def test_get(self):
+        request = self.dummy_request()
+        self.add_status(request, 'stock_parsys', 1)
+
+        statuses = StatusesRegistry(reload_interval=60)
+        status = statuses.get(request.db_session, 'stock_parsys')
+        assert status.status_id == 'stock_parsys'
+        assert status in request.db_session
+        assert statuses.get(request.db_session, 'unknown') is None
+
+        # Unknown statuses don't reload the registry until the interval has elapsed.
+        self.add_status(request, 'service', 2)
+        assert statuses.get(request.db_session, 'service') is None
+
+        statuses.reload_interval = 0
+        assert statuses.get(request.db_session, 'service').status_id == 'service'
+
+    def test_unknown_status_reloads(self):
+        request = self.dummy_request()
+        self.add_status(request, 'stock_parsys', 1)
+
+        statuses = StatusesRegistry(reload_interval=60)
+        statuses.load(request.db_session)
+        loaded_at = statuses.loaded_at
+
+        for status_id in ['bogus_1', 'bogus_2', 'bogus_3']:
+            assert statuses.get(request.db_session, status_id) is None
+        assert statuses.loaded_at == loaded_at
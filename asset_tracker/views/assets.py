@@ -20,6 +20,7 @@ from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 
 from asset_tracker import models
+from asset_tracker.configs import release_config
 from asset_tracker.constants import ASSET_TYPES, CALIBRATION_FREQUENCIES_YEARS
 from asset_tracker.views import FormException, read_form
 
@@ -116,7 +117,7 @@ class Assets(metaclass=AuthenticatedEndpoint):
             creator_id=self.request.user.id,
             creator_alias=self.request.user.alias,
             date=event_date,
-            status=self.request.db_session.query(models.EventStatus).filter_by(status_id=self.form['event']).one(),
+            status=self.request.get_status(self.form['event']),
         )
         self.asset.add_event(event)
         self.request.db_session.add(event)
@@ -131,7 +132,7 @@ class Assets(metaclass=AuthenticatedEndpoint):
             creator_id=self.request.user.id,
             creator_alias=self.request.user.alias,
             date=date.today(),
-            status=self.request.db_session.query(models.EventStatus).filter_by(status_id='site_change').one(),
+            status=self.request.get_status('site_change'),
         )
 
         if new_site_id:
@@ -139,7 +140,8 @@ class Assets(metaclass=AuthenticatedEndpoint):
                 .filter(models.Site.id == new_site_id) \
                 .join(models.Site.tenant) \
                 .one()
-            event.extra = json.dumps({'site_id': new_site.site_id, 'tenant_id': new_site.tenant.tenant_id})
+            event.new_site_id = new_site.site_id
+            event.new_tenant_id = new_site.tenant.tenant_id
 
         self.asset.add_event(event)
         self.request.db_session.add(event)
@@ -191,23 +193,7 @@ class Assets(metaclass=AuthenticatedEndpoint):
         if not self.asset.id:
             return
 
-        software_updates = self.asset.history('desc') \
-            .join(models.Event.status) \
-            .filter(models.EventStatus.status_id == 'software_update')
-
-        softwares = {}
-        for event in software_updates:
-            extra = event.extra_json
-            try:
-                name, version = extra['software_name'], extra['software_version']
-            except KeyError as error:
-                capture_exception(error)
-                continue
-            else:
-                if name not in softwares:
-                    softwares[name] = version
-
-        return softwares
+        return {software.product: software.version for software in self.asset.softwares}
 
     def get_last_config(self):
         """Get last version of configuration updates."""
@@ -216,7 +202,7 @@ class Assets(metaclass=AuthenticatedEndpoint):
             .filter(models.EventStatus.status_id == 'config_update') \
             .first()
         if last_config:
-            return last_config.extra_json.get('config')
+            return last_config.config_file_id
 
     def get_site_data(self):
         """Get all sites. Sites will be filtered according to selected tenant in
@@ -244,6 +230,16 @@ class Assets(metaclass=AuthenticatedEndpoint):
             event.remover_id = self.request.user.id
             event.remover_alias = self.request.user.alias
 
+            # The configuration of a removed event isn't needed anymore.
+            if event.config_file_id:
+                release_config(self.request.db_session, event.config_file_id)
+                event.config_file_id = None
+
+        # Milestones dates, software versions and configuration can't be updated incrementally when events are removed.
+        self.asset.update_dates()
+        self.asset.update_softwares()
+        self.asset.update_config_hash()
+
     @staticmethod
     def update_calibration_next(asset):
         """Update next calibration date according to functional rules."""
@@ -331,7 +327,7 @@ class Assets(metaclass=AuthenticatedEndpoint):
     def validate_events(self):
         """Validate events data."""
         if self.form.get('event'):
-            status = self.request.db_session.query(models.EventStatus).filter_by(status_id=self.form['event']).one()
+            status = self.request.get_status(self.form['event'])
             if not status:
                 raise FormException(_('Invalid asset status.'))
 
@@ -390,7 +386,7 @@ class Assets(metaclass=AuthenticatedEndpoint):
             mac_wifi=self.form.get('mac_wifi'),
             notes=self.form.get('notes'),
             site_id=self.form.get('site_id'),
-            status=self.request.db_session.query(models.EventStatus).filter_by(status_id='stock_parsys').one(),
+            status=self.request.get_status('stock_parsys'),
             tenant=self.request.db_session.query(models.Tenant).filter_by(tenant_id=self.form['tenant_id']).one(),
         )
         # Marlink has only one calibration frequency, so they don't want to see the input.
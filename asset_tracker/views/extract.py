@@ -1,17 +1,22 @@
 """Asset tracker views: assets lists and read/update."""
 
-import json
+import csv
+import io
 from datetime import date
+from itertools import islice
 
 from parsys_utilities import ADMIN_PRINCIPAL
 from parsys_utilities.sql import windowed_query
+from pyramid.response import Response
 from pyramid.security import Allow
 from pyramid.view import view_config
 from sqlalchemy import func
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 
 from asset_tracker import models
 
+# Assets queried (and rows sent) at a time.
+EXTRACT_WINDOW_SIZE = 100
 MAX_CONSUMABLES = 7
 MAX_SOFTWARES = 2
 
@@ -86,34 +91,51 @@ class AssetsExtract:
 
         return asset_columns + equipment_columns
 
-    def get_csv_rows(self, max_equipments_per_asset):
-        """Get the asset information for the csv file.
+    @staticmethod
+    def get_max_equipments(db_session):
+        """Get the maximum number of equipments of an asset, which sets the number of columns of the csv file.
 
         Args:
-            max_equipments_per_asset (int): maximum number of equipment.
+            db_session (sqlalchemy.orm.session.Session).
 
         Returns:
-            csv body (list): information on the assets.
+            int.
+        """
+        equipments_counts = db_session.query(func.count(models.Equipment.id).label('equipments_count')) \
+            .filter(models.Equipment.asset_id.is_not(None)) \
+            .group_by(models.Equipment.asset_id) \
+            .subquery()
+        return db_session.query(func.max(equipments_counts.c.equipments_count)).scalar() or 0
+
+    def get_csv_rows(self, db_session, max_equipments_per_asset):
+        """Get the asset information for the csv file, window by window.
+
+        Args:
+            db_session (sqlalchemy.orm.session.Session).
+            max_equipments_per_asset (int): maximum number of equipment.
+
+        Yields:
+            list: information on an asset.
         """
         config = self.request.registry.settings.get('asset_tracker.config', 'parsys')
-        last_event = self.request.db_session.query(func.max(models.Event.created_at)) \
+        last_event = db_session.query(func.max(models.Event.created_at)) \
             .join(models.Event.status) \
             .filter(
                 models.Event.asset_id == models.Asset.id,
                 models.EventStatus.status_type == 'event',
             ) \
             .scalar_subquery()
-        medcapture_version = self.request.db_session.query(models.Event.extra) \
+        medcapture_version = db_session.query(models.Event.software_version) \
             .join(models.Event.status) \
             .filter(
                 models.Event.asset_id == models.Asset.id,
                 models.EventStatus.status_id == 'software_update',
-                models.Event.extra.ilike('%"medcapture"%'),
+                models.Event.software_name == 'medcapture',
             ) \
             .order_by(models.Event.created_at.desc()) \
             .limit(1) \
             .scalar_subquery()
-        assets = self.request.db_session.query(models.Asset, last_event, medcapture_version) \
+        assets = db_session.query(models.Asset, last_event, medcapture_version) \
             .options(
                 joinedload(models.Asset.tenant),
                 joinedload(models.Asset.site),
@@ -121,97 +143,160 @@ class AssetsExtract:
             ) \
             .order_by(models.Asset.asset_id)
 
-        rows = []
-        for asset, last_event, medcapture_version in windowed_query(assets, models.Asset.asset_id, 100):
-            # Asset information.
-            row = [
-                asset.asset_id,
-                asset.asset_type,
-                asset.tenant.tenant_id,
-                asset.tenant.name,
-                asset.customer_name,
-                asset.customer_id,
-                asset.current_location,
-                asset.calibration_frequency,
-                asset.status.label(config),
-                last_event,
-                json.loads(medcapture_version)['software_version'] if medcapture_version else None,
-                asset.notes,
-                asset.production,
-                asset.delivery,
-                asset.activation,
-                asset.calibration_last,
-                asset.calibration_next,
-                asset.warranty_end,
-            ]
+        rows = windowed_query(assets, models.Asset.asset_id, EXTRACT_WINDOW_SIZE)
+        while window := list(islice(rows, EXTRACT_WINDOW_SIZE)):
+            equipments = self.load_equipments(db_session, [asset.id for asset, *_ in window])
+            for asset, last_event, medcapture_version in window:
+                yield self.get_csv_row(
+                    asset,
+                    last_event,
+                    medcapture_version,
+                    equipments.get(asset.id, []),
+                    config,
+                    max_equipments_per_asset,
+                )
 
-            # Site information.
-            if asset.site:
-                row += [
-                    asset.site.name,
-                    asset.site.site_type,
-                    asset.site.contact,
-                    asset.site.phone,
-                    asset.site.email,
-                ]
-            else:
-                # Fill with None values to maintain column alignment.
-                row += [None, None, None, None, None]
-
-            # Equipments information.
-            equipments = self.request.db_session.query(models.Equipment) \
-                .options(
-                    joinedload(models.Equipment.family),
-                    joinedload(models.Equipment.consumables).joinedload(models.Consumable.family),
-                ) \
-                .filter(models.Equipment.asset_id == asset.id) \
-                .all()
-
-            for equipment in equipments:
-                empty_consumables_count = MAX_CONSUMABLES - len(equipment.consumables)
-                consumables = [(c.family.model, c.expiration_date) for c in equipment.consumables]
-                row += [
-                    equipment.family.model,
-                    equipment.serial_number,
-                    *[element for consumable in consumables for element in consumable],
-                    *[None for _i in range(empty_consumables_count * 2)],
-                ]
+    @staticmethod
+    def load_equipments(db_session, assets_ids):
+        """Load the equipments of several assets, with their consumables and families, in a fixed number of queries.
 
-            empty_equipment_count = max_equipments_per_asset - len(equipments)
-            for _ in range(empty_equipment_count):
-                # Fill with None values to maintain column alignment.
-                row += [None, None]
-                for _ in range(MAX_CONSUMABLES):
-                    row += [None, None]
+        Args:
+            db_session (sqlalchemy.orm.session.Session).
+            assets_ids (list): assets primary keys.
 
-            rows.append(row)
+        Returns:
+            dict: asset primary key => equipments (list).
+        """
+        equipments = db_session.query(models.Equipment) \
+            .options(
+                joinedload(models.Equipment.family),
+                selectinload(models.Equipment.consumables).joinedload(models.Consumable.family),
+            ) \
+            .filter(models.Equipment.asset_id.in_(assets_ids)) \
+            .order_by(models.Equipment.id)
 
-        return rows
+        assets_equipments = {}
+        for equipment in equipments:
+            assets_equipments.setdefault(equipment.asset_id, []).append(equipment)
+        return assets_equipments
 
-    @view_config(route_name='assets-extract', request_method='GET', permission='assets-extract', renderer='csv')
-    def extract_get(self):
-        """Download Asset data. Write Asset information in csv file.
+    @staticmethod
+    def get_csv_row(asset, last_event, medcapture_version, equipments, config, max_equipments_per_asset):
+        """Get the information of an asset for the csv file.
+
+        Args:
+            asset (asset_tracker.models.Asset): with its tenant, site and status loaded.
+            last_event (datetime.datetime): creation date of the asset last event.
+            medcapture_version (str).
+            equipments (list): asset equipments, see load_equipments.
+            config (str).
+            max_equipments_per_asset (int): maximum number of equipment.
 
         Returns:
-            (dict): header (list) and rows (list) of csv file.
+            list.
         """
-        # Find maximum number of equipments per asset.
-        asset_with_most_equipments = self.request.db_session.query(models.Asset) \
-            .join(models.Asset.equipments) \
-            .group_by(models.Asset.id) \
-            .order_by(func.count(models.Asset.equipments).desc()) \
-            .first()
+        # Asset information.
+        row = [
+            asset.asset_id,
+            asset.asset_type,
+            asset.tenant.tenant_id,
+            asset.tenant.name,
+            asset.customer_name,
+            asset.customer_id,
+            asset.current_location,
+            asset.calibration_frequency,
+            asset.status.label(config),
+            last_event,
+            medcapture_version,
+            asset.notes,
+            asset.production,
+            asset.delivery,
+            asset.activation,
+            asset.calibration_last,
+            asset.calibration_next,
+            asset.warranty_end,
+        ]
 
-        max_equipments = len(asset_with_most_equipments.equipments) if asset_with_most_equipments else 0
+        # Site information.
+        if asset.site:
+            row += [
+                asset.site.name,
+                asset.site.site_type,
+                asset.site.contact,
+                asset.site.phone,
+                asset.site.email,
+            ]
+        else:
+            # Fill with None values to maintain column alignment.
+            row += [None, None, None, None, None]
+
+        # Equipments information.
+        for equipment in equipments:
+            empty_consumables_count = MAX_CONSUMABLES - len(equipment.consumables)
+            consumables = [(c.family.model, c.expiration_date) for c in equipment.consumables]
+            row += [
+                equipment.family.model,
+                equipment.serial_number,
+                *[element for consumable in consumables for element in consumable],
+                *[None for _i in range(empty_consumables_count * 2)],
+            ]
 
-        # Override attributes of response.
-        filename = f'{date.today():%Y%m%d}_assets.csv'
-        self.request.response.content_disposition = f'attachment;filename={filename}'
+        empty_equipment_count = max_equipments_per_asset - len(equipments)
+        for _ in range(empty_equipment_count):
+            # Fill with None values to maintain column alignment.
+            row += [None, None]
+            for _ in range(MAX_CONSUMABLES):
+                row += [None, None]
+
+        return row
+
+    def iter_csv(self):
+        """Write the csv file chunk by chunk, so that memory use doesn't depend on the number of assets.
+
+        The response is sent after the request transaction has ended: the header and the rows are read in their own
+        session, in one snapshot on PostgreSQL, so that the header width matches all the rows.
+
+        Yields:
+            bytes: csv chunk.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
 
-        return {
-            'header': self.get_csv_header(max_equipments),
-            'rows': self.get_csv_rows(max_equipments),
-        }
+        def get_chunk():
+            chunk = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        with self.request.registry['db_session_factory']() as db_session:
+            if db_session.get_bind().dialect.name == 'postgresql':
+                db_session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+            max_equipments = self.get_max_equipments(db_session)
+            writer.writerow(self.get_csv_header(max_equipments))
+            yield get_chunk()
+
+            for index, row in enumerate(self.get_csv_rows(db_session, max_equipments), start=1):
+                writer.writerow(row)
+                if index % EXTRACT_WINDOW_SIZE == 0:
+                    yield get_chunk()
+
+        yield get_chunk()
+
+    @view_config(route_name='assets-extract', request_method='GET', permission='assets-extract')
+    def extract_get(self):
+        """Download Asset data. Write Asset information in csv file, streamed as it is written.
+
+        Returns:
+            pyramid.response.Response.
+        """
+        filename = f'{date.today():%Y%m%d}_assets.csv'
+        return Response(
+            app_iter=self.iter_csv(),
+            content_disposition=f'attachment;filename={filename}',
+            content_type='text/csv',
+            charset='utf-8',
+        )
 
 
 def includeme(config):
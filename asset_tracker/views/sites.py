@@ -54,13 +54,12 @@ class Sites(metaclass=AuthenticatedEndpoint):
         past_assets = []
 
         # Get all assets who have ever been on a site (this includes current assets).
-        # site_id is stored in models.Event.extra in JSON. Filtering gets complicated.
         # noinspection PyProtectedMember
         assets_ever_on_site = self.request.db_session.query(models.Asset) \
             .join(models.Asset._history) \
             .join(models.Event.status) \
             .filter(
-                models.Event.extra.ilike(f'%"site_id": "{self.site.site_id}"%'),
+                models.Event.new_site_id == self.site.site_id,
                 models.EventStatus.status_id == 'site_change',
             )
 
@@ -78,7 +77,7 @@ class Sites(metaclass=AuthenticatedEndpoint):
                 if index == 0:
                     continue
 
-                if site_changes[index - 1].extra_json.get('site_id') == self.site.site_id:
+                if site_changes[index - 1].new_site_id == self.site.site_id:
                     past_assets.append({
                         'asset_id': asset.asset_id,
                         'asset_type': asset.asset_type,